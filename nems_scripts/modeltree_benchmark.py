@@ -0,0 +1,112 @@
+"""Compares the time taken to parse a modeltree string by
+nems_web.nems_analysis.ModelFinder.parse_modeltree and by the replace and
+ast.literal_eval parser it replaced, and checks that both give the same
+nested list.
+
+Can be run through the custom script interface, which parses the modeltree
+of every analysis for the selected batch, or from the command line
+with a modeltree string:
+    python -m nems_scripts.modeltree_benchmark "['a', {'b', 'c'}]"
+
+"""
+
+import ast
+import re
+import sys
+import timeit
+
+from nems_db.db import Session, NarfAnalysis
+from nems_web.nems_analysis.ModelFinder import parse_modeltree
+
+
+def legacy_nested_list(modelstring):
+    """The replace and ast.literal_eval parser used before
+    parse_modeltree.
+
+    """
+
+    s = modelstring.replace('{', '[')
+    s = s.replace('}', ']')
+    s = s.replace(" ","")
+    s = s.replace('],]',']]')
+    s = s.replace('  ',' ')
+    s = s.replace("]'","],'")
+    s = s.replace("][","],[")
+    s = s.replace("'[","',[")
+
+    # Insert comma between adjacent quotation marks unless it's an empty
+    # string
+    r = re.compile(r"(?P<ONE>\w)''(?P<TWO>\w)")
+    s = r.sub(r"\g<ONE>','\g<TWO>", s)
+    # Insert comma between empty string and regular string (empty first)
+    r = re.compile(r"(?P<ONE>'')(?P<TWO>'\w)")
+    s = r.sub(r"\g<ONE>,\g<TWO>", s)
+    # Insert comma between empty string and regular string (empty second)
+    r = re.compile(r"(?P<ONE>'\w)(?P<TWO>'')")
+    s = r.sub(r"\g<ONE>,\g<TWO>", s)
+
+    return ast.literal_eval(s)
+
+
+def benchmark_parsers(modelstring, number=1000):
+    """Returns a dict with the average number of seconds taken to parse
+    modelstring by parse_modeltree ('parser') and by legacy_nested_list
+    ('legacy'), and whether the two produced the same nested list.
+
+    """
+
+    same = (parse_modeltree(modelstring) == legacy_nested_list(modelstring))
+    return {
+            'parser': timeit.timeit(
+                    lambda: parse_modeltree(modelstring), number=number,
+                    )/number,
+            'legacy': timeit.timeit(
+                    lambda: legacy_nested_list(modelstring), number=number,
+                    )/number,
+            'same': same,
+            }
+
+
+def run_script(argsdict):
+    """Times both parsers on the modeltree of the analysis for the selected
+    batch (see demo_script for the contents of argsdict) and returns the
+    results as html.
+    """
+
+    session = Session()
+    analyses = (
+            session.query(NarfAnalysis.name, NarfAnalysis.modeltree)
+            .filter(NarfAnalysis.batch.startswith(argsdict['batch']))
+            .all()
+            )
+    session.close()
+
+    rows = []
+    for name, modeltree in analyses:
+        if not modeltree:
+            continue
+        try:
+            times = benchmark_parsers(modeltree, number=100)
+        except (ValueError, SyntaxError) as e:
+            rows.append("<tr><td>{0}</td><td colspan=3>{1}</td></tr>"
+                        .format(name, e))
+            continue
+        rows.append(
+                "<tr><td>{0}</td><td>{1:.3g}</td><td>{2:.3g}</td>"
+                "<td>{3}</td></tr>"
+                .format(name, times['parser']*1000, times['legacy']*1000,
+                        times['same'])
+                )
+    html = (
+            "<table><tr><th>analysis</th><th>parser (ms)</th>"
+            "<th>legacy (ms)</th><th>same</th></tr>{0}</table>"
+            .format(''.join(rows))
+            )
+    return {'html': html}
+
+
+if __name__ == '__main__':
+    times = benchmark_parsers(sys.argv[1])
+    print("parser: {0:.3g} ms, legacy: {1:.3g} ms, same: {2}"
+          .format(times['parser']*1000, times['legacy']*1000,
+                  times['same']))
@@ -0,0 +1,110 @@
+"""Compares the time taken to find the common prefix and suffix of a list of
+modelnames by nems_web.utilities.pruffix (which compares underscore
+separated keywords) and by the character-by-character loops it replaced.
+
+Can be run through the custom script interface, which times the selected
+models, or from the command line with a list of modelnames:
+    python -m nems_scripts.pruffix_benchmark model_a_x model_b_x ...
+
+"""
+
+import sys
+import timeit
+
+from nems_web.utilities.pruffix import find_prefix, find_suffix
+
+
+def benchmark(s_list, number=100):
+    """Returns a dict with the average number of seconds taken to find the
+    prefix and suffix of s_list by the keyword-based functions ('tokens')
+    and by the character-by-character loops they replaced ('chars').
+    s_list should contain at least two different strings, since the old
+    loops never finish otherwise.
+    """
+
+    return {
+            'tokens': timeit.timeit(
+                    lambda: (find_prefix(s_list), find_suffix(s_list)),
+                    number=number,
+                    )/number,
+            'chars': timeit.timeit(
+                    lambda: (char_prefix(s_list), char_suffix(s_list)),
+                    number=number,
+                    )/number,
+            }
+
+
+# The character-by-character versions of find_prefix and find_suffix.
+def char_prefix(s_list):
+    prefix = ''
+    if (not s_list) or (len(s_list) == 1):
+        return prefix
+    i = 0
+    test = True
+    while test:
+        for j in range(len(s_list) - 1):
+            if i < len(s_list[j]):
+                a = s_list[j][i]
+            else:
+                a = ''
+            if i<len(s_list[j+1]):
+                b = s_list[j + 1][i]
+            else:
+                b = ''
+            if a != b:
+                test = False
+                break
+            if j == len(s_list) - 2:
+                prefix += b
+        i += 1
+
+    while prefix and (prefix[-1] != '_'):
+        prefix = prefix[:-1]
+
+    return prefix
+
+
+def char_suffix(s_list):
+    suffix = ''
+    if (not s_list) or (len(s_list) == 1):
+        return suffix
+    i = 1
+    test = True
+    while test:
+        for j in range(len(s_list) - 1):
+            a = s_list[j][-1 * i]
+            b = s_list[j + 1][-1 * i]
+            if a != b:
+                test = False
+                break
+            if j == len(s_list) - 2:
+                suffix += b
+        i += 1
+    suffix = suffix[::-1]
+    while suffix and (suffix[0] != '_'):
+        suffix = suffix[1:]
+
+    return suffix
+
+
+def run_script(argsdict):
+    """Times both versions on the selected models (see demo_script for the
+    contents of argsdict) and returns the results as html.
+    """
+
+    models = list(set(argsdict['models']))
+    if len(models) < 2:
+        return {'html': "Select at least two different models to compare."}
+    times = benchmark(models)
+    html = (
+            "<p>Prefix and suffix of {0} models, average of 100 runs:</p>"
+            "<p>keywords: {1:.3g} ms<br>characters: {2:.3g} ms</p>"
+            .format(len(models), times['tokens']*1000, times['chars']*1000)
+            )
+    return {'html': html}
+
+
+if __name__ == '__main__':
+    times = benchmark(sys.argv[1:])
+    print("keywords: {0:.3g} ms, characters: {1:.3g} ms"
+          .format(times['tokens']*1000, times['chars']*1000))
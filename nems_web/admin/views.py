@@ -3,11 +3,18 @@ import pkgutil
 import importlib
 import inspect
 
-from flask import url_for, Response, jsonify
+from flask import url_for, Response, jsonify, request
 from flask_login import login_required
 
 from nems_web.nems_analysis import app
 from nems_web.account_management.views import get_current_user
+from nems_web.utilities.cell_quality import invalidate_cell_quality
+from nems_web.nems_analysis.views import batch_cache, search_index_cache
+from nems_web.nems_analysis.AnalysisCatalog import analysis_catalog
+from nems_web.nems_analysis.ModelFinder import invalidate_models
+from nems_web.nems_analysis.ModelIndex import invalidate_model_indexes
+from nems_web.plot_functions.views import plot_cache
+from nems_web.utilities.summary_store import summary_store
 
 import nems_web
 
@@ -94,3 +101,40 @@ def reload_modules():
         importlib.reload(mod)
 
     return jsonify(success=True)
+
+
+@app.route('/clear_caches')
+@login_required
+def clear_caches():
+    """Empties the in-process caches so that the next request reloads
+    everything from the database. Pass batch to only clear that batch.
+
+    """
+
+    user = get_current_user()
+    if user.sec_lvl < 9:
+        return Response("Must have admin privileges to clear caches")
+
+    batch = request.args.get('batch', None)
+    invalidate_cell_quality(batch)
+    batch_cache.invalidate()
+    search_index_cache.invalidate()
+    analysis_catalog.invalidate()
+    invalidate_models()
+    invalidate_model_indexes()
+    plot_cache.invalidate()
+    summary_store.invalidate(batch)
+
+    return jsonify(success=True)
+
+
+@app.route('/cache_stats')
+@login_required
+def cache_stats():
+    """Reports the size and hit/miss counts of the rendered plot cache."""
+
+    user = get_current_user()
+    if user.sec_lvl < 9:
+        return Response("Must have admin privileges to view cache stats")
+
+    return jsonify(plot_cache=plot_cache.stats())
@@ -17,6 +17,7 @@ import matplotlib.pyplot as plt, mpld3
 import numpy as np
 
 from nems_web.nems_analysis import app
+from nems_web.plot_functions.render_service import pyplot_lock
 
 FIGSIZE = (9, 3)  # width, height for matplotlib figures
 mp_stack = None
@@ -209,10 +210,12 @@ def update_modelpane_plot():
         log.info("index was: " + str(i))
         return Response('')
 
-    p = plt.figure(figsize=FIGSIZE)
     plot_fn = getattr(nu, plotType)
-    plot_fn(m)
-    html = mpld3.fig_to_html(p)
+    with pyplot_lock:
+        p = plt.figure(figsize=FIGSIZE)
+        plot_fn(m)
+        html = mpld3.fig_to_html(p)
+        plt.close(p)
 
     return jsonify(html=html)
 
@@ -322,15 +325,21 @@ def re_render_plots(modIdx=1):
 
     global mp_stack
 
+    # The module plot functions draw on the current pyplot figure, so
+    # they can't be sent to the render service. Hold its pyplot lock
+    # instead so that figures drawn by other requests don't interleave.
     stackmods = mp_stack.modules[modIdx:]
     plot_list = []
     for m in stackmods:
         try:
-            p = plt.figure(figsize=FIGSIZE)
-            m.do_plot(m)
-            html = mpld3.fig_to_html(p)
+            with pyplot_lock:
+                p = plt.figure(figsize=FIGSIZE)
+                try:
+                    m.do_plot(m)
+                    html = mpld3.fig_to_html(p)
+                finally:
+                    plt.close(p)
             plot_list.append(html)
-            plt.close(p)
         except Exception as e:
             log.info("Issue with plot for: " + m.name)
             print(e)
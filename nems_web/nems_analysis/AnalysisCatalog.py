@@ -0,0 +1,167 @@
+"""Defines the AnalysisCatalog class, an in-memory copy of the NarfAnalysis
+columns needed to build the analysis, tag and status selectors.
+"""
+import logging
+import threading
+import time
+
+from nems_db.db import NarfAnalysis
+
+log = logging.getLogger(__name__)
+
+# Number of seconds before the whole catalog is reloaded from the database,
+# to pick up changes made outside of this process.
+CATALOG_TTL = 300
+
+
+class AnalysisCatalog():
+    """Keeps the name, status, tags and permission columns of every
+    NarfAnalysis entry in memory, along with the tag and status lists for
+    each visibility class of user that has asked for them.
+
+    The catalog is loaded from the database on first use and after
+    CATALOG_TTL seconds. In between, the Analysis Editor view functions
+    should call update() or remove() after committing a change so that
+    only the affected entry is refreshed.
+
+    A visibility class is either 'all' (for superusers) or a
+    (labgroup, username) pair, and matches the permission filter used by
+    the view functions: an analysis is visible if it is public, if its
+    labgroup contains the user's labgroup, or if it belongs to the user.
+
+    """
+
+    def __init__(self, ttl=CATALOG_TTL):
+        self.ttl = ttl
+        self._rows = None
+        self._loaded = 0
+        # visibility class : (analyses, taglist, statuslist)
+        self._views = {}
+        self._lock = threading.RLock()
+
+    def load(self, session):
+        """Reload every NarfAnalysis entry with a single query."""
+        analyses = (
+                session.query(
+                        NarfAnalysis.id, NarfAnalysis.name,
+                        NarfAnalysis.status, NarfAnalysis.tags,
+                        NarfAnalysis.public, NarfAnalysis.labgroup,
+                        NarfAnalysis.username,
+                        )
+                .all()
+                )
+        rows = {a.id: self._to_row(a) for a in analyses}
+        with self._lock:
+            self._rows = rows
+            self._loaded = time.time()
+            self._views = {}
+        log.debug("Loaded {0} analyses into catalog".format(len(rows)))
+
+    def update(self, analysis):
+        """Add or replace the entry for a NarfAnalysis object."""
+        row = self._to_row(analysis)
+        with self._lock:
+            if self._rows is None:
+                return
+            self._rows[analysis.id] = row
+            self._views = {}
+
+    def remove(self, id):
+        """Remove the entry for analysis id, if it's in the catalog."""
+        with self._lock:
+            if self._rows is None:
+                return
+            self._rows.pop(int(id), None)
+            self._views = {}
+
+    def invalidate(self):
+        """Force a full reload on the next request."""
+        with self._lock:
+            self._rows = None
+            self._views = {}
+
+    def analyses(self, session, user, superuser=False):
+        """Returns a list of (id, name) tuples, sorted by id, for every
+        analysis that user is allowed to see.
+
+        """
+
+        return self._view(session, user, superuser)[0]
+
+    def taglist(self, session, user, superuser=False):
+        """Returns the sorted, de-duplicated list of tags used by the
+        analyses that user is allowed to see.
+
+        """
+
+        return self._view(session, user, superuser)[1]
+
+    def statuslist(self, session, user, superuser=False):
+        """Returns the distinct statuses of the analyses that user is
+        allowed to see.
+
+        """
+
+        return self._view(session, user, superuser)[2]
+
+    def _view(self, session, user, superuser):
+        with self._lock:
+            expired = (
+                    (self._rows is None)
+                    or (time.time() - self._loaded > self.ttl)
+                    )
+        if expired:
+            self.load(session)
+
+        if superuser:
+            key = 'all'
+        else:
+            key = (str(user.labgroup), str(user.username))
+        with self._lock:
+            view = self._views.get(key, None)
+            if view is None:
+                view = self._build_view(key)
+                self._views[key] = view
+            return view
+
+    def _build_view(self, key):
+        if key == 'all':
+            rows = list(self._rows.values())
+        else:
+            labgroup = key[0].lower()
+            username = key[1]
+            rows = [
+                    r for r in self._rows.values()
+                    if r['public']
+                    or (r['labgroup'] is not None
+                        and labgroup in r['labgroup'].lower())
+                    or (r['username'] == username)
+                    ]
+        rows.sort(key=lambda r: r['id'])
+
+        analyses = [(r['id'], r['name']) for r in rows]
+        taglist = sorted(set(t for r in rows for t in r['tags']))
+        statuslist = []
+        for r in rows:
+            if (r['status'] is not None) and (r['status'] not in statuslist):
+                statuslist.append(r['status'])
+
+        return (analyses, taglist, statuslist)
+
+    def _to_row(self, analysis):
+        # Split tags into a list of strings, removing leading and trailing
+        # whitespace and blank tags.
+        tags = analysis.tags.split(',') if analysis.tags else []
+        tags = [t.strip() for t in tags]
+        return {
+                'id': analysis.id,
+                'name': analysis.name,
+                'status': analysis.status,
+                'tags': [t for t in tags if t != ''],
+                'public': str(analysis.public) in ('1', 'True'),
+                'labgroup': analysis.labgroup,
+                'username': analysis.username,
+                }
+
+
+analysis_catalog = AnalysisCatalog()
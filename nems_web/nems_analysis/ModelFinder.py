@@ -1,26 +1,197 @@
 """Defines the ModelFinder class, used for parsing modeltree strings."""
 import logging
-import ast
-import re
+import sys
+import hashlib
+
+from nems_web.utilities.cache import LRUCache
 
 log = logging.getLogger(__name__)
 
+# Approximate upper bound, in bytes, on the memory used by cached model lists.
+MODELLIST_CACHE_BYTES = 32*1024*1024
+
+
+def _modellist_size(modellist):
+    return sys.getsizeof(modellist) + sum(sys.getsizeof(m) for m in modellist)
+
+
+_modellist_cache = LRUCache(
+        maxbytes=MODELLIST_CACHE_BYTES,
+        sizeof=lambda entry: _modellist_size(entry[0]),
+        )
+
+
+def tree_key(modelstring):
+    """Returns the hash used to identify a modeltree string in caches."""
+    return hashlib.sha1(modelstring.encode('utf-8')).hexdigest()
+
+
+def find_models(modelstring, offset=0, limit=None):
+    """Returns a 2-tuple containing:
+        index 0, the list of modelnames for a modeltree string, starting at
+            offset and including at most limit names (or all of the
+            remaining names if limit is None).
+        index 1, the total number of modelnames in the tree.
+    Each page is only expanded if it isn't already cached.
+
+    """
+
+    if modelstring is None:
+        modelstring = ''
+
+    def expand():
+        mf = ModelFinder(modelstring)
+        return (mf.page(offset, limit), mf.count)
+
+    modellist, count = _modellist_cache.get_or_load(
+            (tree_key(modelstring), offset, limit), expand,
+            )
+    # Copy so that callers can't modify the cached list.
+    return (list(modellist), count)
+
+
+def invalidate_models(modelstring=None):
+    """Removes the cached model lists for modelstring, or every cached list
+    if modelstring is None.
+
+    """
+
+    if modelstring is None:
+        _modellist_cache.invalidate()
+    else:
+        key = tree_key(modelstring)
+        _modellist_cache.invalidate_where(lambda k: k[0] == key)
+
+
+class ModelTreeSyntaxError(ValueError):
+    """Raised by parse_modeltree when a modeltree string can't be parsed.
+    pos is the index of the character in modelstring where parsing failed.
+
+    """
+
+    def __init__(self, message, modelstring, pos):
+        self.message = message
+        self.modelstring = modelstring
+        self.pos = pos
+        # Show the line containing the error with a marker underneath.
+        line_start = modelstring.rfind('\n', 0, pos) + 1
+        line_end = modelstring.find('\n', pos)
+        if line_end == -1:
+            line_end = len(modelstring)
+        line = modelstring[line_start:line_end]
+        column = pos - line_start
+        super().__init__(
+                "{0} at position {1}:\n{2}\n{3}^"
+                .format(message, pos, line, ' '*column)
+                )
+
+
+_OPEN = '{['
+_CLOSE = '}]'
+_QUOTES = '\'"'
+
+
+def parse_modeltree(modelstring):
+    """Parse a modeltree string, ex: {'an','example',{'tree','string'}},
+    into the equivalent nested list of strings in a single pass.
+
+    Either {} or [] can be used for brackets, and strings can use single or
+    double quotes. Commas between items are optional, and a trailing comma
+    before a closing bracket is allowed. Spaces inside strings are removed.
+
+    Raises ModelTreeSyntaxError with the position of the first problem if
+    the string isn't a valid tree.
+
+    """
+
+    return _TreeParser(modelstring).parse()
+
+
+class _TreeParser():
+    """Recursive-descent parser used by parse_modeltree."""
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+
+    def error(self, message, pos=None):
+        if pos is None:
+            pos = self.pos
+        raise ModelTreeSyntaxError(message, self.text, pos)
+
+    def skip_space(self):
+        text = self.text
+        while (self.pos < len(text)) and text[self.pos].isspace():
+            self.pos += 1
+
+    def parse(self):
+        self.skip_space()
+        if self.pos >= len(self.text):
+            self.error("Empty modeltree")
+        if self.text[self.pos] not in _OPEN:
+            self.error("Modeltree must start with '{'")
+        tree = self.parse_list()
+        self.skip_space()
+        if self.pos < len(self.text):
+            self.error("Unexpected text after end of modeltree")
+        return tree
+
+    def parse_list(self):
+        start = self.pos
+        self.pos += 1
+        items = []
+        comma = False
+        while True:
+            self.skip_space()
+            if self.pos >= len(self.text):
+                self.error("Bracket is never closed", start)
+            c = self.text[self.pos]
+            if c in _CLOSE:
+                # Either closing bracket is accepted since older trees
+                # weren't checked for matching pairs.
+                self.pos += 1
+                return items
+            elif c == ',':
+                if comma or not items:
+                    self.error("Unexpected ','")
+                comma = True
+                self.pos += 1
+                continue
+            elif c in _OPEN:
+                items.append(self.parse_list())
+            elif c in _QUOTES:
+                items.append(self.parse_string())
+            else:
+                self.error("Unexpected character {0!r}".format(c))
+            comma = False
+
+    def parse_string(self):
+        start = self.pos
+        quote = self.text[start]
+        end = self.text.find(quote, start + 1)
+        if end == -1:
+            self.error("String is never closed", start)
+        self.pos = end + 1
+        # Spaces were always stripped from keywords by the old parser.
+        return self.text[start+1:end].replace(' ', '')
+
+
 class ModelFinder():
     """Converts a modeltree string from NarfAnalysis into a list of modelnames.
-    
+
     Invokes a series of internal methods on any modeltree string passed to
     its constructor.
-    First, string_to_nested_list cleans up the string to match the syntax for
-        nested python lists, and interprets the string as a list using
-        ast.literal_eval.
-    Then, traverse_nested recursively finds all combinations of the strings
-        (i.e. 'keywords') inside the lists and stores them in self.comboArray.
-    Finally, array_to_list converts each list of strings contained in
-        self.comboArray into a string concatenation of the list separated
-        with underscores, and stores a list of the strings in self.modellist.
-    self.modellist is ultimately used by the update_models view function in
-        nems_analysis.views.
-    
+    First, string_to_nested_list parses the string into a nested list with
+        parse_modeltree, raising ModelTreeSyntaxError if it isn't valid.
+    Then, nested_to_positions converts the nested list into one list of
+        keyword alternatives for each position in the modelname, and stores
+        it in self.positions.
+    Modelnames are never all built at once. self.count is the number of
+    combinations (the product of the number of alternatives at each
+    position), iter_models yields modelnames one at a time starting from
+    any offset, and page returns a list of up to limit modelnames.
+    self.modellist builds the full list and is kept for older callers.
+
     Arguments:
     ----------
     modelstring : string
@@ -32,108 +203,98 @@ class ModelFinder():
     Narf_Analysis : rebuild_model_tree, keyword_combos
 
     """
-    
+
     def __init__(self, modelstring=''):
         self.modelstring = modelstring
-        # As soon as modelstring is passed, go ahead and 
-        # parse the string into an array then to a list so that
-        # self.modellist attribute can be retrieved by nemsweb.py
         self.nestedlist = self.string_to_nested_list()
-        self.comboArray = []
-        self.traverse_nested(self.nestedlist, [])
-        self.modellist = self.array_to_list(self.comboArray)
-        
-    def string_to_nested_list(self):      
-        """Clean up the modeltree string.
-        
-        Replace curly braces with brackets, remove whitespace, add/remove
-        commas or excess brackets, fix other syntax issues as they come up.
-        Then use ast.literal_eval to interpret the (hopefully) syntactically
-        valid string as a nested list.
-        
+        self.positions = self.nested_to_positions(self.nestedlist)
+        if self.positions is None:
+            self.count = 0
+        else:
+            self.count = 1
+            for alternatives in self.positions:
+                self.count *= len(alternatives)
+
+    @property
+    def modellist(self):
+        return list(self.iter_models())
+
+    def page(self, offset=0, limit=None):
+        """Returns a list of up to limit modelnames starting at offset."""
+        return list(self.iter_models(offset, limit))
+
+    def iter_models(self, offset=0, limit=None):
+        """Yields modelnames in the order they appear in the tree, starting
+        with the combination at index offset and stopping after limit names
+        (or at the end of the tree if limit is None).
+
         """
-        
-        # TODO: May not be a complete list of fixes - have been playing
-        # whack-a-mole with syntax errors so far. ast.literal_eval is 
-        # very picky about commas, brackets etc, but still seems more 
-        # efficient than writing a new function for evaluating the string.
-        # If a modelstring is found that won't work with this, 
-        # chances are another s.replace(...) is needed to fix
-        # some syntax error.
-        s = self.modelstring.replace('{', '[')
-        s = s.replace('}', ']')
-        s = s.replace(" ","")
-        s = s.replace('],]',']]')
-        s = s.replace('  ',' ')
-        s = s.replace("]'","],'")
-        s = s.replace("][","],[")
-        s = s.replace("'[","',[")
-        
-        # Insert comma between adjacent quotation marks unless it's an empty
-        # string
-        r = re.compile(r"(?P<ONE>\w)''(?P<TWO>\w)")
-        s = r.sub("\g<ONE>','\g<TWO>", s)
-        # Insert comma between empty string and regular string (empty first)
-        r = re.compile(r"(?P<ONE>'')(?P<TWO>'\w)")
-        s = r.sub("\g<ONE>,\g<TWO>", s)
-        # Insert comma between empty string and regular string (empty second)
-        r = re.compile(r"(?P<ONE>'\w)(?P<TWO>'')")
-        s = r.sub("\g<ONE>,\g<TWO>", s)
-        
-        try:
-            nestedlist = ast.literal_eval(s)
-        except (ValueError, SyntaxError):
-            print(
-                """
-                \n\n ast.literal_eval has issues with the string format for 
-                this modeltree:\n\n
-                %s\n\n
-                Or modelstring was not present in NarfAnalysis
-                """%self.modelstring
-                )
-            return ([
-                'ast', 'eval', 'did', 'not', 'work', 'for', 'this',
-                'analysis', 'or', 'model', 'string', 'not', 'present',
-                ])
-            
-        return nestedlist
-        
-    def traverse_nested(self, nestedlist, path):
-        """Recursively form an array of all combinations of strings
-        (or lists of strings) contained in a nested list.
-        
+
+        offset = max(0, offset)
+        if offset >= self.count:
+            return
+        remaining = self.count - offset
+        if limit is not None:
+            remaining = min(remaining, max(0, limit))
+
+        # Decode offset into one alternative index per position, with the
+        # last position changing fastest.
+        positions = self.positions
+        index = [0]*len(positions)
+        rest = offset
+        for p in reversed(range(len(positions))):
+            rest, index[p] = divmod(rest, len(positions[p]))
+
+        for _ in range(remaining):
+            keywords = [k for p, i in enumerate(index) for k in positions[p][i]]
+            # Ignore blank strings when joining underscores
+            yield '_'.join(filter(None, keywords))
+            # Advance to the next combination
+            for p in reversed(range(len(positions))):
+                index[p] += 1
+                if index[p] < len(positions[p]):
+                    break
+                index[p] = 0
+
+    def string_to_nested_list(self):
+        """Parse the modeltree string into a nested list with
+        parse_modeltree.
+
+        Raises ModelTreeSyntaxError if the string isn't a valid tree.
+
         """
-        
-        # If nestedList is empty, recursion reached a 'leaf.'
-        if len(nestedlist) == 0:
-            self.comboArray.append(path)
-        elif type(nestedlist) is list:
-            head = nestedlist[0]
-            tail = nestedlist[1:]
-            # If first element of nestedList is a string, append and move on.
-            if type(head) is str:
-                self.traverse_nested(tail, (path+[head]) )
-            # If it's a list, iteratively append each item to a new path
-            # and traverse the rest of the list on each path
-            elif type(head) is list:
-                for l in range(len(head)):
-                    if type(head[l]) is list:
-                        self.traverse_nested(tail,path+head[l])
-                    elif type(head[l]) is str:
-                        self.traverse_nested(tail,path+[head[l]])
-        # If nestedList isn't a list, something didn't work right.
-        else:
-            # TODO: Need some kind of error here?
-            pass
-        
-        return
-    
-    def array_to_list(self,array):
-        """Parse each list of strings in self.comboArray into a string
-        concatenation of the list separated by underscores.
-        
+
+        return parse_modeltree(self.modelstring)
+
+    def nested_to_positions(self, nestedlist):
+        """Convert a nested list into a list with one entry per position in
+        the modelname, each a list of tuples of the keywords that can be
+        used at that position.
+
+        A string adds a position with a single alternative, and a list adds
+        a position with one alternative per item, where a list item is a
+        sequence of keywords used together. Returns None if the tree can't
+        produce any modelnames.
+
         """
-        # Ignore blank strings when joining underscores
-        models = ['_'.join(filter(None,c)) for c in self.comboArray]
-        
-        return models
+
+        if type(nestedlist) is not list:
+            # TODO: Need some kind of error here?
+            return None
+
+        positions = []
+        for item in nestedlist:
+            if type(item) is str:
+                positions.append([(item,)])
+            elif type(item) is list:
+                alternatives = []
+                for alt in item:
+                    if type(alt) is list:
+                        alternatives.append(tuple(alt))
+                    elif type(alt) is str:
+                        alternatives.append((alt,))
+                positions.append(alternatives)
+            else:
+                return None
+
+        return positions
@@ -0,0 +1,202 @@
+"""Defines the ModelIndex class, an inverted index from modelname keywords
+to the models that use them.
+"""
+import logging
+import collections
+
+import numpy as np
+
+from nems_db.db import NarfResults
+from nems_web.nems_analysis.ModelFinder import ModelFinder, tree_key
+from nems_web.utilities.cache import LRUCache, TTLCache
+
+log = logging.getLogger(__name__)
+
+# Approximate upper bound, in bytes, on the memory used by cached indexes
+# of analysis modeltrees.
+TREE_INDEX_CACHE_BYTES = 64*1024*1024
+# Largest number of models in a modeltree that will be indexed. Bigger
+# trees would have every model built to index them, so they can only be
+# paged through with ModelFinder.
+TREE_INDEX_MAX_MODELS = 200000
+# Number of seconds to keep an index of NarfResults modelnames, since new
+# results are added as models are fit.
+RESULTS_INDEX_TTL = 300
+
+_tree_index_cache = LRUCache(
+        maxbytes=TREE_INDEX_CACHE_BYTES, sizeof=lambda index: index.nbytes,
+        )
+_results_index_cache = TTLCache(ttl=RESULTS_INDEX_TTL)
+
+
+class ModelIndex():
+    """Maps each keyword token in a list of modelnames, and each
+    (token, position) pair, to the ids of the models that contain it.
+
+    Modelnames are split into tokens on underscores, so
+    'fb18ch100_wc03_fir10_dexp_fit01' has token 'fir10' at position 2.
+    A model's id is its index in self.modelnames.
+
+    Arguments:
+    ----------
+    modelnames : iterable of strings
+        The modelnames to index, ex: ModelFinder.iter_models() or the
+        distinct modelnames in NarfResults.
+
+    """
+
+    def __init__(self, modelnames=()):
+        self.modelnames = np.array(list(modelnames), dtype=object)
+        tokens = collections.defaultdict(list)
+        positions = collections.defaultdict(list)
+        for i, name in enumerate(self.modelnames):
+            for pos, token in enumerate(name.split('_')):
+                tokens[token].append(i)
+                positions[(token, pos)].append(i)
+        # A token can appear more than once in the same model, so remove
+        # duplicate ids.
+        self.tokens = {
+                k: np.unique(np.array(v, dtype=np.int32))
+                for k, v in tokens.items()
+                }
+        self.positions = {
+                k: np.array(v, dtype=np.int32) for k, v in positions.items()
+                }
+
+    def __len__(self):
+        return len(self.modelnames)
+
+    @property
+    def nbytes(self):
+        """Rough estimate of the memory used by the index."""
+        postings = sum(v.nbytes for v in self.tokens.values())
+        postings += sum(v.nbytes for v in self.positions.values())
+        names = sum(len(m) + 49 for m in self.modelnames)
+        return postings + names + 8*len(self.modelnames)
+
+    def postings(self, term):
+        """Returns the ids of the models matching a single query term,
+        which is either a token ('fir15') or a token and position separated
+        by '@' ('fir15@2').
+
+        Raises ValueError if the position isn't an integer.
+
+        """
+
+        if '@' in term:
+            token, pos = term.rsplit('@', 1)
+            try:
+                pos = int(pos)
+            except ValueError:
+                raise ValueError(
+                        "Position must be an integer in query term: {0}"
+                        .format(term)
+                        )
+            ids = self.positions.get((token, pos), None)
+        else:
+            ids = self.tokens.get(term, None)
+        if ids is None:
+            return np.array([], dtype=np.int32)
+        return ids
+
+    def match(self, include=(), exclude=()):
+        """Returns the sorted ids of the models that match every term in
+        include and none of the terms in exclude. If include is empty,
+        every model not excluded is matched.
+
+        """
+
+        mask = np.ones(len(self.modelnames), dtype=bool)
+        for term in include:
+            term_mask = np.zeros(len(self.modelnames), dtype=bool)
+            term_mask[self.postings(term)] = True
+            mask &= term_mask
+        for term in exclude:
+            mask[self.postings(term)] = False
+        return np.flatnonzero(mask)
+
+    def query(self, include=(), exclude=(), offset=0, limit=None):
+        """Returns a 2-tuple containing:
+            index 0, the list of matching modelnames starting at offset,
+                with at most limit names (or all of them if limit is None).
+            index 1, the total number of matching modelnames.
+        See match for the meaning of include and exclude.
+
+        """
+
+        ids = self.match(include, exclude)
+        offset = max(0, offset)
+        if limit is None:
+            page = ids[offset:]
+        else:
+            page = ids[offset:offset+max(0, limit)]
+        return (self.modelnames[page].tolist(), len(ids))
+
+
+class ModelTreeTooLargeError(ValueError):
+    """Raised by get_tree_index when a modeltree has more than
+    TREE_INDEX_MAX_MODELS models.
+
+    """
+
+    def __init__(self, count):
+        self.count = count
+        super().__init__(
+                "Model tree has {0} models, too many to search (limit {1}). "
+                "Narrow the tree or page through it instead."
+                .format(count, TREE_INDEX_MAX_MODELS)
+                )
+
+
+def get_tree_index(modelstring):
+    """Returns the ModelIndex for every model in a modeltree string,
+    building it only if it isn't already cached.
+
+    Raises ModelTreeSyntaxError if the tree can't be parsed, or
+    ModelTreeTooLargeError if it has more than TREE_INDEX_MAX_MODELS models.
+
+    """
+
+    if modelstring is None:
+        modelstring = ''
+
+    def load():
+        # count is known without building any models, so check it before
+        # indexing every combination.
+        finder = ModelFinder(modelstring)
+        if finder.count > TREE_INDEX_MAX_MODELS:
+            raise ModelTreeTooLargeError(finder.count)
+        return ModelIndex(finder.iter_models())
+
+    return _tree_index_cache.get_or_load(tree_key(modelstring), load)
+
+
+def get_results_index(session, batch=None):
+    """Returns the ModelIndex for the distinct modelnames in NarfResults,
+    limited to batch if given, building it only if it isn't already cached.
+
+    """
+
+    key = 'all' if batch is None else str(batch)
+
+    def load():
+        query = session.query(NarfResults.modelname).distinct()
+        if batch is not None:
+            query = query.filter(NarfResults.batch == batch)
+        modelnames = sorted(r[0] for r in query.all() if r[0])
+        return ModelIndex(modelnames)
+
+    return _results_index_cache.get_or_load(key, load)
+
+
+def invalidate_model_indexes(modelstring=None):
+    """Removes the cached index for modelstring, or every cached index if
+    modelstring is None.
+
+    """
+
+    if modelstring is None:
+        _tree_index_cache.invalidate()
+        _results_index_cache.invalidate()
+    else:
+        _tree_index_cache.invalidate(tree_key(modelstring))
@@ -284,8 +284,7 @@ $(document).ready(function(){
     /*
     var analysisCheck = document.getElementById("analysisSelector").value;
     if ((analysisCheck !== "") && (analysisCheck !== undefined) && (analysisCheck !== null)){
-        updateBatchModel();
-        updateAnalysisDetails();
+        selectAnalysis();
     }
     */
     
@@ -313,62 +312,261 @@ $(document).ready(function(){
                 modelOptions[i].selected = false;
             }
         }
+        updateModelCount(model_count);
         updateResults();
     }
     
     
-    $("#analysisSelector").change(updateBatchModel);
+    $("#analysisSelector").change(selectAnalysis);
 
-    function updateBatchModel(){
-        // if analysis selection changes, get the value selected
+    function selectAnalysis(){
+        // if analysis selection changes, get the batch, models, cells and
+        // details for the new selection (plus the first page of results if
+        // every cell and model will be selected) with a single request.
         var aSelected = $("#analysisSelector").val();
+        $("#modelFilter").val('');
+        var allSelected = (document.getElementById("selectAllCells").checked
+                && document.getElementById("selectAllModels").checked);
+        var data = { aSelected:aSelected, withResults:allSelected ? 1 : 0 };
+        if (allSelected){
+            $.extend(data, resultsQuery());
+        }
 
-        // pass the value to '/update_batch' in nemsweb.py
-        // get back associated batchnum and change batch selector to match
         $.ajax({
-            url: $SCRIPT_ROOT + '/update_batch',
-            data: { aSelected:aSelected }, 
+            url: $SCRIPT_ROOT + '/select_analysis',
+            data: data,
             type: 'GET',
             success: function(data) {
+                // set batch without triggering change, since cells are
+                // already included in the response.
                 if ((data.blank === 1) || (data.blank === "1")){
-                    $("#batchSelector").val($("#batchSelector option:first").val()).change();
+                    $("#batchSelector").val($("#batchSelector option:first").val());
                 } else {
-                    $("#batchSelector").val(data.batch).change();
+                    $("#batchSelector").val(data.batch);
+                }
+
+                if (data.error){
+                    py_console_log(data.error);
+                } else if (data.modellist.length === 0){
+                    console.log('No model list returned.');
+                    py_console_log('No model list returned.');
+                }
+                fillSelector($("#modelSelector"), data.modellist,
+                             "modelOption[]", "selectAllModels");
+                updateModelCount(data.modelcount);
+                fillSelector($("#cellSelector"), data.celllist,
+                             "cellOption[]", "selectAllCells");
+
+                $("#analysisDetails").attr("data-content",data.details)
+                $("#analysisDetails").attr("title",aSelected)
+
+                if (data.results === null){
+                    updateResults();
+                } else {
+                    results_cursor = null;
+                    renderResultsPage(data.results, false);
                 }
             },
             error: function(error) {
                 console.log(error);
             }
         });
+    };
+
+    // total number of models in the selected analysis, only the first
+    // page is loaded until 'More models' is clicked.
+    var model_count = 0;
+    function updateModelCount(count){
+        model_count = count;
+        var loaded = $("#modelSelector").children("option").length;
+        var selectAll = document.getElementById("selectAllModels").checked;
+        if (loaded < model_count){
+            // 'select all' only selects the models that have been loaded,
+            // so say so rather than leaving the rest out silently.
+            if (selectAll){
+                $("#modelCount").text(
+                        "All " + loaded + " loaded of " + model_count
+                        + " selected, load more to include the rest");
+                $("#modelCount").addClass("text-warning");
+            } else {
+                $("#modelCount").text(loaded + " of " + model_count);
+                $("#modelCount").removeClass("text-warning");
+            }
+            $("#moreModels").css('display', 'inline-block');
+        } else {
+            $("#modelCount").text(model_count);
+            $("#modelCount").removeClass("text-warning");
+            $("#moreModels").css('display', 'none');
+        }
+    }
+
+    // Suggest cells and models from the server as the user types, so that
+    // finding an entry doesn't depend on scrolling the full selector.
+    $("#cellSearch").autocomplete({
+        minLength: 1,
+        source: function(request, response){
+            autocompleteSource('cells', request, response);
+        },
+        select: function(event, ui){
+            selectOption($("#cellSelector"), ui.item.value, "cellOption[]");
+            $(this).val('');
+            return false;
+        }
+    });
+    $("#modelSearch").autocomplete({
+        minLength: 1,
+        source: function(request, response){
+            autocompleteSource('models', request, response);
+        },
+        select: function(event, ui){
+            selectOption($("#modelSelector"), ui.item.value, "modelOption[]");
+            $(this).val('');
+            return false;
+        }
+    });
 
-        // also pass analysis value to 'update_models' in nemsweb.py
+    function autocompleteSource(kind, request, response){
         $.ajax({
-            url: $SCRIPT_ROOT + '/update_models',
-            data: { aSelected:aSelected }, 
+            url: $SCRIPT_ROOT + '/autocomplete',
+            data: { kind:kind, q:request.term,
+                    bSelected:$("#batchSelector").val(),
+                    aSelected:$("#analysisSelector").val() },
             type: 'GET',
             success: function(data){
-                if (data.modellist.length === 0){
-                    console.log('No model list returned.');
-                    py_console_log('No model list returned.');
+                if (data.error){
+                    py_console_log(data.error);
+                }
+                response(data.items);
+            },
+            error: function(error){
+                console.log(error);
+                response([]);
+            }
+        });
+    }
+
+    function selectOption(selector, value, name){
+        // add value to the current selection, adding it to the selector
+        // first if that page of options hasn't been loaded.
+        var option = selector.children("option").filter(function(){
+            return this.value === value;
+        });
+        if (option.length === 0){
+            option = $("<option></option>")
+                .attr("value", value)
+                .attr("name", name)
+                .text(value);
+            selector.prepend(option);
+        }
+        option.prop("selected", true);
+        selector.scrollTop(
+                selector.scrollTop() + option.position().top
+                - selector.height()/2
+                );
+        updateResults();
+    }
+
+    function modelFilterTerms(){
+        // keywords in the model filter box, ex: 'fir15 dexp -stp2pc',
+        // keywords starting with '-' are excluded.
+        var include = [];
+        var exclude = [];
+        $.each($("#modelFilter").val().split(/\s+/), function(i, term){
+            if (term.length === 0){
+                return true;
+            }
+            if ((term.charAt(0) === '-') && (term.length > 1)){
+                exclude.push(term.slice(1));
+            } else {
+                include.push(term);
+            }
+        });
+        return { include:include, exclude:exclude };
+    }
+
+    $("#modelFilter").change(filterModels);
+    function filterModels(){
+        var aSelected = $("#analysisSelector").val();
+        var terms = modelFilterTerms();
+        $.ajax({
+            url: $SCRIPT_ROOT + '/query_models',
+            data: { aSelected:aSelected, include:terms.include,
+                    exclude:terms.exclude },
+            type: 'GET',
+            success: function(data){
+                if (data.error){
+                    py_console_log(data.error);
+                    return false;
+                }
+                fillSelector($("#modelSelector"), data.modellist,
+                             "modelOption[]", "selectAllModels");
+                updateModelCount(data.modelcount);
+                updateResults();
+            },
+            error: function(error){
+                console.log(error);
+            }
+        });
+    }
+
+    $("#moreModels").on('click', loadMoreModels);
+    function loadMoreModels(){
+        var aSelected = $("#analysisSelector").val();
+        var offset = $("#modelSelector").children("option").length;
+        var terms = modelFilterTerms();
+        var url = '/update_models';
+        var data = { aSelected:aSelected, offset:offset };
+        if ((terms.include.length > 0) || (terms.exclude.length > 0)){
+            url = '/query_models';
+            data.include = terms.include;
+            data.exclude = terms.exclude;
+        }
+        $.ajax({
+            url: $SCRIPT_ROOT + url,
+            data: data,
+            type: 'GET',
+            success: function(data){
+                if (data.error){
+                    py_console_log(data.error);
+                    return false;
+                }
+                if (typeof data.modellist === 'string'){
+                    py_console_log(data.modellist);
                     return false;
                 }
                 var models = $("#modelSelector");
-                models.empty();
-                             
+                var selectAll = document.getElementById("selectAllModels").checked;
                 $.each(data.modellist, function(i, modelname){
                     models.append($("<option></option>")
                         .attr("value", modelname)
                         .attr("name","modelOption[]")
+                        .prop("selected", selectAll)
                         .text(modelname));
                 });
-                    
-                selectModelsCheck();
+                updateModelCount(data.modelcount);
+                if (selectAll){
+                    updateResults();
+                }
             },
             error: function(error){
                 console.log(error);
-            }     
+            }
         });
-    };
+    }
+
+    function fillSelector(selector, values, name, selectAllId){
+        // replace the options in selector with values, selecting all of
+        // them if the matching 'select all' box is checked.
+        var selectAll = document.getElementById(selectAllId).checked;
+        selector.empty();
+        $.each(values, function(i, value){
+            selector.append($("<option></option>")
+                .attr("value", value)
+                .attr("name", name)
+                .prop("selected", selectAll)
+                .text(value));
+        });
+    }
 
     $("#batchSelector").change(updateCells);
 
@@ -402,11 +600,14 @@ $(document).ready(function(){
         });
     };
 
-    function addLinksToTable(){
+    function addLinksToTable(rows){
         // Iterate through each table row and convert each result
         // to a link to detailed info for that result
-        var $table = $("#tableWrapper").children('table');
-        $table.find('tbody').find('tr').each(function(){
+        if (rows === undefined){
+            var $table = $("#tableWrapper").children('table');
+            rows = $table.find('tbody').find('tr');
+        }
+        rows.each(function(){
             var cellid = $(this).children().eq(0).html();
             var modelname = $(this).children().eq(1).html();
             var cell_link = $SCRIPT_ROOT + '/cell_details/';
@@ -428,10 +629,18 @@ $(document).ready(function(){
 
     $("#modelSelector,#cellSelector,#rowLimit,#tableColSelector,#tableSortSelector,#descending")
     .change(updateResults);
+    // cursor for the next page of results, null if there are no more pages
+    var results_cursor = null;
     function updateResults(){
-        var bSelected = $("#batchSelector").val();
-        var cSelected = $("#cellSelector").val();
-        var mSelected = $("#modelSelector").val();
+        results_cursor = null;
+        getResultsPage(false);
+    }
+
+    $("#moreResults").on('click', function(){
+        getResultsPage(true);
+    });
+    function resultsQuery(){
+        // table options shared by every request for a page of results
         var colSelected = $("#tableColSelector").val();
         var sortSelected = $("#tableSortSelector").val();
         if (document.getElementById("descending").checked){
@@ -439,34 +648,106 @@ $(document).ready(function(){
         } else {
             var ordSelected = "asc";
         }
-        var rowLimit = $("#rowLimit").val();
-                         
+        // row limit is used as the page size, more rows are fetched
+        // one page at a time with the 'More results' button.
+        var pageSize = $("#rowLimit").val();
+        return { colSelected:colSelected, pageSize:pageSize,
+                 ordSelected:ordSelected, sortSelected:sortSelected };
+    }
+
+    function getResultsPage(append){
+        var bSelected = $("#batchSelector").val();
+        var cSelected = $("#cellSelector").val();
+        var mSelected = $("#modelSelector").val();
+        var data = $.extend(
+                { bSelected:bSelected, cSelected:cSelected,
+                  mSelected:mSelected },
+                resultsQuery()
+                );
+        if (append){
+            if (results_cursor === null){
+                return false;
+            }
+            data.cursor = results_cursor;
+        }
+
         $.ajax({
-            url: $SCRIPT_ROOT + '/update_results',
-            data: { bSelected:bSelected, cSelected:cSelected, 
-                   mSelected:mSelected, colSelected:colSelected,
-                   rowLimit:rowLimit, ordSelected:ordSelected,
-                   sortSelected:sortSelected },
+            url: $SCRIPT_ROOT + '/results_page',
+            data: data,
             type: 'GET',
             success: function(data) {
-                //grabs whole div - replace inner html with new table?
-                results = $("#tableWrapper");
-                //results.resizable("destroy");
-                //results.draggable("destroy");
-                results.html(data.resultstable)
-                //sizeDragTable();
-                var table = results.children("table");
-                //initTable(table);
-                //disabled for now - need to figure out agood way to let user
-                // toggle the links on and off
-                addLinksToTable();
+                if (data.hasOwnProperty('error')){
+                    py_console_log(data.error);
+                    return false;
+                }
+                renderResultsPage(data, append);
             },
             error: function(error) {
                 console.log(error);
             }
         });
     }
-    
+
+    function renderResultsPage(data, append){
+        var results = $("#tableWrapper");
+        if (!append){
+            if (data.columns.length === 0){
+                results.html(
+                        "MUST SELECT A BATCH AND ONE OR MORE CELLS AND "
+                        + "ONE OR MORE MODELS BEFORE RESULTS WILL UPDATE"
+                        );
+                $("#moreResults").css('display', 'none');
+                return false;
+            }
+            var table = $("<table></table>")
+                    .addClass("dataframe table-hover table-condensed");
+            var header = $("<tr></tr>");
+            $.each(data.columns, function(i, col){
+                header.append($("<th></th>").text(col.name));
+            });
+            table.append($("<thead></thead>").append(header));
+            table.append($("<tbody></tbody>"));
+            results.html(table);
+        }
+        var body = results.children("table").children("tbody");
+        var newRows = $();
+        $.each(data.rows, function(i, row){
+            var tr = $("<tr></tr>");
+            $.each(row, function(j, value){
+                tr.append($("<td></td>").text(value));
+            });
+            body.append(tr);
+            newRows = newRows.add(tr);
+        });
+        addLinksToTable(newRows);
+        results_cursor = data.next_cursor;
+        if (results_cursor === null){
+            $("#moreResults").css('display', 'none');
+        } else {
+            $("#moreResults").css('display', 'inline-block');
+        }
+    }
+
+    $("#exportResults").on('click', exportResults);
+    function exportResults(){
+        // Navigating to the export url lets the browser save the streamed
+        // file directly instead of holding it in memory.
+        var bSelected = $("#batchSelector").val();
+        var cSelected = $("#cellSelector").val();
+        var mSelected = $("#modelSelector").val();
+        if ((!bSelected) || (!cSelected) || (cSelected.length == 0)
+                || (!mSelected) || (mSelected.length == 0)){
+            py_console_log('Must select a batch, cells and models to export');
+            return false;
+        }
+        var query = $.param({
+                bSelected:bSelected, cSelected:cSelected,
+                mSelected:mSelected,
+                colSelected:$("#tableColSelector").val(),
+                format:$("#exportFormat").val() });
+        window.location = $SCRIPT_ROOT + '/export_results?' + query;
+    }
+
     updateColText();
     $("#tableColSelector").change(updateColText);
     function updateColText(){
@@ -490,25 +771,6 @@ $(document).ready(function(){
     ////////////////////////////////////////////////////////////////////////
 
 
-    $("#analysisSelector").change(updateAnalysisDetails);
-            
-    function updateAnalysisDetails(){
-        var aSelected = $("#analysisSelector").val();
-        
-        $.ajax({
-            url: $SCRIPT_ROOT + '/update_analysis_details',
-            data: { aSelected:aSelected },
-            type: 'GET',
-            success: function(data) {
-                $("#analysisDetails").attr("data-content",data.details)
-                $("#analysisDetails").attr("title",aSelected)
-            },
-            error: function(error) {
-                console.log(error);
-            }
-        });
-    }
-
     updateAnalysis();
     $("#tagFilters, #statusFilters").change(updateAnalysis);
     
@@ -1165,8 +1427,6 @@ $(document).ready(function(){
         
     $("#submitPlot").on('click', getNewPlot);
     function getNewPlot(){
-        var plotDiv = $("#displayWrapper");
-        
         var plotType = $("#plotTypeSelector").val();
         var bSelected = $("#batchSelector").val();
         var cSelected = $("#cellSelector").val();
@@ -1180,67 +1440,76 @@ $(document).ready(function(){
         if (document.getElementById("includeOutliers").checked){
             includeOutliers = 1;
         }
+        // paired test and multiple comparison correction for
+        // Significance_Plot
+        var test = $("#pairedTest").val();
+        var correction = $("#correction").val();
         var plotNewWindow = 0;
         
         addLoad();
         $.ajax({
-            url: $SCRIPT_ROOT + '/generate_plot_html',
+            url: $SCRIPT_ROOT + '/submit_plot_job',
             data: { plotType:plotType, bSelected:bSelected, cSelected:cSelected,
                     mSelected:mSelected, measure:measure, onlyFair:onlyFair,
                     includeOutliers:includeOutliers, iso:iso, snr:snr, 
-                    snri:snri, plotNewWindow:plotNewWindow },
+                    snri:snri, test:test, correction:correction,
+                    plotNewWindow:plotNewWindow },
             type: 'GET',
             success: function(data){
-                if (data.hasOwnProperty('script')){
-                    if(plotNewWindow){
-                        var w = window.open(
-                                $SCRIPT_ROOT + '/plot_window',
-                                //"_blank",
-                                //"width=600, height=600"
-                                )
-                        $(w.document).ready(function(){
-                            w.$(w.document.body).append(data.script + data.div);
-                        });
-                    } else{
-                        $("#statusReportWrapper").html('');
-                        plotDiv.html(data.script + data.div);  
-                    }
-                }
-                if (data.hasOwnProperty('html')){
-                    if(plotNewWindow){
-                        var w = window.open(
-                                $SCRIPT_ROOT + '/plot_window',
-                                //"_blank",
-                                //"width=600, height=600" 
-                                )
-                        $(w.document).ready(function(){
-                            w.$(w.document.body).append(data.html);
-                        });
-                    } else{
-                        $("#statusReportWrapper").html('');
-                        plotDiv.html(data.html);
-                    }
+                if (data.status === 'error'){
+                    py_console_log(data.error);
+                    removeLoad();
+                } else if (data.job === null){
+                    // plot was already cached
+                    showPlot(data, plotNewWindow);
+                } else {
+                    pollPlotJob(data.job, plotNewWindow);
                 }
-                if (data.hasOwnProperty('image')){
-                    if(plotNewWindow){
-                        var w = window.open(
-                            $SCRIPT_ROOT + '/plot_window',
-                            )
-                        $(w.document).ready(function(){
-                            w.$(w.document.body).append(
-                                '<img id="preview_image" src="data:image/png;base64,'
-                                + data.image + '" />'
+            },
+            error: function(error){
+                console.log(error)
+                removeLoad();
+            }
+        });
+    }
+
+    // milliseconds between checks on a background plot job
+    var plot_poll_interval = 500;
+    function pollPlotJob(job, plotNewWindow){
+        $.ajax({
+            url: $SCRIPT_ROOT + '/plot_job_status',
+            data: { job:job },
+            type: 'GET',
+            success: function(data){
+                if (data.status === 'done'){
+                    getPlotJobResult(job, plotNewWindow);
+                } else if (data.status === 'error'){
+                    py_console_log("Plot failed: " + data.error);
+                    removeLoad();
+                } else {
+                    $("#statusReportWrapper").html(
+                            "Plot " + data.status + ": " + data.stage
+                            + " (" + data.elapsed + "s)"
                             );
-                        });
-                    } else{
-                        $("#statusReportWrapper").html();
-                        plotDiv.html(
-                            '<img id="preview_image" src="data:image/png;base64,'
-                            + data.image + '" />'
-                        );
-                    }
+                    setTimeout(function(){
+                        pollPlotJob(job, plotNewWindow);
+                    }, plot_poll_interval);
                 }
+            },
+            error: function(error){
+                console.log(error)
                 removeLoad();
+            }
+        });
+    }
+
+    function getPlotJobResult(job, plotNewWindow){
+        $.ajax({
+            url: $SCRIPT_ROOT + '/plot_job_result',
+            data: { job:job },
+            type: 'GET',
+            success: function(data){
+                showPlot(data, plotNewWindow);
             },
             error: function(error){
                 console.log(error)
@@ -1248,8 +1517,68 @@ $(document).ready(function(){
             }
         });
     }
-           
-    $("#submitCustom").on('click', getCustomScript);
+
+    function showPlot(data, plotNewWindow){
+        var plotDiv = $("#displayWrapper");
+        if (data.hasOwnProperty('filtered')){
+            py_console_log("Cells removed before plotting -- snr: "
+                    + data.filtered.snr + ", iso: " + data.filtered.iso
+                    + ", snri: " + data.filtered.snri + ", missing: "
+                    + data.filtered.missing + ", total: "
+                    + data.filtered.total);
+        }
+        if (data.hasOwnProperty('script')){
+            if(plotNewWindow){
+                var w = window.open(
+                        $SCRIPT_ROOT + '/plot_window',
+                        //"_blank",
+                        //"width=600, height=600"
+                        )
+                $(w.document).ready(function(){
+                    w.$(w.document.body).append(data.script + data.div);
+                });
+            } else{
+                $("#statusReportWrapper").html('');
+                plotDiv.html(data.script + data.div);  
+            }
+        }
+        if (data.hasOwnProperty('html')){
+            if(plotNewWindow){
+                var w = window.open(
+                        $SCRIPT_ROOT + '/plot_window',
+                        //"_blank",
+                        //"width=600, height=600" 
+                        )
+                $(w.document).ready(function(){
+                    w.$(w.document.body).append(data.html);
+                });
+            } else{
+                $("#statusReportWrapper").html('');
+                plotDiv.html(data.html);
+            }
+        }
+        if (data.hasOwnProperty('image')){
+            if(plotNewWindow){
+                var w = window.open(
+                    $SCRIPT_ROOT + '/plot_window',
+                    )
+                $(w.document).ready(function(){
+                    w.$(w.document.body).append(
+                        '<img id="preview_image" src="data:image/png;base64,'
+                        + data.image + '" />'
+                    );
+                });
+            } else{
+                $("#statusReportWrapper").html('');
+                plotDiv.html(
+                    '<img id="preview_image" src="data:image/png;base64,'
+                    + data.image + '" />'
+                );
+            }
+        }
+        removeLoad();
+    }
+
     function getCustomScript(){
         var scriptName = $("#customSelector").val();
         var bSelected = $("#batchSelector").val();
@@ -24,27 +24,39 @@ any other category (so far, just one function to serve error_log.txt).
 import logging
 import copy
 import datetime
-from base64 import b64encode
+import json
+from base64 import b64encode, urlsafe_b64encode, urlsafe_b64decode
 from urllib.parse import urlparse
 from collections import namedtuple
 
 from flask import (
-        render_template, jsonify, request,
+        render_template, jsonify, request, Response,
         )
 from flask_login import login_required
 import pandas.io.sql as psql
 import pandas as pd
 from sqlalchemy.orm import Query
-from sqlalchemy import desc, asc, or_
+from sqlalchemy import desc, asc, or_, and_
 
 from nems_web.nems_analysis import app, bokeh_version
 from nems_db.db import (
         Session, NarfAnalysis, NarfBatches, NarfResults, sBatch, NarfUsers,
         )
-from nems_web.nems_analysis.ModelFinder import ModelFinder
+from nems_web.nems_analysis.ModelFinder import (
+        find_models, invalidate_models, parse_modeltree, ModelTreeSyntaxError,
+        tree_key,
+        )
+from nems_web.nems_analysis.AnalysisCatalog import analysis_catalog
+from nems_web.nems_analysis.ModelIndex import (
+        get_tree_index, get_results_index, invalidate_model_indexes,
+        )
 from nems_web.plot_functions.PlotGenerator import PLOT_TYPES
+from nems_web.utilities.paired_stats import TESTS, CORRECTIONS
 from nems_web.account_management.views import get_current_user
 from nems_web.run_custom.script_utils import scan_for_scripts
+from nems_web.utilities.cell_quality import get_cell_quality
+from nems_web.utilities.cache import TTLCache
+from nems_web.utilities.trigram import TrigramIndex
 #from nems_config.defaults import UI_OPTIONS, DEMO_MODE
 from nems.uri import load_resource, save_resource
 #n_ui = UI_OPTIONS
@@ -64,10 +76,19 @@ log = logging.getLogger(__name__)
 
 # TODO: figure out where to move this for easier config
 #       namedtuple is a temporary hack to force object-like attributes
-ui_opt = namedtuple('ui_opt', 'cols rowlimit sort measurelist required_cols detailcols iso snr snri')
+ui_opt = namedtuple('ui_opt', 'cols rowlimit maxpagesize exportchunk modelpage autocompletelimit sort measurelist required_cols detailcols iso snr snri')
 n_ui = ui_opt(
     cols=['r_test', 'r_fit', 'n_parms'],
     rowlimit=500,
+    # largest page of results that results_page will return at once
+    maxpagesize=5000,
+    # number of rows read from the database at a time when exporting results
+    exportchunk=10000,
+    # number of modelnames sent to the model selector at a time. 'select
+    # all' only covers the models loaded so far, which the selector shows.
+    modelpage=1000,
+    # default number of suggestions returned by autocomplete
+    autocompletelimit=20,
     sort='cellid',
     # specifies which columns from narf results can be used to quantify
     # performance for plots
@@ -86,6 +107,57 @@ n_ui = ui_opt(
     snri=0,
     )
 
+# Names of the NarfResults table columns. Column and sort selections from
+# the request are checked against this rather than with hasattr, which
+# would also accept attributes like query or metadata.
+RESULTS_COLUMNS = set(NarfResults.__table__.columns.keys())
+
+# Number of seconds to keep the list of batches before reloading it.
+BATCH_CACHE_TTL = 60
+batch_cache = TTLCache(ttl=BATCH_CACHE_TTL)
+
+# Number of seconds to keep the trigram indexes used by autocomplete.
+SEARCH_INDEX_TTL = 300
+search_index_cache = TTLCache(ttl=SEARCH_INDEX_TTL)
+
+
+def get_batch_catalog(session):
+    """Returns a dict of batch id : batch name for every batch in
+    NarfBatches, loaded with a single query and cached for BATCH_CACHE_TTL
+    seconds. Batches with no entry in sBatch get a blank name.
+
+    """
+
+    return batch_cache.get_or_load(
+            'catalog', lambda: load_batch_catalog(session)
+            )
+
+
+def load_batch_catalog(session):
+    rows = (
+            session.query(NarfBatches.batch, sBatch.name)
+            .outerjoin(sBatch, sBatch.id == NarfBatches.batch)
+            .distinct()
+            .all()
+            )
+    catalog = {}
+    for batch, name in rows:
+        if catalog.get(batch, ''):
+            continue
+        catalog[batch] = name if name else ''
+    return catalog
+
+
+def format_batchlist(catalog):
+    """Formats a batch catalog as a sorted list of 'id: name' strings."""
+    batchlist = [
+            (str(batch) + ': ' + name)
+            for batch, name in catalog.items()
+            ]
+    batchlist.sort()
+    return batchlist
+
+
 ##################################################################
 ####################   UI UPDATE FUNCTIONS  ######################
 ##################################################################
@@ -116,54 +188,18 @@ def main_view():
 
     session = Session()
 
-    # .all() returns a list of tuples, so it's necessary to pull the
-    # name elements out into a list by themselves.
-    analyses = (
-            session.query(NarfAnalysis)
-            .filter(or_(
-                    int(user.sec_lvl) == 9,
-                    NarfAnalysis.public == '1',
-                    NarfAnalysis.labgroup.ilike('%{0}%'.format(user.labgroup)),
-                    NarfAnalysis.username == user.username,
-                    ))
-            .order_by(asc(NarfAnalysis.id))
-            .all()
-            )
+    # Analyses, tags and statuses visible to this user all come from the
+    # in-memory analysis catalog.
+    superuser = (int(user.sec_lvl) == 9)
+    analyses = analysis_catalog.analyses(session, user, superuser)
     analysislist = [
-            a.name for a in analyses
+            a[1] for a in analyses
             ]
     analysis_ids = [
-            a.id for a in analyses
+            a[0] for a in analyses
             ]
 
-    batchids = [
-            i[0] for i in
-            session.query(NarfBatches.batch)
-            .distinct()
-            #.filter(or_(
-            #        int(user.sec_lvl) == 9,
-            #        NarfBatches.public == '1',
-            #        NarfBatches.labgroup.ilike('%{0}%'.format(user.labgroup)),
-            #        NarfBatches.username == user.username,
-            #        ))
-            .all()
-            ]
-    batchnames = []
-    for i in batchids:
-        name = (
-                session.query(sBatch.name)
-                .filter(sBatch.id == i)
-                .first()
-                )
-        if not name:
-            batchnames.append('')
-        else:
-            batchnames.append(name.name)
-    batchlist = [
-            (batch + ': ' + batchnames[i])
-            for i, batch in enumerate(batchids)
-            ]
-    batchlist.sort()
+    batchlist = format_batchlist(get_batch_catalog(session))
 
     # Default settings for results display.
     # TODO: let user choose their defaults and save for later sessions
@@ -173,29 +209,8 @@ def main_view():
     defaultrowlimit = n_ui.rowlimit
     defaultsort = n_ui.sort
     measurelist = n_ui.measurelist
-    statuslist = [
-            i[0] for i in
-            session.query(NarfAnalysis.status)
-            .filter(NarfAnalysis.name.in_(analysislist))
-            .distinct().all()
-            ]
-
-    # Separate tags into list of lists of strings.
-    tags = [
-            i[0].split(",") for i in
-            session.query(NarfAnalysis.tags)
-            .filter(NarfAnalysis.name.in_(analysislist))
-            .distinct().all()
-            ]
-    # Flatten list of lists into a single list of all tag strings
-    # and remove leading and trailing whitespace.
-    taglistbldupspc = [i for sublist in tags for i in sublist]
-    taglistbldup = [t.strip() for t in taglistbldupspc]
-    # Reform the list with only unique tags
-    taglistbl = list(set(taglistbldup))
-    # Finally, remove any blank tags and sort the list.
-    taglist = [t for t in taglistbl if t != '']
-    taglist.sort()
+    statuslist = analysis_catalog.statuslist(session, user, superuser)
+    taglist = analysis_catalog.taglist(session, user, superuser)
 
     # Returns all columns in the format 'NarfResults.columnName,'
     # then removes the leading 'NarfResults.' from each string
@@ -219,35 +234,79 @@ def main_view():
             batchlist=batchlist, collist=collist, defaultcols=defaultcols,
             measurelist=measurelist, defaultrowlimit=defaultrowlimit,
             sortlist=sortlist, defaultsort=defaultsort,statuslist=statuslist,
-            taglist=taglist, plotTypeList=plotTypeList, username=user.username,
+            taglist=taglist, plotTypeList=plotTypeList, testList=TESTS,
+            correctionList=CORRECTIONS, username=user.username,
             seclvl = int(user.sec_lvl), iso=n_ui.iso, snr=n_ui.snr,
             snri=n_ui.snri, scripts=scriptList, bokeh_version=bokeh_version
             )
 
 
-@app.route('/update_batch')
-def update_batch():
-    """Update current batch selection after an analysis is selected."""
+@app.route('/select_analysis')
+def select_analysis():
+    """Update the batch, model list, cell list and analysis details after an
+    analysis is selected, all from a single session.
+
+    If withResults is 1, the first page of the results table (with every
+    cell and model selected) is also included in the same format returned
+    by results_page. This replaces the update_batch, update_models,
+    update_cells, update_analysis_details and results_page calls that would
+    otherwise be made one after another.
+
+    """
 
+    user = get_current_user()
     session = Session()
-    blank = 0
 
     aSelected = request.args.get('aSelected', type=str)
-    batch = (
-            session.query(NarfAnalysis.batch)
-            .filter(NarfAnalysis.name == aSelected)
-            .first()
-            )
+    withResults = request.args.get('withResults', 0, type=int)
+
+    batch = get_analysis_batch(session, aSelected)
+    error = None
     try:
-        batch = batch.batch
-    except Exception as e:
+        modellist, modelcount = get_analysis_models(
+                session, aSelected, limit=n_ui.modelpage,
+                )
+    except ModelTreeSyntaxError as e:
         log.info(e)
-        batch = ''
-        blank = 1
+        modellist, modelcount = (None, 0)
+        error = "Could not parse model tree: {0}".format(e)
+    if modellist is None:
+        modellist = []
+    if batch:
+        celllist = get_batch_cells(session, batch)
+    else:
+        celllist = []
+    details = get_analysis_details(session, aSelected)
+
+    results = None
+    if withResults and celllist and modellist:
+        results = get_results_page(
+                session, user, batch, celllist, modellist,
+                request.args.getlist('colSelected[]'),
+                pageSize=request.args.get('pageSize', n_ui.rowlimit, type=int),
+                sortSelected=request.args.get('sortSelected', n_ui.sort),
+                ordSelected=request.args.get('ordSelected', 'asc'),
+                )
+
+    session.close()
+
+    return jsonify(
+            batch=batch, blank=int(not batch), modellist=modellist,
+            modelcount=modelcount, celllist=celllist, details=details,
+            results=results, error=error,
+            )
 
+
+@app.route('/update_batch')
+def update_batch():
+    """Update current batch selection after an analysis is selected."""
+
+    session = Session()
+    aSelected = request.args.get('aSelected', type=str)
+    batch = get_analysis_batch(session, aSelected)
     session.close()
 
-    return jsonify(batch=batch, blank=blank)
+    return jsonify(batch=batch, blank=int(not batch))
 
 
 @app.route('/update_models')
@@ -255,28 +314,34 @@ def update_models():
     """Update the list of modelnames in the model selector after an
     analysis is selected.
 
+    Modelnames are returned limit at a time (n_ui.modelpage by default, at
+    most n_ui.maxpagesize), starting at offset, along with the total number
+    of models in the tree as modelcount.
+
     """
 
     session = Session()
-
     aSelected = request.args.get('aSelected', type=str)
-
-    modeltree = (
-            session.query(NarfAnalysis.modeltree)
-            .filter(NarfAnalysis.name == aSelected)
-            .first()
-            )
-    # Pass modeltree string from NarfAnalysis to a ModelFinder constructor,
-    # which will use a series of internal methods to convert the tree string
-    # to a list of model names.
-    if modeltree:
-        mf = ModelFinder(modeltree[0])
-    else:
-        return jsonify(modellist="Model tree not found.")
-
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = request.args.get('limit', n_ui.modelpage, type=int)
+    limit = max(1, min(limit, n_ui.maxpagesize))
+    try:
+        modellist, modelcount = get_analysis_models(
+                session, aSelected, offset, limit,
+                )
+    except ModelTreeSyntaxError as e:
+        log.info(e)
+        session.close()
+        return jsonify(
+                modellist=[], modelcount=0,
+                error="Could not parse model tree: {0}".format(e),
+                )
     session.close()
 
-    return jsonify(modellist=mf.modellist)
+    if modellist is None:
+        return jsonify(modellist="Model tree not found.", modelcount=0)
+
+    return jsonify(modellist=modellist, modelcount=modelcount, offset=offset)
 
 
 @app.route('/update_cells')
@@ -293,20 +358,20 @@ def update_cells():
     bSelected = request.args.get('bSelected')
     aSelected = request.args.get('aSelected')
 
-    celllist = [
-            i[0] for i in
-            session.query(NarfBatches.cellid)
-            .filter(NarfBatches.batch == bSelected[:3])
-            .all()
-            ]
+    celllist = get_batch_cells(session, bSelected)
 
-    batchname = (
-            session.query(sBatch)
-            .filter(sBatch.id == bSelected[:3])
-            .first()
-            )
-    if batchname:
-        batch = str(bSelected[:3] + ': ' + batchname.name)
+    batchname = get_batch_catalog(session).get(bSelected[:3], None)
+    if batchname is None:
+        # Batch isn't in NarfBatches yet, so it won't be in the catalog.
+        batchname = (
+                session.query(sBatch.name)
+                .filter(sBatch.id == bSelected[:3])
+                .first()
+                )
+        if batchname:
+            batchname = batchname.name
+    if batchname is not None:
+        batch = str(bSelected[:3] + ': ' + batchname)
     else:
         batch = bSelected
     analysis = (
@@ -324,6 +389,187 @@ def update_cells():
     return jsonify(celllist=celllist)
 
 
+@app.route('/query_models')
+def query_models():
+    """Return the modelnames that contain every keyword in include[] and
+    none of the keywords in exclude[].
+
+    A keyword can be limited to one position in the modelname with '@',
+    ex: fir15@2 only matches models with fir15 as their third keyword.
+    Models come from the selected analysis' modeltree, or from the distinct
+    modelnames in NarfResults (for the selected batch, if any) if
+    source=results. Returns limit names (n_ui.modelpage by default, at
+    most n_ui.maxpagesize) starting at offset, along with the total number
+    of matches as modelcount. Trees too big to index (see
+    ModelIndex.TREE_INDEX_MAX_MODELS) return an error instead.
+
+    """
+
+    include = request.args.getlist('include[]')
+    exclude = request.args.getlist('exclude[]')
+    source = request.args.get('source', 'analysis')
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = request.args.get('limit', n_ui.modelpage, type=int)
+    limit = max(1, min(limit, n_ui.maxpagesize))
+
+    session = Session()
+    try:
+        if source == 'results':
+            bSelected = request.args.get('bSelected', '')
+            batch = bSelected[:3] if bSelected else None
+            index = get_results_index(session, batch)
+        else:
+            aSelected = request.args.get('aSelected', type=str)
+            modeltree = (
+                    session.query(NarfAnalysis.modeltree)
+                    .filter(NarfAnalysis.name == aSelected)
+                    .first()
+                    )
+            if not modeltree:
+                session.close()
+                return jsonify(
+                        modellist=[], modelcount=0,
+                        error="Model tree not found.",
+                        )
+            index = get_tree_index(modeltree[0])
+        modellist, modelcount = index.query(include, exclude, offset, limit)
+    except ValueError as e:
+        # Includes ModelTreeSyntaxError and ModelTreeTooLargeError
+        log.info(e)
+        session.close()
+        return jsonify(modellist=[], modelcount=0, error=str(e))
+    session.close()
+
+    return jsonify(modellist=modellist, modelcount=modelcount, offset=offset)
+
+
+@app.route('/autocomplete')
+def autocomplete():
+    """Return the cellids or modelnames that best match the text in q, for
+    suggesting selections as the user types.
+
+    kind=cells searches the cells in the selected batch. kind=models
+    searches the models in the selected analysis' modeltree, or the
+    distinct modelnames in NarfResults if source=results. Matches are
+    ranked by TrigramIndex and returned limit at a time
+    (n_ui.autocompletelimit by default) starting at offset, along with the
+    total number of matches.
+
+    """
+
+    kind = request.args.get('kind', 'cells')
+    q = request.args.get('q', '')
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', n_ui.autocompletelimit, type=int)
+    limit = max(1, min(limit, n_ui.maxpagesize))
+
+    session = Session()
+    try:
+        index = get_search_index(session, kind, request.args)
+    except ValueError as e:
+        # Includes ModelTreeSyntaxError
+        log.info(e)
+        session.close()
+        return jsonify(items=[], total=0, offset=offset, error=str(e))
+    session.close()
+
+    if index is None:
+        return jsonify(items=[], total=0, offset=offset)
+    items, total = index.search(q, offset, limit)
+
+    return jsonify(items=items, total=total, offset=offset)
+
+
+def get_search_index(session, kind, args):
+    """Returns the cached TrigramIndex for an autocomplete request, or None
+    if nothing is selected to search. See autocomplete for the arguments.
+
+    Raises ValueError for an unknown kind.
+
+    """
+
+    bSelected = args.get('bSelected', '')
+    batch = bSelected[:3] if bSelected else None
+    if kind == 'cells':
+        if batch is None:
+            return None
+        return search_index_cache.get_or_load(
+                ('cells', batch),
+                lambda: TrigramIndex(
+                    get_cell_quality(session, batch)['cellid'].tolist()
+                    ),
+                )
+    elif kind == 'models':
+        if args.get('source', 'analysis') == 'results':
+            return search_index_cache.get_or_load(
+                    ('results', batch),
+                    lambda: TrigramIndex(
+                        get_results_index(session, batch).modelnames
+                        ),
+                    )
+        modeltree = (
+                session.query(NarfAnalysis.modeltree)
+                .filter(NarfAnalysis.name == args.get('aSelected'))
+                .first()
+                )
+        if not modeltree:
+            return None
+        return search_index_cache.get_or_load(
+                ('models', tree_key(modeltree[0] or '')),
+                lambda: TrigramIndex(get_tree_index(modeltree[0]).modelnames),
+                )
+    else:
+        raise ValueError("Unknown autocomplete kind: {0}".format(kind))
+
+
+def get_analysis_batch(session, aSelected):
+    """Returns the batch string saved with analysis aSelected, or an empty
+    string if the analysis doesn't exist or has no batch.
+
+    """
+
+    batch = (
+            session.query(NarfAnalysis.batch)
+            .filter(NarfAnalysis.name == aSelected)
+            .first()
+            )
+    if (batch is None) or (batch.batch is None):
+        return ''
+    return batch.batch
+
+
+def get_analysis_models(session, aSelected, offset=0, limit=None):
+    """Returns a tuple of (modelnames, total count) for analysis aSelected,
+    with at most limit modelnames starting from offset, or (None, 0) if
+    the analysis doesn't exist.
+
+    Raises ModelTreeSyntaxError if the analysis' modeltree can't be parsed.
+
+    """
+
+    modeltree = (
+            session.query(NarfAnalysis.modeltree)
+            .filter(NarfAnalysis.name == aSelected)
+            .first()
+            )
+    if not modeltree:
+        return (None, 0)
+    # Convert the tree string to a list of model names with ModelFinder,
+    # unless the same page of the tree has already been expanded.
+    return find_models(modeltree[0], offset, limit)
+
+
+def get_batch_cells(session, bSelected):
+    """Returns the list of cellids for the batch in bSelected, which may
+    include the batch description after the numerals.
+
+    """
+
+    # Cellids come from the cached NarfBatches quality table, which the
+    # plot and custom script cell filters also use.
+    return get_cell_quality(session, bSelected[:3])['cellid'].tolist()
+
+
 @app.route('/update_results')
 def update_results():
     """Update the results table after a batch, cell or model selection
@@ -374,12 +620,7 @@ def update_results():
             .filter(NarfResults.batch == bSelected)
             .filter(NarfResults.cellid.in_(cSelected))
             .filter(NarfResults.modelname.in_(mSelected))
-            .filter(or_(
-                    int(user.sec_lvl) == 9,
-                    NarfResults.public == '1',
-                    NarfResults.labgroup.ilike('%{0}%'.format(user.labgroup)),
-                    NarfResults.username == user.username,
-                    ))
+            .filter(results_visible_to(user))
             .order_by(ordSelected(getattr(NarfResults, sortSelected)))
             .limit(rowlimit).statement,
             session.bind
@@ -394,6 +635,354 @@ def update_results():
     return jsonify(resultstable=resultstable)
 
 
+@app.route('/results_page')
+def results_page():
+    """Return one page of the results table as JSON.
+
+    Pages are found with a keyset cursor on (sort column, id) instead of an
+    offset, so each page costs the same no matter how deep into the results
+    it is. Rows are returned as lists in the same order as the entries in
+    columns. Pass the returned next_cursor back as cursor to get the next
+    page; it will be null after the last page.
+
+    """
+
+    user = get_current_user()
+    session = Session()
+
+    bSelected = request.args.get('bSelected', '')
+    cSelected = request.args.getlist('cSelected[]')
+    mSelected = request.args.getlist('mSelected[]')
+    colSelected = request.args.getlist('colSelected[]')
+    if (len(bSelected) == 0) or (not cSelected) or (not mSelected):
+        session.close()
+        return jsonify(columns=[], rows=[], next_cursor=None)
+
+    try:
+        page = get_results_page(
+                session, user, bSelected, cSelected, mSelected, colSelected,
+                pageSize=request.args.get('pageSize', n_ui.rowlimit, type=int),
+                sortSelected=request.args.get('sortSelected', n_ui.sort),
+                ordSelected=request.args.get('ordSelected', 'asc'),
+                cursor=request.args.get('cursor', None),
+                )
+    except (ValueError, TypeError) as e:
+        log.info(e)
+        session.close()
+        return jsonify(error='Invalid cursor.')
+    session.close()
+
+    return jsonify(**page)
+
+
+def get_results_page(session, user, bSelected, cSelected, mSelected,
+                     colSelected, pageSize=None, sortSelected=None,
+                     ordSelected='asc', cursor=None):
+    """Returns a dict with the columns, rows and next_cursor entries for one
+    page of results, as described in results_page.
+
+    Raises ValueError or TypeError if cursor can't be decoded.
+
+    """
+
+    bSelected = bSelected[:3]
+    if pageSize is None:
+        pageSize = n_ui.rowlimit
+    pageSize = max(1, min(pageSize, n_ui.maxpagesize))
+    if sortSelected not in RESULTS_COLUMNS:
+        sortSelected = n_ui.sort
+
+    colnames = copy.copy(n_ui.required_cols)
+    colnames += [
+            c for c in colSelected
+            if (c in RESULTS_COLUMNS) and (c not in colnames)
+            ]
+    sort_col = getattr(NarfResults, sortSelected)
+    # Sort column and id are always queried (but only returned if they
+    # were selected) since the cursor is built from them.
+    cols = [getattr(NarfResults, c) for c in colnames]
+    cols += [sort_col, NarfResults.id]
+
+    query = (
+            Query(cols, session)
+            .filter(NarfResults.batch == bSelected)
+            .filter(NarfResults.cellid.in_(cSelected))
+            .filter(NarfResults.modelname.in_(mSelected))
+            .filter(results_visible_to(user))
+            )
+    if cursor:
+        last_value, last_id = decode_cursor(cursor)
+        query = query.filter(
+                keyset_filter(sort_col, last_value, last_id, ordSelected)
+                )
+    order = desc if ordSelected == 'desc' else asc
+    # Fetch one extra row to find out if there is another page.
+    rows = (
+            query.order_by(order(sort_col), order(NarfResults.id))
+            .limit(pageSize + 1)
+            .all()
+            )
+
+    next_cursor = None
+    if len(rows) > pageSize:
+        rows = rows[:pageSize]
+        next_cursor = encode_cursor(rows[-1][-2], rows[-1][-1])
+    n = len(colnames)
+    rows = [list(r[:n]) for r in rows]
+    columns = [
+            {'name': c, 'type': str(getattr(NarfResults, c).type)}
+            for c in colnames
+            ]
+
+    return {'columns': columns, 'rows': rows, 'next_cursor': next_cursor}
+
+
+EXPORT_FORMATS = {
+        'csv': 'text/csv',
+        'ndjson': 'application/x-ndjson',
+        'parquet': 'application/octet-stream',
+        }
+
+
+@app.route('/export_results')
+def export_results():
+    """Stream the results for the selected batch, cells, models and columns
+    as a csv, ndjson or parquet file.
+
+    Results are read from the database n_ui.exportchunk rows at a time and
+    each chunk is sent as soon as it's ready, so memory use doesn't grow
+    with the size of the export.
+
+    """
+
+    user = get_current_user()
+
+    bSelected = request.args.get('bSelected', '')
+    cSelected = request.args.getlist('cSelected[]')
+    mSelected = request.args.getlist('mSelected[]')
+    colSelected = request.args.getlist('colSelected[]')
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return Response(
+                "Unknown export format: {0}".format(fmt), status=400,
+                )
+    if (len(bSelected) == 0) or (not cSelected) or (not mSelected):
+        return Response(
+                "Must select a batch and one or more cells and models "
+                "before exporting results.", status=400,
+                )
+    bSelected = bSelected[:3]
+
+    colnames = copy.copy(n_ui.required_cols)
+    colnames += [
+            c for c in colSelected
+            if (c in RESULTS_COLUMNS) and (c not in colnames)
+            ]
+    cols = [getattr(NarfResults, c) for c in colnames]
+    statement = (
+            Query(cols)
+            .filter(NarfResults.batch == bSelected)
+            .filter(NarfResults.cellid.in_(cSelected))
+            .filter(NarfResults.modelname.in_(mSelected))
+            .filter(results_visible_to(user))
+            .order_by(asc(NarfResults.id))
+            .statement
+            )
+
+    chunks = read_results_chunks(statement, n_ui.exportchunk)
+    if fmt == 'csv':
+        body = csv_chunks(chunks)
+    elif fmt == 'ndjson':
+        body = ndjson_chunks(chunks)
+    else:
+        try:
+            body = parquet_chunks(chunks, colnames)
+        except ImportError as e:
+            log.info(e)
+            return Response(
+                    "Parquet export requires pyarrow to be installed.",
+                    status=501,
+                    )
+
+    filename = 'batch{0}_results.{1}'.format(bSelected, fmt)
+    return Response(
+            body, mimetype=EXPORT_FORMATS[fmt],
+            headers={
+                'Content-Disposition': 'attachment; filename=' + filename,
+                },
+            )
+
+
+def read_results_chunks(statement, chunksize):
+    """Yields DataFrames of up to chunksize rows for statement, using a
+    server-side cursor so the full result set is never held in memory.
+
+    """
+
+    session = Session()
+    connection = session.bind.connect().execution_options(
+            stream_results=True
+            )
+    try:
+        for chunk in psql.read_sql_query(
+                statement, connection, chunksize=chunksize
+                ):
+            yield chunk
+    finally:
+        connection.close()
+        session.close()
+
+
+def csv_chunks(chunks):
+    header = True
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=header)
+        header = False
+
+
+def ndjson_chunks(chunks):
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        lines = chunk.to_json(
+                orient='records', lines=True, date_format='iso',
+                )
+        yield lines.rstrip('\n') + '\n'
+
+
+class _ParquetSink():
+    """Minimal writable file object that hands back whatever has been
+    written to it since the last call to drain().
+
+    """
+
+    def __init__(self):
+        self.buffers = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.buffers.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.buffers)
+        self.buffers = []
+        return data
+
+
+def parquet_chunks(chunks, colnames):
+    """Writes each chunk as a parquet row group and yields the bytes
+    for each one as they are written.
+
+    Raises ImportError right away if pyarrow isn't installed, before
+    any rows are read.
+
+    """
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Build the schema from the table definition so that every row group
+    # matches, even if a column happens to be all NULL in one chunk.
+    arrow_types = {
+            int: pa.int64(), float: pa.float64(), str: pa.string(),
+            datetime.datetime: pa.timestamp('us'),
+            }
+    fields = []
+    for c in colnames:
+        try:
+            python_type = getattr(NarfResults, c).type.python_type
+        except NotImplementedError:
+            python_type = str
+        fields.append(pa.field(c, arrow_types.get(python_type, pa.string())))
+    schema = pa.schema(fields)
+
+    def generate():
+        sink = _ParquetSink()
+        writer = pq.ParquetWriter(sink, schema)
+        for chunk in chunks:
+            table = pa.Table.from_pandas(
+                    chunk, schema=schema, preserve_index=False,
+                    )
+            writer.write_table(table)
+            yield sink.drain()
+        writer.close()
+        yield sink.drain()
+
+    return generate()
+
+
+def results_visible_to(user):
+    """Returns a filter clause that limits a NarfResults query to the
+    results that user has permission to see.
+
+    """
+
+    return or_(
+            int(user.sec_lvl) == 9,
+            NarfResults.public == '1',
+            NarfResults.labgroup.ilike('%{0}%'.format(user.labgroup)),
+            NarfResults.username == user.username,
+            )
+
+
+def encode_cursor(value, id):
+    """Packs the sort value and id of the last row on a page into an opaque,
+    url-safe cursor string.
+
+    """
+
+    raw = json.dumps([value, id], default=str)
+    return urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor, returns a (value, id) tuple."""
+    value, id = json.loads(urlsafe_b64decode(cursor.encode('ascii')))
+    return (value, int(id))
+
+
+def keyset_filter(col, value, id, order='asc'):
+    """Returns a filter clause that selects the rows that come after
+    (value, id) when sorted by col then id in the given order.
+
+    NULL sort values are assumed to come first for ascending order and
+    last for descending order, which is how MySQL sorts them.
+
+    """
+
+    if order == 'desc':
+        if value is None:
+            return and_(col.is_(None), NarfResults.id < id)
+        return or_(
+                col < value,
+                and_(col == value, NarfResults.id < id),
+                col.is_(None),
+                )
+    else:
+        if value is None:
+            return or_(
+                    and_(col.is_(None), NarfResults.id > id),
+                    col.isnot(None),
+                    )
+        return or_(
+                col > value,
+                and_(col == value, NarfResults.id > id),
+                )
+
+
 @app.route('/update_analysis')
 def update_analysis():
     """Update list of analyses after a tag and/or filter selection changes."""
@@ -452,12 +1041,20 @@ def update_analysis_details():
     """
 
     session = Session()
+    aSelected = request.args.get('aSelected')
+    detailsHTML = get_analysis_details(session, aSelected)
+    session.close()
+
+    return jsonify(details=detailsHTML)
+
+
+def get_analysis_details(session, aSelected):
+    """Returns the html for the analysis details popover."""
+
     # TODO: Find a better/centralized place to store these options.
     # Columns to display in detail popup - add/subtract here if desired.
     detailcols = n_ui.detailcols
 
-    aSelected = request.args.get('aSelected')
-
     cols = [
             getattr(NarfAnalysis,c) for c in detailcols
             if hasattr(NarfAnalysis,c)
@@ -487,9 +1084,7 @@ def update_analysis_details():
                     <p>%s</p>
                     """%(col,results.get_value(0, col))
 
-    session.close()
-
-    return jsonify(details=detailsHTML)
+    return detailsHTML
 
 
 @app.route('/update_status_options')
@@ -498,16 +1093,7 @@ def update_status_options():
     user = get_current_user()
     session = Session()
 
-    statuslist = [
-        i[0] for i in
-        session.query(NarfAnalysis.status)
-        .filter(or_(
-                NarfAnalysis.public == '1',
-                NarfAnalysis.labgroup.ilike('%{0}%'.format(user.labgroup)),
-                NarfAnalysis.username == user.username,
-                ))
-        .distinct().all()
-        ]
+    statuslist = analysis_catalog.statuslist(session, user)
 
     session.close()
 
@@ -520,25 +1106,7 @@ def update_tag_options():
     user = get_current_user()
     session = Session()
 
-    tags = [
-        i[0].split(",") for i in
-        session.query(NarfAnalysis.tags)
-        .filter(or_(
-                NarfAnalysis.public == '1',
-                NarfAnalysis.labgroup.ilike('%{0}%'.format(user.labgroup)),
-                NarfAnalysis.username == user.username,
-                ))
-        .distinct().all()
-        ]
-    # Flatten list of lists into a single list of all tag strings
-    # and remove leading and trailing whitespace.
-    taglistbldupspc = [i for sublist in tags for i in sublist]
-    taglistbldup = [t.strip() for t in taglistbldupspc]
-    # Reform the list with only unique tags
-    taglistbl = list(set(taglistbldup))
-    # Finally, remove any blank tags and sort the list.
-    taglist = [t for t in taglistbl if t != '']
-    taglist.sort()
+    taglist = analysis_catalog.taglist(session, user)
 
     session.close()
 
@@ -579,6 +1147,15 @@ def edit_analysis():
     #TODO: add checks to require input inside form fields
     #      or allow blank so that people can erase stuff?
 
+    # Don't save a tree that can't be parsed, since no models could be
+    # shown for it. Blank trees are still allowed.
+    if eTree and eTree.strip():
+        try:
+            parse_modeltree(eTree)
+        except ModelTreeSyntaxError as e:
+            session.close()
+            return jsonify(success='Analysis not saved: \n' + str(e))
+
     # Turned this off for now -- can re-enable when rule needs are more stable
     # Make sure the keyword combination is valid using nems.keyword_rules
     #try:
@@ -613,6 +1190,10 @@ def edit_analysis():
                 a.lastmod = modTime
             except:
                 a.lastmod = str(modTime)
+            if a.modeltree != eTree:
+                # Old tree won't be requested again, so free its model list.
+                invalidate_models(a.modeltree)
+                invalidate_model_indexes(a.modeltree)
             a.modeltree = eTree
         else:
             log.info("You do not have permission to modify this analysis.")
@@ -654,6 +1235,9 @@ def edit_analysis():
     #log.info("-----------------\n\n")
     addedName = a.name
     session.commit()
+    # Refresh only this analysis in the catalog so the filter lists
+    # stay current without rebuilding from the database.
+    analysis_catalog.update(a)
     session.close()
 
     # After handling submissions, return user to main page so that it
@@ -754,6 +1338,7 @@ def delete_analysis():
         success = True
         session.delete(result)
         session.commit()
+        analysis_catalog.remove(aSelected)
     else:
         log.info("You do not have permission to delete this analysis.")
         return jsonify(success=success)
@@ -894,34 +1479,7 @@ def make_jerb_json():
             a.name for a in analyses
             ]
 
-    batchids = [
-            i[0] for i in
-            session.query(NarfBatches.batch)
-            .distinct()
-            #.filter(or_(
-            #        int(user.sec_lvl) == 9,
-            #        NarfBatches.public == '1',
-            #        NarfBatches.labgroup.ilike('%{0}%'.format(user.labgroup)),
-            #        NarfBatches.username == user.username,
-            #        ))
-            .all()
-            ]
-    batchnames = []
-    for i in batchids:
-        name = (
-                session.query(sBatch.name)
-                .filter(sBatch.id == i)
-                .first()
-                )
-        if not name:
-            batchnames.append('')
-        else:
-            batchnames.append(name.name)
-    batchlist = [
-            (batch + ': ' + batchnames[i])
-            for i, batch in enumerate(batchids)
-            ]
-    batchlist.sort()
+    batchlist = format_batchlist(get_batch_catalog(session))
 
     session.close()
 
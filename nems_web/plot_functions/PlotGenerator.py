@@ -13,27 +13,29 @@ an html document.
 """
 
 import logging
-import io
-import math
 import statistics
 import itertools
+import json
 
-from bokeh.layouts import gridplot
+from bokeh.layouts import gridplot, column, row, widgetbox
 from bokeh.plotting import figure
 from bokeh.embed import components
 from bokeh.models import (
         ColumnDataSource, HoverTool, SaveTool, WheelZoomTool,
-        PanTool, ResetTool, Range1d, FactorRange, Title
+        PanTool, ResetTool, Range1d, FactorRange, Title, CustomJS,
         )
+from bokeh.models.widgets import Select
 from bokeh.models.glyphs import VBar, Circle, Glyph
 import pandas as pd
 import numpy as np
-import scipy.stats as st
-import matplotlib.pyplot as plt, mpld3
-import matplotlib.patches as mpatch
-from matplotlib.transforms import Bbox
 
 import nems_web.utilities.pruffix as prx
+import nems_web.utilities.paired_stats as ps
+from nems_web.utilities.outliers import outlier_mask
+from nems_web.utilities.resampling import bootstrap_ci
+from nems_web.utilities.summary import summarize
+from nems_web.utilities.categories import categorize, rename_models
+from nems_web.plot_functions.render_service import render_service
 
 log = logging.getLogger(__name__)
 #NOTE: All subclasses of PlotGenerator should be added to the PLOT_TYPES
@@ -53,6 +55,23 @@ PLOT_TYPES = [
 
 # Specify the number of columns to use for gridplots
 GRID_COLS = 1
+# Scatter_Plot draws one figure per pair of models up to this many pairs.
+# Past that, it draws a single figure with selectors for the x and y models
+# so that the page only carries one copy of the data.
+SCATTER_MAX_PAIRS = 3
+# Plot titles for each test in paired_stats.TESTS
+TEST_TITLES = {
+        'wilcoxon': 'Wilcoxon Signed Test',
+        'sign': 'Sign Test',
+        'permutation': 'Paired Permutation Test',
+        }
+# Resampling options for Bar_Plot confidence intervals and the
+# Significance_Plot permutation test. The seed is fixed so that the same
+# selections always give the same plot.
+BOOTSTRAP_SAMPLES = 1000
+CI_LEVEL = 0.95
+PERMUTATIONS = 10000
+RESAMPLE_SEED = 0
 # Appearance options for circle glyphs (ex. scatter plot)
 CIRCLE_FILL = 'navy'
 CIRCLE_SIZE = 5
@@ -85,11 +104,14 @@ class PlotGenerator():
             self.measure = [measure] + extra_cols
         self.fair = fair
         self.outliers = outliers
+        self.outlier_counts = {}
         log.debug("Checking for common prefixes in modelnames...")
         self.abbr, self.pre, self.suf = prx.find_common(models)
         log.debug("Got back:\nabbr:{}\npre:{}\nsuff:{}\n"
                   .format(self.abbr, self.pre, self.suf))
-        data.replace(models, self.abbr, inplace=True)
+        # Store cellid and modelname as categoricals, so abbreviating only
+        # renames each model's category instead of replacing every value.
+        rename_models(categorize(data), models, self.abbr)
         log.debug("Replaced modelnames with abbreviations.")
         self.models = self.abbr
         log.info("Forming data array inside PlotGenerator...")
@@ -161,133 +183,42 @@ class PlotGenerator():
 
         """
 
-        # TODO: figure out a good way to form this from the existing
-        #       dataframe instead of making a new one then copying over.
-        #       Should be able to just re-index then apply some
-        #       lambda function over vectorized dataframe for filtering?
-
-        celllist = [
-                cell for cell in
-                list(set(data['cellid'].values.tolist()))
-                ]
+        celllist = data['cellid'].unique().tolist()
         modellist = self.models
         # Use lists of unique cell and model names to form a multiindex.
         multiIndex = pd.MultiIndex.from_product(
                 [celllist,modellist], names=['cellid','modelname'],
                 )
-        newData = pd.DataFrame(
-                index = multiIndex, columns = self.measure,
+        # Keep the first row recorded for each cell + model combination,
+        # then align the rows to the full cell x model product in one pass.
+        # Combinations that were never fit come back as rows of NaN.
+        rows = (
+                data.drop_duplicates(subset=['cellid', 'modelname'])
+                .set_index(['cellid', 'modelname'])
+                .reindex(multiIndex)
                 )
+        newData = rows.reindex(columns=self.measure)
 
-        newData.sort_index()
-
-        for c in celllist:
-            for m in modellist:
-                dataRow = data.loc[(data.cellid == c) & (data.modelname == m)]
-
-                # Add column values for any additional columns specificed
-                # in plot class (ex: n_parms for pareto plot)
-                #if self.extra_cols:
-                #    for col in self.extra_cols:
-                #        try:
-                #            colval = dataRow[col].values.tolist()[0]
-                #        except Exception as e:
-                #            # TODO: Is this a good way to do this?
-                #            #       This requires that all extra columns also
-                #            #       have values for every cell/model
-                #            #       if fair is checked.
-                #            colval = math.nan
-                #            log.info(e)
-                #        finally:
-                #            newData[col].loc[c,m] = colval
-
-                for meas in self.measure:
-                    value = np.nan
-                    newData[meas].loc[c,m] = value
-                    # If loop hits a continue, value will be left as NaN.
-                    # Otherwise, will be assigned a value from data
-                    # after passing all checks.
-                    try:
-                        value = dataRow[meas].values.tolist()[0]
-                    except Exception as e:
-                        # Error should mean no value was recorded,
-                        # so leave as NaN.
-                        # No need to run outlier checks if value is missing.
-                        log.info("No %s recorded for %s,%s"%(meas,c,m))
-                        continue
-
-                    if not self.outliers:
-                        # If outliers is false, run a bunch of checks based on
-                        # measure and if a check fails, step out of the loop.
-
-                        # Comments for each check are copied from
-                        # from Narf_Analysis : compute_data_matrix
-
-                        # "Drop r_test values below threshold"
-                        a1 = (meas == 'r_test')
-                        b1 = (value < dataRow['r_floor'].values.tolist()[0])
-                        a2 = (meas == 'r_ceiling')
-                        b2 = (
-                            dataRow['r_test'].values.tolist()[0]
-                            < dataRow['r_floor'].values.tolist()[0]
-                            )
-                        a3 = (meas == 'r_floor')
-                        b3 = b1
-                        if (a1 and b1) or (a2 and b2) or (a3 and b3):
-                            continue
-
-                        # "Drop MI values greater than 1"
-                        a1 = (meas == 'mi_test')
-                        b1 = (value > 1)
-                        a2 = (meas == 'mi_fit')
-                        b2 = (0 <= value <= 1)
-                        if (a1 and b1) or (a2 and not b2):
-                            continue
-
-                        # "Drop MSE values greater than 1.1"
-                        a1 = (meas == 'mse_test')
-                        b1 = (value > 1.1)
-                        a2 = (meas == 'mse_fit')
-                        b2 = b1
-                        if (a1 and b1) or (a2 and b2):
-                            continue
-
-                        # "Drop NLOGL outside normalized region"
-                        a1 = (meas == 'nlogl_test')
-                        b1 = (-1 <= value <= 0)
-                        a2 = (meas == 'nlogl_fit')
-                        b2 = b1
-                        if (a1 and b1) or (a2 and b2):
-                            continue
-
-                        # TODO: is this still used? not listed in NarfResults
-                        # "Drop gamma values that are too low"
-                        a1 = (meas == 'gamma_test')
-                        b1 = (value < 0.15)
-                        a2 = (meas == 'gamma_fit')
-                        b2 = b1
-                        if (a1 and b1) or (a2 and b2):
-                            continue
-
-                        # TODO: is an outlier check needed for cohere_test
-                        #       and/or cohere_fit?
-
-                    # If value existed and passed outlier checks,
-                    # re-assign it to the proper DataFrame position
-                    # to overwrite the NaN value.
-                    newData[meas].loc[c,m] = value
+        if not self.outliers:
+            # If outliers is false, mask out any values that fail the
+            # check for their measure. Masked values are left as NaN.
+            keep, self.outlier_counts = outlier_mask(rows, self.measure)
+            log.debug("Values dropped as outliers: {}"
+                      .format(self.outlier_counts))
+            newData = newData.where(keep)
 
         if self.fair:
-            # If fair is checked, drop all rows that contain a NaN value for
-            # any column.
-            for c in celllist:
-                for m in modellist:
-                    if newData.loc[c,m].isnull().values.any():
-                        newData.drop(c, level='cellid', inplace=True)
-                        log.debug("Dropping cellid {}, not fit by model {}"
-                                  .format(c, m))
-                        break
-
+            # If fair is checked, drop all rows for any cellid that
+            # contains a NaN value in any column for any model.
+            missing = newData.isnull().any(axis=1)
+            unfair = missing.groupby(level='cellid').any()
+            unfair = unfair[unfair].index
+            if len(unfair):
+                log.debug("Dropping cellids not fit by every model: {}"
+                          .format(unfair.tolist()))
+            newData = newData[
+                    ~newData.index.get_level_values('cellid').isin(unfair)
+                    ]
 
         # Swap the 0th and 1st levels so that modelname is the primary index,
         # since most plots group by model.
@@ -326,12 +257,20 @@ class Scatter_Plot(PlotGenerator):
     def generate_plot(self):
         """Iteratively reformats and plots self.data for each cell+model combo.
 
+        If there are more than SCATTER_MAX_PAIRS pairs of models, draws
+        a single scatter matrix plot instead (see generate_matrix_plot).
+
         TODO: Finish this doc
 
         """
 
-        plots = []
         modelnames = self.data.index.levels[0].tolist()
+        npairs = len(modelnames)*(len(modelnames) - 1)//2
+        if npairs > SCATTER_MAX_PAIRS:
+            self.generate_matrix_plot()
+            return
+
+        plots = []
 
         # Iterate over a list of tuples representing all unique pairs of models.
         for pair in list(itertools.combinations(modelnames,2)):
@@ -424,6 +363,85 @@ class Scatter_Plot(PlotGenerator):
                     'Make sure you selected two models.'
                     )
 
+    def generate_matrix_plot(self):
+        """Plots every model against every other model in one figure.
+
+        The measure for each model is stored once, as one column per model
+        in a single ColumnDataSource with one row per cell. Two selectors
+        pick the x and y models, and copy those columns into the plotted
+        x_values and y_values columns in the browser. This keeps the size
+        of the returned script proportional to the number of models rather
+        than to the number of pairs.
+
+        """
+
+        measure = self.measure[0]
+        modelnames = self.data.index.levels[0].tolist()
+        # One row per cell, one column per model.
+        wide = (
+                self.data[measure].unstack(level='modelname')
+                .reindex(columns=modelnames)
+                )
+        keys = ['m{0}'.format(i) for i in range(len(modelnames))]
+        columns = {k: wide[m].values for k, m in zip(keys, modelnames)}
+        columns['cellid'] = wide.index.astype(str).tolist()
+        columns['x_values'] = columns[keys[0]].copy()
+        columns['y_values'] = columns[keys[1]].copy()
+        source = ColumnDataSource(data=columns)
+
+        means = wide.mean()
+        medians = wide.median()
+        labels = {
+                k: ("{0}, mean: {1:5.4f}, median: {2:5.4f}"
+                    .format(m, means[m], medians[m]))
+                for k, m in zip(keys, modelnames)
+                }
+        tools = [
+                PanTool(), SaveTool(), WheelZoomTool(),
+                ResetTool(), self.create_hover(),
+                ]
+        p = figure(
+                x_range=[0,1], y_range=[0,1],
+                x_axis_label=labels[keys[0]], y_axis_label=labels[keys[1]],
+                title=("{0}, prefix: {1}, suffix: {2}"
+                       .format(measure, self.pre, self.suf)),
+                tools=tools, responsive=True,
+                toolbar_location=TOOL_LOC, toolbar_sticky=TOOL_STICK,
+                output_backend="svg"
+                )
+        glyph = Circle(
+                x='x_values', y='y_values', size=CIRCLE_SIZE,
+                fill_color=CIRCLE_FILL, fill_alpha=CIRCLE_ALPHA,
+                )
+        p.add_glyph(source, glyph)
+        p.line([0,1], [0,1], line_width=1, color='black')
+
+        options = [(k, str(m)) for k, m in zip(keys, modelnames)]
+        select_x = Select(title='Model x:', value=keys[0], options=options)
+        select_y = Select(title='Model y:', value=keys[1], options=options)
+        callback = CustomJS(
+                args=dict(
+                        source=source, select_x=select_x, select_y=select_y,
+                        xaxis=p.xaxis[0], yaxis=p.yaxis[0],
+                        ),
+                code="""
+                    var labels = %s;
+                    var data = source.data;
+                    data['x_values'] = data[select_x.value].slice();
+                    data['y_values'] = data[select_y.value].slice();
+                    xaxis.axis_label = labels[select_x.value];
+                    yaxis.axis_label = labels[select_y.value];
+                    source.change.emit();
+                    """ % json.dumps(labels),
+                )
+        select_x.callback = callback
+        select_y.callback = callback
+
+        layout = column(
+                widgetbox(select_x, select_y), p, sizing_mode='scale_width',
+                )
+        self.script, self.div = components(layout)
+
 
 class Bar_Plot(PlotGenerator):
     """Defines the class used to generate a mean-performance bar plot for
@@ -451,13 +469,17 @@ class Bar_Plot(PlotGenerator):
             <div>
                 <span class="hover-tooltip">stdev: @stdev</span>
             </div>
-            """
+            <div>
+                <span class="hover-tooltip">%d%% CI: @ci_low - @ci_high</span>
+            </div>
+            """%(CI_LEVEL*100)
 
         return HoverTool(tooltips=hover_html)
 
     def generate_plot(self):
-        """Calculates mean and standard deviation for measure(s) by model,
-        then generates a bar plot of model vs mean performance.
+        """Calculates mean, standard deviation and a bootstrap confidence
+        interval for measure(s) by model, then generates a bar plot of model
+        vs mean performance with the confidence interval drawn on each bar.
 
         TODO: Finish this doc.
 
@@ -474,38 +496,29 @@ class Bar_Plot(PlotGenerator):
         # TODO: hardcoded self.measure[0] for now, but should incorporate
         #       a for loop somewhere to subplot for each selected measure
 
-        # TODO: add significance information (see plot_bar_pretty
-        #       and randttest in narf_analysis)
-
-        # build new pandas series of stdev values to be added to dataframe
         # if want to show more info on tooltip in the future, just need
-        # to build an appropriate series to add and then build its tooltip
-        #in the create_hover function
+        # to add a column from the summary frame and then build its tooltip
+        # in the create_hover function
 
         modelnames = self.data.index.levels[0].tolist()
-        stdev_col = pd.Series(index=modelnames)
-        mean_col = pd.Series(index=modelnames)
-        median_col = pd.Series(index=modelnames)
-        n_cells_col = pd.Series(index=modelnames)
-        #for each model, find the stdev and mean over the measure values, then
-        #assign those values to new Series objects to use for the plot
-        for model in modelnames:
-            values = self.data[self.measure[0]].loc[model]
-            stdev = values.std(skipna=True)
-            mean = values.mean(skipna=True)
-            median = values.median(skipna=True)
-            if (math.isnan(stdev)) or (math.isnan(mean)) or (math.isnan(median)):
-                # If either statistic comes out as NaN, entire column was NaN,
-                # so model doesn't have the necessary data.
-                continue
-            stdev_col.at[model] = stdev
-            mean_col.at[model] = mean
-            median_col.at[model] = median
-            n_cells_col.at[model] = values.count()
+        summary = summarize(self.data, [self.measure[0]])[self.measure[0]]
+
+        # Bootstrap confidence interval for the mean of each model, drawing
+        # the same cells for every model in each resample.
+        matrix = (
+                self.data[self.measure[0]].unstack(level='modelname')
+                .reindex(columns=modelnames).values
+                )
+        ci_low, ci_high = bootstrap_ci(
+                matrix, nresamples=BOOTSTRAP_SAMPLES, level=CI_LEVEL,
+                seed=RESAMPLE_SEED,
+                )
 
         newData = pd.DataFrame.from_dict({
-                'stdev':stdev_col, 'mean':mean_col, 'median':median_col,
-                'n_cells':n_cells_col,
+                'stdev':summary['std'], 'mean':summary['mean'],
+                'median':summary['median'], 'n_cells':summary['count'],
+                'ci_low':pd.Series(ci_low, index=modelnames),
+                'ci_high':pd.Series(ci_high, index=modelnames),
                 })
         # Drop any models with NaN values, since that means they had no
         # performance data for one or more columns.
@@ -525,7 +538,7 @@ class Bar_Plot(PlotGenerator):
         xrange = FactorRange(factors=modelnames)
         yrange = Range1d(
                 start=0,
-                end=(max(newData['mean'])*1.5)
+                end=max(max(newData['mean'])*1.5, max(newData['ci_high']))
                 )
         p = figure(
                 x_range=xrange, x_axis_label=(
@@ -544,6 +557,10 @@ class Bar_Plot(PlotGenerator):
                 fill_color=VBAR_FILL, line_color='black'
                 )
         p.add_glyph(dat_source,glyph)
+        p.segment(
+                x0='index', y0='ci_low', x1='index', y1='ci_high',
+                source=dat_source, line_color='black', line_width=2,
+                )
 
         # workaround to prevent title and toolbar from overlapping
         grid = gridplot(
@@ -594,23 +611,14 @@ class Pareto_Plot(PlotGenerator):
                 ResetTool(),
                 ]
 
-        x_values = []
-        y_values = []
-        std_errors = []
-        models = self.data.index.levels[0].tolist()
-        for model in models:
-            values = self.data[self.measure[0]].loc[model].values
-            mean = np.mean(values)
-            stderr = np.around(st.sem(values, nan_policy='omit'), 5)
-            n_parms = self.data['n_parms'].loc[model].values[0]
-            x_values.append(n_parms)
-            y_values.append(mean)
-            std_errors.append(stderr)
-
+        summary = summarize(self.data, [self.measure[0], 'n_parms'])
         newData = pd.DataFrame.from_dict({
-                'stderr':std_errors, 'mean':y_values, 'n_parms':x_values,
-                'modelname':models,
+                'stderr':summary[self.measure[0]]['sem'].round(5),
+                'mean':summary[self.measure[0]]['mean'],
+                'n_parms':summary['n_parms']['first'],
+                'modelname':summary.index,
                 })
+        newData.reset_index(drop=True, inplace=True)
         # Drop any models with NaN values, since that means they had no
         # performance data for one or more columns.
         newData.dropna(axis=0, how='any', inplace=True)
@@ -641,11 +649,11 @@ class Pareto_Plot(PlotGenerator):
         hover.renderers = [circle_renderer]
         p.add_tools(hover)
         #p.circle(x_values, y_values, size=6, color="navy", alpha=0.7)
-        error_bars_x = []
-        error_bars_y = []
-        for i, std in enumerate(std_errors):
-            error_bars_x.append([x_values[i], x_values[i]])
-            error_bars_y.append([y_values[i] - std, y_values[i] + std])
+        error_bars_x = [[x, x] for x in newData['n_parms']]
+        error_bars_y = [
+                [y - std, y + std]
+                for y, std in zip(newData['mean'], newData['stderr'])
+                ]
         p.multi_line(
                 error_bars_x, error_bars_y, color="firebrick",
                 alpha=0.4, line_width=2,
@@ -694,59 +702,24 @@ class Tabular_Plot(PlotGenerator):
                     )
             return
 
-        columns = []
-        for m in self.measure:
-            if m == 'n_parms':
-                columns.append('n_parms')
+        # Zeros are treated as missing values for every measure in the table.
+        summary = summarize(self.data.replace(0, np.nan), self.measure)
+        # index = list of model names
+        # columns = list of measures, both mean and median
+        table = pd.DataFrame(index=summary.index.tolist())
+        for meas in self.measure:
+            if meas == 'n_parms':
+                table['n_parms'] = summary['n_parms']['first'].values
                 continue
-            m = m.replace('_test', '')
+            m = meas.replace('_test', '')
             if m == 'r':
-                mean = 'r(mean)'
-                median = 'r(median)'
+                mn = 'r(mean)'
+                md = 'r(median)'
             else:
-                mean = '%s(mn)'%m
-                median = '%s(md)'%m
-            columns.append(mean)
-            columns.append(median)
-        index = self.data.index.levels[0].tolist()
-        table = pd.DataFrame(
-                    # index = list of model names
-                    index=index,
-                    # columns = list of measures, both mean and median
-                    columns=columns
-                    )
-        self.data.replace(0, np.nan, inplace=True)
-
-        for i, model in enumerate(table.index.tolist()):
-            for j, meas in enumerate(self.measure):
-                series = self.data[meas]
-                if meas == 'n_parms':
-                    table.at[model, 'n_parms'] = (
-                            series.loc[model].values.tolist()[0]
-                            )
-                    continue
-                else:
-                    m = meas.replace('_test', '')
-                    if m == 'r':
-                        mn = 'r(mean)'
-                        md = 'r(median)'
-                    else:
-                        mn = '%s(mn)'%m
-                        md = '%s(md)'%m
-                    table.at[model, mn] = np.nanmean(series.loc[model])
-                    table.at[model, md] = np.nanmedian(series.loc[model])
-
-                    # num valid cells is the minimum of either the current
-                    # value or the number of cells in the series minus number
-                    # of NaN values in series.
-                    #table.at['valid_cells', mn] = min(
-                    #        table.at['valid_cells', mn],
-                    #        (series.size - table[mn].isnull().sum())
-                    #        )
-                    #table.at['valid_cells', md] = min(
-                    #        table.at['valid_cells', md],
-                    #        (series.size - table[md].isnull().sum())
-                    #        )
+                mn = '%s(mn)'%m
+                md = '%s(md)'%m
+            table[mn] = summary[meas]['mean'].values
+            table[md] = summary[meas]['median'].values
 
         table.sort_values('n_parms', axis=0, ascending=False, inplace=True)
 
@@ -791,169 +764,51 @@ class Tabular_Plot(PlotGenerator):
 
 
 class Significance_Plot(PlotGenerator):
-    def __init__(self, data, measure, models, fair=True, outliers=False):
-        PlotGenerator.__init__(self, data, measure, models, fair, outliers)
+    """Compares every pair of models with a paired test (see
+    utilities.paired_stats for the supported tests and corrections).
 
-    def extents(self, f):
-        # reference:
-        # https://bl.ocks.org/fasiha/eff0763ca25777ec849ffead370dc907
-        # (calculates the data coordinates of the corners for array chunks)
-        if len(f) == 1:
-            delta = 1
-        else:
-            delta = f[1] - f[0]
-        return [f[0] - delta/2, f[-1] + delta/2]
-
-    def wilcoxon(self, first, second):
-        # make a list of pairs of items from each list
-        # TODO: should lists be randomized first? as-is would compare models
-        #       on matching cells
-
-        # make list of absolute differences between pairs
-        abs_diff = [abs(f-second[i]) for i, f in enumerate(first)]
-        # and list of signs
-        signs = [np.sign(f-second[i]) for i, f in enumerate(first)]
-        # multiply signs by abs_diffs to get signed ranks
-        signed_ranks = [i*signs[i] for i, n in enumerate(abs_diff) if n != 0]
-        # calculate W from sum of the signed ranks, and standard deviation
-        # of W's sample distribution using number of entries
-        w = sum(signed_ranks)
-        n = len(signed_ranks)
-        stdev_w = math.sqrt((n*(n+1)*((2*n)+1))/6)
-        # compute z-score
-        z = (w-0.5)/stdev_w
-        # return p-value that corresponds to z-score (two-tailed)
-        p = 2*(1 - st.norm.cdf(z))
-        return p
+    """
 
+    def __init__(
+            self, data, measure, models, fair=True, outliers=False,
+            test='wilcoxon', correction=None,
+            ):
+        self.test = test
+        self.correction = correction
+        PlotGenerator.__init__(self, data, measure, models, fair, outliers)
 
     def generate_plot(self):
         modelnames = self.data.index.levels[0].tolist()
-
-        array = np.ndarray(
-                shape=(len(modelnames), len(modelnames)),
-                dtype=float,
-                )
-
-        for i, m_one in enumerate(modelnames):
-            for j, m_two in enumerate(modelnames):
-                # get series of values corresponding to selected measure
-                # for each model
-                series_one = self.data.loc[m_one][self.measure[0]]
-                series_two = self.data.loc[m_two][self.measure[0]]
-                if j == i:
-                    # if indices equal, on diagonal so no comparison
-                    array[i][j] = 0.00
-                elif j > i:
-                    # if j is larger, below diagonal so get mean difference
-                    mean_one = np.mean(series_one)
-                    mean_two = np.mean(series_two)
-                    array[i][j] = abs(mean_one - mean_two)
-                else:
-                    # if j is smaller, above diagonal so run t-test and
-                    # get p-value
-                    # array[i][j] = st.ttest_rel(series_one, series_two)[1]
-                    first = series_one.tolist()
-                    second = series_two.tolist()
-                    # use custom-defined wilcoxon in this class
-                    # (wasn't getting the same values, but code
-                    #  may be useful later if customization is desired)
-                    #array[i][j] = self.wilcoxon(first, second)
-                    # use scipy version
-                    array[i][j] = st.wilcoxon(first, second)[1]
-
-        xticks = range(len(modelnames))
-        yticks = xticks
-        minor_xticks = np.arange(-0.5, len(modelnames), 1)
-        minor_yticks = np.arange(-0.5, len(modelnames), 1)
-
-        p = plt.figure(figsize=(len(modelnames),len(modelnames)))
-
-        #extent = self.extents(xticks) + self.extents(yticks)
-        #img = plt.imshow(
-        #        array, aspect='auto', origin='lower',
-        #        cmap=plt.get_cmap('RdBu'), interpolation='none',
-        #        extent=extent,
-        #        )
-
-        ax = plt.gca()
-
-        # ripped from stackoverflow. adds text labels to the grid
-        # at positions i,j (model x model)  with text z (value of array at i, j)
-        for (i, j), z in np.ndenumerate(array):
-            if j == i:
-                color="#EBEBEB"
-            elif j > i:
-                color="#368DFF"
-            else:
-                if array[i][j] < 0.001:
-                    color="#00FF36"
-                elif array[i][j] < 0.01:
-                    color="#00CC2B"
-                elif array[i][j] < 0.05:
-                    color="#00A21B"
-                else:
-                    color="#ABABAB"
-            ax.add_patch(mpatch.Rectangle(
-                    xy=(j-0.5, i-0.5), width=1.0, height=1.0, angle=0.0,
-                    facecolor=color, edgecolor='black',
-                    ))
-            if j == i:
-                # don't draw text for diagonal
-                continue
-            formatting = '{:.04f}'
-            if z <= 0.0001:
-                formatting = '{:.2E}'
-            ax.text(
-                    j, i, formatting.format(z), ha='center', va='center',
-                    )
-
-        ax.set_ylabel('')
-        ax.set_xlabel('')
-        ax.set_yticks(yticks)
-        ax.set_yticklabels(modelnames, fontsize=10)
-        ax.set_xticks(xticks)
-        ax.set_xticklabels(modelnames, fontsize=10, rotation="vertical")
-        ax.set_yticks(minor_yticks, minor=True)
-        ax.set_xticks(minor_xticks, minor=True)
-        ax.grid(b=False)
-        ax.grid(which='minor', color='b', linestyle='-', linewidth=0.75)
-        ax.set_title(
-                ("Wilcoxon Signed Test on {0}\nprefix: {1}, suffix: {2}"
-                 .format(self.measure[0], self.pre, self.suf)),
-                ha='center', fontsize = 14,
-                )
-        blue_patch = mpatch.Patch(
-                color='#368DFF', label='Mean Difference', edgecolor='black'
-                )
-        p001_patch = mpatch.Patch(
-                color='#00FF36', label='P < 0.001', edgecolor='black'
+        # One row per cell, one column per model.
+        matrix = (
+                self.data[self.measure[0]].unstack(level='modelname')
+                .reindex(columns=modelnames).values
                 )
-        p01_patch = mpatch.Patch(
-                color='#00CC2B', label='P < 0.01', edgecolor='black'
+        mean_diff, pvalues = ps.compare_pairs(
+                matrix, test=self.test, correction=self.correction,
+                npermutations=PERMUTATIONS, seed=RESAMPLE_SEED,
                 )
-        p05_patch = mpatch.Patch(
-                color='#00A21B', label='P < 0.05', edgecolor='black'
+        # Mean differences go above the diagonal (j > i) and p-values
+        # below it, with 0 on the diagonal since there's no comparison.
+        upper = np.triu(np.ones(mean_diff.shape, dtype=bool), k=1)
+        array = np.where(upper, mean_diff, pvalues)
+        np.fill_diagonal(array, 0.0)
+
+        title = "{0} on {1}".format(TEST_TITLES[self.test], self.measure[0])
+        if self.correction is not None:
+            title += " ({0} corrected)".format(self.correction)
+
+        # Drawn by the render service so that pyplot state isn't shared
+        # between requests.
+        spec = {
+                'array': array, 'labels': modelnames,
+                'title': ("{0}\nprefix: {1}, suffix: {2}"
+                          .format(title, self.pre, self.suf)),
+                }
+        self.img_str = render_service.render(
+                'significance', spec,
+                figsize=(len(modelnames), len(modelnames)),
                 )
-        nonsig_patch = mpatch.Patch(
-                color='#ABABAB', label='Not Significant', edgecolor='black',
-                )
-
-        plt.legend(
-                #bbox_to_anchor=(0., 1.02, 1., .102), ncol=2,
-                bbox_to_anchor=(1.05, 1), ncol=1,
-                loc=2, handles=[
-                        p05_patch, p01_patch, p001_patch,
-                        nonsig_patch, blue_patch,
-                        ]
-                )
-
-        img = io.BytesIO()
-        plt.savefig(img, bbox_inches='tight')
-        #html = mpld3.fig_to_html(p)
-        plt.close(p)
-        img.seek(0)
-        self.img_str = img.read()
 
 
 
@@ -0,0 +1,246 @@
+"""Renders matplotlib figures in the shared pool of worker processes
+(see utilities.workers).
+
+Figures are described by a renderer name and a spec dict of plain data
+(lists, numpy arrays, strings and numbers), so that they can be sent to
+another process. Each renderer draws onto a fresh Figure with the
+object-oriented matplotlib API rather than pyplot, so no state is shared
+between figures whether they are drawn in a worker or in the web server
+process.
+
+Usage:
+    img = render_service.render('significance', spec, fmt='png')
+
+"""
+
+import io
+import json
+import logging
+import threading
+from concurrent import futures
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import matplotlib.patches as mpatch
+from matplotlib.colors import to_rgb
+
+from nems_web.utilities.workers import worker_pool
+
+log = logging.getLogger(__name__)
+
+# Seconds to wait for a worker to finish a figure before giving up.
+RENDER_TIMEOUT = 120
+FORMATS = ['png', 'svg', 'mpld3']
+
+# Code that still has to draw with pyplot (like modelpane, which plots
+# straight from the nems modules) should hold this lock while it does.
+pyplot_lock = threading.Lock()
+
+
+def draw_significance(fig, spec):
+    """Draws the model x model grid for Significance_Plot.
+
+    spec should contain:
+        array: square array with mean differences above the diagonal
+               and p-values below it.
+        labels: the modelname for each row and column.
+        title: title for the plot.
+
+    """
+
+    array = np.asarray(spec['array'])
+    labels = spec['labels']
+    ticks = range(len(labels))
+    minor_ticks = np.arange(-0.5, len(labels), 1)
+    ax = fig.add_subplot(111)
+
+    # Color every square at once with a single image: grey on the
+    # diagonal, blue for mean differences above it and green, by
+    # significance level, for p-values below it.
+    codes = np.digitize(array, [0.001, 0.01, 0.05])
+    codes[np.triu_indices(len(labels), k=1)] = 4
+    np.fill_diagonal(codes, 5)
+    palette = [
+            '#00FF36', '#00CC2B', '#00A21B', '#ABABAB', '#368DFF', '#EBEBEB',
+            ]
+    rgb = np.array([to_rgb(c) for c in palette])
+    ax.imshow(
+            rgb[codes], origin='lower', interpolation='none',
+            extent=extents(ticks) + extents(ticks),
+            )
+
+    # add a text label to the grid at positions i,j (model x model) with
+    # text z (value of array at i, j)
+    for (i, j), z in np.ndenumerate(array):
+        if j == i:
+            # don't draw text for diagonal
+            continue
+        formatting = '{:.04f}'
+        if z <= 0.0001:
+            formatting = '{:.2E}'
+        ax.text(j, i, formatting.format(z), ha='center', va='center')
+
+    ax.set_xlim(-0.5, len(labels) - 0.5)
+    ax.set_ylim(-0.5, len(labels) - 0.5)
+    ax.set_ylabel('')
+    ax.set_xlabel('')
+    ax.set_yticks(ticks)
+    ax.set_yticklabels(labels, fontsize=10)
+    ax.set_xticks(ticks)
+    ax.set_xticklabels(labels, fontsize=10, rotation="vertical")
+    ax.set_yticks(minor_ticks, minor=True)
+    ax.set_xticks(minor_ticks, minor=True)
+    ax.grid(False)
+    ax.grid(which='minor', color='black', linestyle='-', linewidth=0.75)
+    ax.set_title(spec['title'], ha='center', fontsize=14)
+
+    handles = [
+            mpatch.Patch(facecolor=color, label=label, edgecolor='black')
+            for color, label in [
+                    ('#00A21B', 'P < 0.05'), ('#00CC2B', 'P < 0.01'),
+                    ('#00FF36', 'P < 0.001'), ('#ABABAB', 'Not Significant'),
+                    ('#368DFF', 'Mean Difference'),
+                    ]
+            ]
+    ax.legend(bbox_to_anchor=(1.05, 1), ncol=1, loc=2, handles=handles)
+
+
+def draw_fit_report(fig, spec):
+    """Draws the cell x model status grid for Fit_Report.
+
+    spec should contain:
+        array: 2D array of status values, one row per cell and one
+               column per model.
+        rows: the cellid for each row.
+        cols: the (abbreviated) modelname for each column.
+        xlabel: label for the x axis.
+
+    """
+
+    array = np.asarray(spec['array'])
+    rows = spec['rows']
+    cols = spec['cols']
+    xticks = range(len(cols))
+    yticks = range(len(rows))
+    minor_xticks = np.arange(-0.5, len(cols), 1)
+    minor_yticks = np.arange(-0.5, len(rows), 1)
+    extent = extents(xticks) + extents(yticks)
+
+    ax = fig.add_subplot(111)
+    img = ax.imshow(
+            array, aspect='auto', origin='lower', cmap='RdBu',
+            interpolation='none', extent=extent,
+            )
+    img.set_clim(0, 0.6)
+
+    ax.set_ylabel('')
+    ax.set_xlabel(spec['xlabel'])
+    ax.set_yticks(yticks)
+    ax.set_yticklabels(rows, fontsize=8)
+    ax.set_xticks(xticks)
+    ax.set_xticklabels(cols, fontsize=8, rotation='vertical')
+    ax.set_yticks(minor_yticks, minor=True)
+    ax.set_xticks(minor_xticks, minor=True)
+    ax.grid(False)
+    ax.grid(which='minor', color='w', linestyle='-', linewidth=0.75)
+    cbar = fig.colorbar(img, ax=ax)
+    cbar.set_ticks([0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6])
+    cbar.set_ticklabels([
+            'Dead', '', '', 'Missing', 'In Progress', 'Not Started',
+            'Complete',
+            ])
+
+
+def extents(f):
+    # reference:
+    # https://bl.ocks.org/fasiha/eff0763ca25777ec849ffead370dc907
+    # (calculates the data coordinates of the corners for array chunks)
+    if len(f) == 1:
+        delta = 1
+    else:
+        delta = f[1] - f[0]
+    return [f[0] - delta/2, f[-1] + delta/2]
+
+
+def draw_message(fig, spec):
+    """Draws spec['text'] in place of a figure that couldn't be made."""
+    fig.text(0.5, 0.5, spec['text'], ha='center', va='center', wrap=True)
+
+
+# renderer name : function(fig, spec) that draws onto fig
+RENDERERS = {
+        'significance': draw_significance,
+        'fit_report': draw_fit_report,
+        'message': draw_message,
+        }
+
+
+def render_figure(name, spec, fmt='png', figsize=None):
+    """Draws the figure for renderer name with spec and returns it as
+    PNG or SVG bytes, or as an mpld3 JSON string if fmt is 'mpld3'.
+
+    This is the function run by the worker processes, but it is safe to
+    call directly from any thread.
+
+    """
+
+    if fmt not in FORMATS:
+        raise ValueError("Unknown figure format: {0}".format(fmt))
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    RENDERERS[name](fig, spec)
+
+    if fmt == 'mpld3':
+        import mpld3
+        return json.dumps(mpld3.fig_to_dict(fig), default=_to_json)
+
+    img = io.BytesIO()
+    fig.savefig(img, format=fmt, bbox_inches='tight')
+    return img.getvalue()
+
+
+def _to_json(value):
+    # numpy arrays and scalars left in the mpld3 figure dict
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError("Can't convert {0} to JSON".format(type(value)))
+
+
+class RenderService():
+    """Sends figures to the shared worker pool (see utilities.workers) to be
+    drawn, so that slow figures don't hold up the web server's threads.
+
+    If a figure isn't finished within timeout seconds, a figure with an
+    error message is drawn in-process and returned in its place, and the
+    pool is recycled so that the slow figure doesn't keep holding a worker.
+    Other work in the pool at that point is rerun in its calling thread.
+
+    """
+
+    def __init__(self, pool=worker_pool, timeout=RENDER_TIMEOUT):
+        self.pool = pool
+        self.timeout = timeout
+
+    def render(self, name, spec, fmt='png', figsize=None):
+        """Returns the rendered figure (see render_figure)."""
+        if name not in RENDERERS:
+            raise ValueError("Unknown renderer: {0}".format(name))
+        try:
+            return self.pool.call(
+                    render_figure, name, spec, fmt, figsize,
+                    timeout=self.timeout,
+                    )
+        except futures.TimeoutError:
+            log.warning("Timed out after {0}s drawing {1}"
+                        .format(self.timeout, name))
+            self.pool.recycle()
+            message = {
+                    'text': ("Drawing this figure took longer than {0} "
+                             "seconds. Try selecting fewer models or cells."
+                             .format(self.timeout)),
+                    }
+            return render_figure('message', message, fmt)
+
+
+render_service = RenderService()
@@ -5,12 +5,8 @@ been separated here.
 
 """
 
-import io
 import logging
 
-import matplotlib.pyplot as plt
-import numpy as np
-
 from bokeh.embed import components
 from bokeh.models import (
         HoverTool, SaveTool, WheelZoomTool, PanTool, ResetTool,
@@ -21,16 +17,21 @@ from bokeh.plotting import figure
 from bokeh.layouts import gridplot
 
 import nems_web.utilities.pruffix as prx
+from nems_web.utilities.categories import categorize, rename_models
+from nems_web.plot_functions.render_service import render_service
 
 log = logging.getLogger(__name__)
-plt.switch_backend('agg')
+
+# Fit_Report labels models with only their distinguishing keywords when
+# there are more models than this.
+COMPRESS_MODELS = 50
 
 
 class Performance_Report():
     def __init__(self, data, batch, models):
         self.batch = batch
         self.abbr, self.pre, self.suf = prx.find_common(models)
-        data.replace(models, self.abbr, inplace=True)
+        rename_models(categorize(data), models, self.abbr)
         self.data = data
 
     def generate_plot(self):
@@ -48,12 +49,15 @@ class Performance_Report():
                 palette=colors, low=self.data.r_test.min(),
                 high=self.data.r_test.max()
                 )
-        source = ColumnDataSource(self.data)
+        # ColumnDataSource needs plain strings rather than categoricals.
+        source = ColumnDataSource(
+                self.data.astype({'cellid': str, 'modelname': str})
+                )
         p = figure(
                 title=("batch {0}, model prefix: {1}, suffix: {2}"
                        .format(self.batch, self.pre, self.suf)),
-                x_range=list(set(self.data['cellid'].values.tolist())),
-                y_range=list(set(self.data['modelname'].values.tolist())),
+                x_range=self.data['cellid'].unique().astype(str).tolist(),
+                y_range=self.data['modelname'].unique().astype(str).tolist(),
                 tools=tools, toolbar_location='above',
                 )
 
@@ -93,63 +97,15 @@ class Fit_Report():
         self.data = data
 
     def generate_plot(self):
-        array = self.data.values
         cols = self.data.columns.tolist()
         rows = self.data.index.tolist()
-
-        xticks = range(len(cols))
-        yticks = range(len(rows))
-        minor_xticks = np.arange(-0.5, len(cols), 1)
-        minor_yticks = np.arange(-0.5, len(rows), 1)
-        extent = self.extents(xticks) + self.extents(yticks)
-
-        p = plt.figure(figsize=(len(cols), len(rows)/4))
-        img = plt.imshow(
-                array, aspect='auto', origin='lower',
-                cmap=plt.get_cmap('RdBu'), interpolation='none',
-                extent=extent,
+        abbr, pre, suf = prx.find_common(
+                cols, compress=(len(cols) > COMPRESS_MODELS),
+                )
+        spec = {
+                'array': self.data.values, 'rows': rows, 'cols': abbr,
+                'xlabel': 'Model, prefix: {0}, suffix: {1}'.format(pre, suf),
+                }
+        self.img_str = render_service.render(
+                'fit_report', spec, figsize=(len(cols), len(rows)/4),
                 )
-        img.set_clim(0, 0.6)
-        ax = plt.gca()
-
-        abbr, pre, suf = prx.find_common(cols)
-
-        ax.set_ylabel('')
-        ax.set_xlabel('Model, prefix: {0}, suffix: {1}'.format(pre, suf))
-        ax.set_yticks(yticks)
-        ax.set_yticklabels(rows, fontsize=8)
-        ax.set_xticks(xticks)
-        ax.set_xticklabels(abbr, fontsize=8, rotation='vertical')
-        ax.set_yticks(minor_yticks, minor=True)
-        ax.set_xticks(minor_xticks, minor=True)
-        ax.grid(b=False)
-        ax.grid(which='minor', color='w', linestyle='-', linewidth=0.75)
-        cbar = plt.colorbar()
-        cbar.set_ticks([0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6])
-        cbar.set_ticklabels([
-                'Dead', '', '', 'Missing', 'In Progress', 'Not Started',
-                'Complete',
-                ])
-        # Should set the colorbar to sit at the top of the figure (y=1),
-        # which it does, but also forces plot way down, which is bad.
-        #cax = cbar.ax
-        #current_pos = cax.get_position()
-        #cax.set_position(
-        #        [current_pos.x0, 1, current_pos.width, current_pos.height]
-        #        )
-
-        img = io.BytesIO()
-        plt.savefig(img, bbox_inches='tight')
-        plt.close(p)
-        img.seek(0)
-        self.img_str = img.read()
-
-    def extents(self, f):
-        # reference:
-        # https://bl.ocks.org/fasiha/eff0763ca25777ec849ffead370dc907
-        # (calculates the data coordinates of the corners for array chunks)
-        if len(f) == 1:
-            delta = 1
-        else:
-            delta = f[1] - f[0]
-        return [f[0] - delta/2, f[-1] + delta/2]
@@ -14,43 +14,156 @@ the display area in the browser.
 import logging
 from base64 import b64encode
 
+import pandas as pd
 import pandas.io.sql as psql
+from sqlalchemy import func
 
 from flask import render_template, jsonify, request, Response
 
 from nems_web.nems_analysis import app
-from nems_db.db import Session, NarfResults, NarfBatches
+from nems_db.db import Session, NarfResults
 import nems_web.plot_functions.PlotGenerator as pg
+from nems_web.utilities.cell_quality import (
+        get_cell_quality, filter_cell_quality,
+        )
+from nems_web.utilities.cache import LRUCache
+from nems_web.utilities.summary_store import summary_store, STORE_MEASURES
+from nems_web.utilities.jobs import JobRunner, DONE, ERROR
+from nems_web.utilities.paired_stats import TESTS, CORRECTIONS
 
 log = logging.getLogger(__name__)
 
+# Maximum number of rendered plots, and approximate number of bytes, to keep
+# in the plot cache.
+PLOT_CACHE_SIZE = 64
+PLOT_CACHE_BYTES = 128*1024*1024
+plot_cache = LRUCache(
+        maxsize=PLOT_CACHE_SIZE, maxbytes=PLOT_CACHE_BYTES,
+        sizeof=lambda response: sum(
+                len(v) for v in response.values() if isinstance(v, str)
+                ),
+        )
+
+
 @app.route('/generate_plot_html')
 def generate_plot_html():
+    """Return the rendered plot for the current selections.
 
-    session = Session()
+    Plots are cached by plot_args_key plus the plot_version of the
+    batch, so the same plot is only rendered again once results for the
+    batch have been added, removed or modified.
 
-    plotType = request.args.get('plotType')
-    bSelected = request.args.get('bSelected')[:3]
-    mSelected = request.args.getlist('mSelected[]')
-    cSelected = request.args.getlist('cSelected[]')
-    measure = request.args.get('measure')
-    onlyFair = request.args.get('onlyFair')
-    if int(onlyFair):
-        onlyFair = True
-    else:
-        onlyFair = False
-    includeOutliers = request.args.get('includeOutliers')
-    if int(includeOutliers):
-        includeOutliers = True
+    """
+
+    args = read_plot_args(request.args)
+
+    session = Session()
+    key = plot_args_key(args) + (plot_version(session, args),)
+    response = plot_cache.get(key)
+    if response is None:
+        response = render_plot(session, args)
+        plot_cache.set(key, response)
     else:
-        includeOutliers = False
+        log.debug("Returning cached plot")
+    session.close()
+
+    return jsonify(**response)
+
+
+# Number of plots that can be rendered in the background at once, and the
+# number that can be waiting or running before new jobs are refused.
+PLOT_WORKERS = 2
+PLOT_MAX_PENDING = 20
+# Seconds to keep a finished job's result for the page to collect.
+PLOT_JOB_KEEP = 600
+plot_jobs = JobRunner(
+        max_workers=PLOT_WORKERS, max_pending=PLOT_MAX_PENDING,
+        keep=PLOT_JOB_KEEP,
+        )
+
+
+@app.route('/submit_plot_job')
+def submit_plot_job():
+    """Start rendering the plot for the current selections in the
+    background and return its job id right away.
+
+    Poll plot_job_status with the job id, then get the plot from
+    plot_job_result once the status is 'done'. If the plot is already
+    cached it's returned directly instead, with job set to null.
+
+    """
+
+    args = read_plot_args(request.args)
+
+    session = Session()
+    key = plot_args_key(args) + (plot_version(session, args),)
+    session.close()
+    response = plot_cache.get(key)
+    if response is not None:
+        return jsonify(job=None, status=DONE, **response)
+
+    try:
+        job = plot_jobs.submit(plot_job, args, key, key=key)
+    except RuntimeError as e:
+        return jsonify(job=None, status=ERROR, error=str(e))
+
+    return jsonify(**job.info())
+
+
+@app.route('/plot_job_status')
+def plot_job_status():
+    """Return the status, current stage and elapsed time of a plot job."""
+
+    job = plot_jobs.get(request.args.get('job', ''))
+    if job is None:
+        return jsonify(status=ERROR, error="Plot job not found."), 404
+
+    return jsonify(**job.info())
+
+
+@app.route('/plot_job_result')
+def plot_job_result():
+    """Return the rendered plot for a finished plot job, in the same format
+    as generate_plot_html, or the job status if it isn't finished.
+
+    """
+
+    job = plot_jobs.get(request.args.get('job', ''))
+    if job is None:
+        return jsonify(status=ERROR, error="Plot job not found."), 404
+    if job.status != DONE:
+        return jsonify(**job.info())
+
+    return jsonify(status=DONE, **job.result)
+
+
+def plot_job(args, key, progress=None):
+    """Renders a plot in a worker thread with its own session and stores
+    it in the plot cache.
+
+    """
+
+    session = Session()
+    try:
+        response = render_plot(session, args, progress)
+    finally:
+        session.close()
+    plot_cache.set(key, response)
+    return response
+
+
+def read_plot_args(args):
+    """Returns a dict of the plot selections in the request args."""
+
+    onlyFair = bool(int(args.get('onlyFair')))
+    includeOutliers = bool(int(args.get('includeOutliers')))
 
     # TODO: Re-do this to include any new criteria dynamically instead of
     #       hard-coding snr/iso/snri.
     filterCriteria = {
-            'snr' : float(request.args.get('snr')),
-            'iso' : float(request.args.get('iso')),
-            'snri' : float(request.args.get('snri')),
+            'snr' : float(args.get('snr')),
+            'iso' : float(args.get('iso')),
+            'snri' : float(args.get('snri')),
             }
 
     # TODO: Looks like this is what NARF does, but not 100% sure.
@@ -59,70 +172,117 @@ def generate_plot_html():
         if filterCriteria[key] < 0:
             filterCriteria[key] = 0
 
-    removalCount = 0
-    for cellid in cSelected:
-        dbCriteria = (
-                session.query(NarfBatches)
-                .filter(NarfBatches.batch == bSelected)
-                .filter(NarfBatches.cellid == cellid)
-                .all()
+    # Paired test options for Significance_Plot. Unknown values fall back
+    # to the defaults rather than failing the plot job.
+    test = args.get('test', 'wilcoxon')
+    if test not in TESTS:
+        test = 'wilcoxon'
+    correction = args.get('correction') or None
+    if correction not in CORRECTIONS:
+        correction = None
+
+    return {
+            'plotType': args.get('plotType'),
+            'batch': args.get('bSelected')[:3],
+            'models': args.getlist('mSelected[]'),
+            'cells': args.getlist('cSelected[]'),
+            'measure': args.get('measure'),
+            'onlyFair': onlyFair,
+            'includeOutliers': includeOutliers,
+            'filterCriteria': filterCriteria,
+            'test': test,
+            'correction': correction,
+            }
+
+
+def plot_args_key(args):
+    """Returns a hashable key for the plot described by args. Cells are
+    sorted since their order doesn't change the plot, but model order is
+    kept since it sets the order models are plotted in.
+
+    """
+
+    return (
+            args['plotType'], args['batch'], tuple(sorted(set(args['cells']))),
+            tuple(args['models']), args['measure'], args['onlyFair'],
+            args['includeOutliers'],
+            tuple(sorted(args['filterCriteria'].items())),
+            args['test'], args['correction'],
+            )
+
+
+def plot_version(session, args):
+    """Returns a value that changes whenever the results behind the plot
+    described by args do. Measures kept in the summary store use the
+    store's version for the batch, which is only checked against the
+    database once per refresh interval. Others use results_version.
+
+    """
+
+    if args['measure'] in STORE_MEASURES:
+        return ('store', summary_store.version(session, args['batch']))
+    return results_version(session, args['batch'])
+
+
+def results_version(session, batch):
+    """Returns a (max lastmod, max id, count) tuple for the results in batch,
+    which changes whenever a result is added, refit or removed.
+
+    """
+
+    lastmod, last_id, count = (
+            session.query(
+                    func.max(NarfResults.lastmod), func.max(NarfResults.id),
+                    func.count(NarfResults.id),
+                    )
+            .filter(NarfResults.batch == batch)
+            .one()
+            )
+    return (str(lastmod), last_id, count)
+
+
+def render_plot(session, args, progress=None):
+    """Queries results for the selections in args (see read_plot_args) and
+    returns a dict of the values to send back for the rendered plot.
+
+    If given, progress is called with a short description of each step.
+
+    """
+
+    if progress is None:
+        progress = lambda stage: None
+
+    bSelected = args['batch']
+    mSelected = args['models']
+    filterCriteria = args['filterCriteria']
+
+    # Get the (cached) quality metrics for the batch, then drop any
+    # selected cells that don't meet the criteria.
+    progress('filtering cells')
+    quality = get_cell_quality(session, bSelected)
+    cSelected, removed = filter_cell_quality(
+            quality, args['cells'], min_snr=filterCriteria['snr'],
+            min_iso=filterCriteria['iso'], min_snri=filterCriteria['snri'],
+            )
+    log.info("Number of cells filtered due to snr/iso criteria: {}"
+             .format(removed))
+
+    progress('querying results')
+    if args['measure'] in STORE_MEASURES:
+        # Only the rows added or modified since the batch was last checked
+        # are read from the database, at most once per refresh interval.
+        results = summary_store.results(
+                session, bSelected, cells=cSelected, models=mSelected,
                 )
-        if dbCriteria:
-            if len(dbCriteria) > 1:
-                log.info(
-                    "Multiple results found for cellid: %s in batch: %s"
-                    %(cellid, bSelected)
-                    )#!/usr/bin/env python3
-
-            min_snr = min(dbCriteria[0].est_snr, dbCriteria[0].val_snr)
-            min_isolation = dbCriteria[0].min_isolation
-            min_snr_index = dbCriteria[0].min_snr_index
-
-            a = (filterCriteria['snr'] > min_snr)
-            b = (filterCriteria['iso'] > min_isolation)
-            c = (filterCriteria['snri'] > min_snr_index)
-
-            if a or b or c:
-                filterReason = ""
-                if a:
-                    filterReason += (
-                            "min snr: %s -- was less than criteria: %s\n"
-                            %(min_snr, filterCriteria['snr'])
-                            )
-                if b:
-                    filterReason += (
-                            "min iso: %s -- was less than criteria: %s\n"
-                            %(min_isolation, filterCriteria['iso'])
-                            )
-                if c:
-                    filterReason += (
-                            "min snr index: %s -- was less than criteria: %s\n"
-                            %(min_snr_index, filterCriteria['snri'])
-                            )
-                #log.info(
-                #    "Removing cellid: %s,\n"
-                #    "because: %s"
-                #    %(cellid, filterReason)
-                #    )
-                cSelected.remove(cellid)
-                removalCount += 1
-        else:
-            log.info(
-                "No entry in NarfBatches for cellid: %s in batch: %s"
-                %(cellid, bSelected)
+    else:
+        results = psql.read_sql_query(
+                session.query(NarfResults)
+                .filter(NarfResults.batch == bSelected)
+                .filter(NarfResults.cellid.in_(cSelected))
+                .filter(NarfResults.modelname.in_(mSelected))
+                .statement,
+                session.bind
                 )
-            cSelected.remove(cellid)
-            removalCount += 1
-    log.info("Number of cells filtered due to snr/iso criteria: %d"%removalCount)
-
-    results = psql.read_sql_query(
-            session.query(NarfResults)
-            .filter(NarfResults.batch == bSelected)
-            .filter(NarfResults.cellid.in_(cSelected))
-            .filter(NarfResults.modelname.in_(mSelected))
-            .statement,
-            session.bind
-            )
     log.debug("Results retrieved, with size: {}".format(results.size))
     # get back list of models that matched other query criteria
     results_models = [
@@ -136,29 +296,80 @@ def generate_plot_html():
             if m in results_models
             ]
     log.debug("Modelnames re-ordered and filtered to: {}".format(ordered_models))
-    Plot_Class = getattr(pg, plotType)
+    progress('forming data array')
+    Plot_Class = getattr(pg, args['plotType'])
+    options = {}
+    if Plot_Class is pg.Significance_Plot:
+        options = {'test': args['test'], 'correction': args['correction']}
     plot = Plot_Class(
-            data=results, measure=measure, models=ordered_models,
-            fair=onlyFair, outliers=includeOutliers,
+            data=results, measure=args['measure'], models=ordered_models,
+            fair=args['onlyFair'], outliers=args['includeOutliers'],
+            **options
             )
     log.debug("Plot successfully initialized")
     if plot.emptycheck:
         log.info('Plot checked empty after forming data array')
-        return jsonify(script='Empty',div='Plot')
+        return {'script': 'Empty', 'div': 'Plot', 'filtered': removed}
     else:
+        progress('rendering')
         plot.generate_plot()
 
-    session.close()
-
     if hasattr(plot, 'script') and hasattr(plot, 'div'):
-        return jsonify(script=plot.script, div=plot.div)
+        return {'script': plot.script, 'div': plot.div, 'filtered': removed}
     elif hasattr(plot, 'html'):
-        return jsonify(html=plot.html)
+        return {'html': plot.html, 'filtered': removed}
     elif hasattr(plot, 'img_str'):
         image = str(b64encode(plot.img_str))[2:-1]
-        return jsonify(image=image)
+        return {'image': image, 'filtered': removed}
     else:
-        return jsonify(script="Couldn't find anything ", div="to return")
+        return {
+                'script': "Couldn't find anything ", 'div': "to return",
+                'filtered': removed,
+                }
+
+
+@app.route('/batch_summary')
+def batch_summary():
+    """Return the count, mean, median, standard deviation and standard error
+    of measure for each selected model (or every model, if none are
+    selected) over all cells in the batch.
+
+    Values come from the summary store, so only one row per model is
+    built for the response. Any percentiles[] given (0 to 100) are added
+    as approximate values read from the store's quantile sketches.
+
+    """
+
+    bSelected = request.args.get('bSelected')[:3]
+    mSelected = request.args.getlist('mSelected[]')
+    measure = request.args.get('measure')
+    includeOutliers = bool(int(request.args.get('includeOutliers', 1)))
+    percentiles = [float(p) for p in request.args.getlist('percentiles[]')]
+    if measure not in STORE_MEASURES:
+        return jsonify(error="No summary available for: {0}".format(measure))
+
+    session = Session()
+    summary = summary_store.summary(
+            session, bSelected, models=(mSelected or None),
+            outliers=includeOutliers,
+            )
+    table = summary[measure][['count', 'mean', 'median', 'std', 'sem']]
+    if percentiles:
+        quantiles = summary_store.quantiles(
+                session, bSelected, measure, [p/100 for p in percentiles],
+                models=table.index.tolist(), outliers=includeOutliers,
+                )
+        quantiles.columns = ['p{0:g}'.format(p) for p in percentiles]
+        table = pd.concat([table, quantiles], axis=1)
+    session.close()
+
+    # jsonify can't encode NaN, so send null for models with no results.
+    table = table.astype(object).where(table.notnull(), None)
+
+    return jsonify(
+            measure=measure, models=table.index.tolist(),
+            summary=table.to_dict(orient='records'),
+            )
 
 
 @app.route('/plot_window')
@@ -15,6 +15,7 @@ from flask import request, render_template, jsonify
 from nems_web.nems_analysis import app, bokeh_version
 from nems_db.db import Session, NarfResults, tQueue
 from nems_web.plot_functions.reports import Performance_Report, Fit_Report
+from nems_web.utilities.summary_store import summary_store
 
 log = logging.getLogger(__name__)
 
@@ -32,27 +33,12 @@ def batch_performance():
     mSelected = mSelected.split(',')
 
     if int(findAll):
-        results = psql.read_sql_query(
-                session.query(
-                        NarfResults.cellid, NarfResults.modelname,
-                        NarfResults.r_test
-                        )
-                .filter(NarfResults.batch == bSelected)
-                .statement,
-                session.bind
-                )
+        results = summary_store.results(session, bSelected)
     else:
-        results = psql.read_sql_query(
-                session.query(
-                        NarfResults.cellid, NarfResults.modelname,
-                        NarfResults.r_test
-                        )
-                .filter(NarfResults.batch == bSelected)
-                .filter(NarfResults.cellid.in_(cSelected))
-                .filter(NarfResults.modelname.in_(mSelected))
-                .statement,
-                session.bind
+        results = summary_store.results(
+                session, bSelected, cells=cSelected, models=mSelected,
                 )
+    results = results.reindex(columns=['cellid', 'modelname', 'r_test'])
     # get back list of models that matched other query criteria
     results_models = [
             m for m in
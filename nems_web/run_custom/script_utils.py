@@ -3,11 +3,21 @@
 import pkgutil
 
 import pandas as pd
-import numpy as np
 import pandas.io.sql as psql
 
-from nems_db.db import NarfBatches, NarfResults
+from nems_db.db import NarfResults
 import nems_scripts as ns
+from nems_web.utilities.outliers import outlier_mask
+from nems_web.utilities.cell_quality import (
+        get_cell_quality, filter_cell_quality,
+        )
+from nems_web.utilities.summary_store import (
+        summary_store, STORE_MEASURES, STORE_EXTRA,
+        )
+
+# NarfResults columns that form_data_array can get from the summary store.
+STORE_COLUMNS = ['id', 'cellid', 'modelname', 'lastmod'] + STORE_MEASURES \
+        + STORE_EXTRA
 
 def scan_for_scripts():
     package = ns
@@ -40,58 +50,20 @@ def filter_cells(session, batch, cells, min_snr=0, min_iso=0, min_snri=0):
         
     """
     
-    bad_cells=[]
-    
-    for cellid in cells:
-        dbCriteria = (
-                session.query(NarfBatches)
-                .filter(NarfBatches.batch == batch)
-                .filter(NarfBatches.cellid.ilike(cellid))
-                .first()
-                )
-        if dbCriteria:
-            
-            db_snr = min(dbCriteria.est_snr, dbCriteria.val_snr)
-            db_iso = dbCriteria.min_isolation
-            db_snri = dbCriteria.min_snr_index
-            
-            a = (min_snr > db_snr)
-            b = (min_iso > db_iso)
-            c = (min_snri > db_snri)
-            
-            if a or b or c:
-                bad_cells.append(cellid)
-                
-                # Uncomment section below to include verbose output of
-                # why individual cells were 'bad'
-                
-                #filterReason = ""
-                #if a:
-                #    filterReason += (
-                #            "min snr: %s -- was less than criteria: %s\n"
-                #            %(db_snr, min_snr)
-                #            )
-                #if b:
-                #    filterReason += (
-                #            "min iso: %s -- was less than criteria: %s\n"
-                #            %(db_iso, min_iso)
-                #            )
-                #if c:
-                #    filterReason += (
-                #            "min snr index: %s -- was less than criteria: %s\n"
-                #            %(db_snri, min_snri)
-                #            )
-                #print(
-                #    "Removing cellid: %s,\n"
-                #    "because: %s"
-                #    %(cellid, filterReason)
-                #    )
-        else:
-            print(
-                "No entry in NarfBatches for cellid: {0} in batch: {1}"
-                .format(cellid, batch)
-                )
-            bad_cells.append(cellid)
+    # Quality metrics for the whole batch are cached, so repeated calls
+    # only hit the database when the cache is empty or has expired.
+    quality = get_cell_quality(session, batch)
+    good_cells, removed = filter_cell_quality(
+            quality, cells, min_snr=min_snr, min_iso=min_iso,
+            min_snri=min_snri,
+            )
+    good_cells = set(good_cells)
+    bad_cells = [c for c in cells if c not in good_cells]
+    if removed['missing']:
+        print(
+            "No entry in NarfBatches for {0} cells in batch: {1}"
+            .format(removed['missing'], batch)
+            )
             
     print("Number of bad cells to snr/iso criteria: {0}".format(len(bad_cells)))
     print("Out of total cell count: {0}".format(len(cells)))
@@ -104,29 +76,35 @@ def form_data_array(
         include_outliers=False,
         ):
 
-    # TODO: figure out a good way to form this from the existing
-    #       dataframe instead of making a new one then copying over.
-    #       Should be able to just re-index then apply some
-    #       lambda function over vectorized dataframe for filtering?
-    
-    data = psql.read_sql_query(
-            session.query(NarfResults)
-            .filter(NarfResults.batch == batch)
-            .filter(NarfResults.cellid.in_(cells))
-            .filter(NarfResults.modelname.in_(models))
-            .statement,
-            session.bind
-            )
+    if columns and all(c in STORE_COLUMNS for c in columns):
+        # Everything needed is in the summary store, which only reads
+        # new or modified results from the database.
+        data = summary_store.results(session, batch, cells, models)
+        data = data.astype({'cellid': str, 'modelname': str})
+    else:
+        data = psql.read_sql_query(
+                session.query(NarfResults)
+                .filter(NarfResults.batch == batch)
+                .filter(NarfResults.cellid.in_(cells))
+                .filter(NarfResults.modelname.in_(models))
+                .statement,
+                session.bind
+                )
     if not columns:
         columns = data.columns.values.tolist()
         
     multiIndex = pd.MultiIndex.from_product(
             [cells, models], names=['cellid', 'modelname'],
             )
-    newData = pd.DataFrame(
-            index=multiIndex, columns=columns,
+    # Keep the first row recorded for each cell + model combination, then
+    # align the rows to the full cell x model product. Combinations that
+    # were never fit come back as rows of NaN.
+    rows = (
+            data.drop_duplicates(subset=['cellid', 'modelname'])
+            .set_index(['cellid', 'modelname'], drop=False)
+            .reindex(multiIndex)
             )
-    newData.sort_index()
+    newData = rows.reindex(columns=columns)
 
     # columns that don't contain performance data - this will be excluded
     # from outlier checks.
@@ -135,107 +113,81 @@ def form_data_array(
             'githash', 'lastmod', 'score', 'sparsity', 'modelpath', 'modelfile',
             'username', 'labgroup', 'public',
             ]
-    for c in cells:
-        for m in models:
-            dataRow = data.loc[(data.cellid == c) & (data.modelname == m)]
-            
-            # if col is in the non_comp list, just copy the value if it exists
-            # then move on to the next iteration.
-            for col in columns:
-                if col in non_comp_columns:
-                    try:
-                        newData[col].loc[c,m] = dataRow[col].values.tolist()[0]
-                        continue
-                    except:
-                        newData[col].loc[c,m] = np.nan
-                        continue
-                value = np.nan 
-                newData[col].loc[c,m] = value
-                # If loop hits a continue, value will be left as NaN.
-                # Otherwise, will be assigned a value from data 
-                # after passing all checks.
-                try:
-                    value = dataRow[col].values.tolist()[0]
-                except Exception as e:
-                    # Error should mean no value was recorded,
-                    # so leave as NaN.
-                    # No need to run outlier checks if value is missing.
-                    print("No %s recorded for %s,%s"%(col,m,c))
-                    continue
-                    
-                if not include_outliers:
-                    # If outliers is false, run a bunch of checks based on
-                    # measure and if a check fails, step out of the loop.
-                    
-                    # Comments for each check are copied from
-                    # from Narf_Analysis : compute_data_matrix
-                    
-                    # "Drop r_test values below threshold"
-                    a1 = (col == 'r_test')
-                    b1 = (value < dataRow['r_floor'].values.tolist()[0])
-                    a2 = (col == 'r_ceiling')
-                    b2 = (
-                        dataRow['r_test'].values.tolist()[0]
-                        < dataRow['r_floor'].values.tolist()[0]
-                        )
-                    a3 = (col == 'r_floor')
-                    b3 = b1
-                    if (a1 and b1) or (a2 and b2) or (a3 and b3):
-                        continue
-                
-                    # "Drop MI values greater than 1"
-                    a1 = (col == 'mi_test')
-                    b1 = (value > 1)
-                    a2 = (col == 'mi_fit')
-                    b2 = (0 <= value <= 1)
-                    if (a1 and b1) or (a2 and not b2):
-                        continue
-                           
-                    # "Drop MSE values greater than 1.1"
-                    a1 = (col == 'mse_test')
-                    b1 = (value > 1.1)
-                    a2 = (col == 'mse_fit')
-                    b2 = b1
-                    if (a1 and b1) or (a2 and b2):
-                        continue
-                           
-                    # "Drop NLOGL outside normalized region"
-                    a1 = (col == 'nlogl_test')
-                    b1 = (-1 <= value <= 0)
-                    a2 = (col == 'nlogl_fit')
-                    b2 = b1
-                    if (a1 and b1) or (a2 and b2):
-                        continue
-                           
-                    # TODO: is this still used? not listed in NarfResults
-                    # "Drop gamma values that are too low"
-                    a1 = (col == 'gamma_test')
-                    b1 = (value < 0.15)
-                    a2 = (col == 'gamma_fit')
-                    b2 = b1
-                    if (a1 and b1) or (a2 and b2):
-                        continue
-
-                # TODO: is an outlier check needed for cohere_test
-                #       and/or cohere_fit?
-                    
-                # If value existed and passed outlier checks,
-                # re-assign it to the proper DataFrame position
-                # to overwrite the NaN value.
-                newData[col].loc[c,m] = value
+    if not include_outliers:
+        # If outliers is false, mask out any performance values that fail
+        # the check for their measure. Masked values are left as NaN.
+        comp_columns = [c for c in columns if c not in non_comp_columns]
+        keep, dropped = outlier_mask(rows, comp_columns)
+        newData[comp_columns] = newData[comp_columns].where(keep)
+        print("Number of values dropped as outliers: {0}".format(dropped))
 
     if only_fair:
-        # If fair is checked, drop all rows that contain a NaN value for
-        # every column.
-        for c in cells:
-            for m in models:
-                if newData.loc[c,m].isnull().values.all():
-                    newData.drop(c, level='cellid', inplace=True)
-                    break
-        
+        # If fair is checked, drop all rows for any cellid that has no
+        # results at all for one or more of the models.
+        missing = newData.isnull().all(axis=1)
+        unfair = missing.groupby(level='cellid').any()
+        unfair = unfair[unfair].index
+        newData = newData[
+                ~newData.index.get_level_values('cellid').isin(unfair)
+                ]
 
     # Swap the 0th and 1st levels so that modelname is the primary index,
     # since most plots group by model.
     newData = newData.swaplevel(i=0, j=1, axis=0)
 
     return newData
+
+
+def batch_summary(session, batch, models=None, include_outliers=True):
+    """ Returns the count, mean, median, std, sem and quartiles of every
+    stored performance measure for each model in batch, over all of the
+    batch's cells, as a DataFrame with one row per model and a
+    (measure, stat) column for each measure and statistic.
+
+    Arguments:
+    ----------
+    batch : int
+        The batch number to summarize.
+    models : list
+        If given, only these models are included, in this order.
+    include_outliers : boolean
+        If False, values that fail the outlier checks are left out.
+    session : object
+        An open database session object for querying NarfResults.
+
+    """
+
+    return summary_store.summary(
+            session, batch, models=models, outliers=include_outliers,
+            )
+
+
+def batch_quantiles(session, batch, measure, qs, models=None,
+                    include_outliers=True):
+    """ Returns approximate quantiles of measure for each model in batch,
+    over all of the batch's cells, as a DataFrame with one row per model and
+    one column per quantile. Values are read from quantile sketches that are
+    kept up to date as results arrive, so they're within about 1% (in rank)
+    of the exact quantiles.
+
+    Arguments:
+    ----------
+    batch : int
+        The batch number to summarize.
+    measure : str
+        The performance measure to use, ex: 'r_test'.
+    qs : list
+        Quantiles to compute, from 0 to 1.
+    models : list
+        If given, only these models are included, in this order.
+    include_outliers : boolean
+        If False, values that fail the outlier checks are left out.
+    session : object
+        An open database session object for querying NarfResults.
+
+    """
+
+    return summary_store.quantiles(
+            session, batch, measure, qs, models=models,
+            outliers=include_outliers,
+            )
@@ -0,0 +1,170 @@
+""" Small in-process caches shared by the view functions.
+
+Entries are kept in memory for the life of the server process, so anything
+stored here should be safe to serve to any user and cheap to rebuild from
+the database on a miss.
+"""
+import collections
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class TTLCache():
+    """A thread-safe key : value store whose entries expire after ttl
+    seconds. If ttl is None, entries never expire and must be removed with
+    invalidate().
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return default
+            value, stored = entry
+            if (self.ttl is not None) and (time.time() - stored > self.ttl):
+                del self._entries[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+
+    def get_or_load(self, key, loader):
+        """Returns the cached value for key, calling loader() to build and
+        store it first if it is missing or has expired.
+        """
+
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            # Loader runs outside the lock so that a slow database query
+            # doesn't block reads of other keys.
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key=None):
+        """Removes the entry for key, or every entry if key is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def __contains__(self, key):
+        missing = object()
+        return self.get(key, missing) is not missing
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class LRUCache():
+    """A thread-safe key : value store that evicts the least recently used
+    entries once it holds more than maxsize entries or, if sizeof is given,
+    once the total of sizeof(value) over all entries is more than maxbytes.
+
+    A value larger than maxbytes on its own is returned to the caller but
+    never stored.
+    """
+
+    def __init__(self, maxsize=None, maxbytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        with self._lock:
+            self._pop(key)
+            if (self.maxbytes is not None) and (size > self.maxbytes):
+                log.debug("Not caching {0}, size {1} is over maxbytes"
+                          .format(key, size))
+                return
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            while (
+                    ((self.maxsize is not None)
+                     and (len(self._entries) > self.maxsize))
+                    or ((self.maxbytes is not None)
+                        and (self.nbytes > self.maxbytes))
+                    ):
+                oldest = next(iter(self._entries))
+                self._pop(oldest)
+
+    def get_or_load(self, key, loader):
+        """Returns the cached value for key, calling loader() to build and
+        store it first if it is missing.
+        """
+
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key=None):
+        """Removes the entry for key, or every entry if key is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self.nbytes = 0
+            else:
+                self._pop(key)
+
+    def stats(self):
+        """Returns a dict with the number of entries, their total size and
+        the hit and miss counts since the cache was created.
+        """
+
+        with self._lock:
+            return {
+                    'entries': len(self._entries), 'nbytes': self.nbytes,
+                    'hits': self.hits, 'misses': self.misses,
+                    }
+
+    def invalidate_where(self, test):
+        """Removes every entry whose key passes test(key)."""
+        with self._lock:
+            for key in [k for k in self._entries if test(k)]:
+                self._pop(key)
+
+    def _pop(self, key):
+        # Must be called with self._lock held.
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
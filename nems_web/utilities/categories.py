@@ -0,0 +1,43 @@
+""" Utility functions for storing the cellid and modelname columns of a
+results DataFrame as pandas categoricals.
+
+Each distinct name is stored once and rows hold integer codes, so renaming
+models, grouping and pivoting work on integers instead of python strings.
+"""
+import logging
+
+log = logging.getLogger(__name__)
+
+RESULTS_CATEGORIES = ['cellid', 'modelname']
+
+
+def categorize(data, columns=RESULTS_CATEGORIES):
+    """Converts each of columns that's in data to a categorical, in place,
+    and returns data. Columns that are already categorical are left alone.
+    """
+
+    for c in columns:
+        if (c in data.columns) and (data[c].dtype.name != 'category'):
+            data[c] = data[c].astype('category')
+    return data
+
+
+def rename_models(data, models, abbr, column='modelname'):
+    """Renames each name in models to the name at the same position in abbr
+    in data[column], in place, by renaming categories. Other values are left
+    as they are. Returns data.
+    """
+
+    categorize(data, [column])
+    mapping = dict(zip(models, abbr))
+    categories = data[column].cat.categories
+    renamed = [mapping.get(c, c) for c in categories]
+    if len(set(renamed)) == len(renamed):
+        data[column] = data[column].cat.rename_categories(renamed)
+    else:
+        # Two models were abbreviated to the same name, so their categories
+        # have to be merged.
+        log.debug("Abbreviations are not unique, merging categories.")
+        data[column] = data[column].astype(object).replace(mapping)
+        data[column] = data[column].astype('category')
+    return data
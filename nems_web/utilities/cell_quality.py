@@ -0,0 +1,105 @@
+""" Utility functions for loading the NarfBatches cell quality metrics
+(snr, isolation and snr index) and filtering cellids against minimum values
+for those metrics.
+
+The metrics for a whole batch are cached in memory by get_cell_quality, since
+they rarely change once a batch has been set up. Call invalidate_cell_quality
+after NarfBatches is modified to force the next request to reload them.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+import pandas.io.sql as psql
+
+from nems_db.db import NarfBatches
+from nems_web.utilities.cache import TTLCache
+
+log = logging.getLogger(__name__)
+
+# Number of seconds to keep a batch's quality metrics before reloading them.
+QUALITY_CACHE_TTL = 600
+_quality_cache = TTLCache(ttl=QUALITY_CACHE_TTL)
+
+QUALITY_COLUMNS = [
+        'cellid', 'est_snr', 'val_snr', 'min_isolation', 'min_snr_index',
+        ]
+
+
+def load_cell_quality(session, batch, cells=None):
+    """Returns a DataFrame with one row per NarfBatches entry for batch,
+    with a column for each name in QUALITY_COLUMNS. If cells is given, only
+    those cellids are included. All cells are loaded with a single query.
+    """
+
+    query = (
+            session.query(*[getattr(NarfBatches, c) for c in QUALITY_COLUMNS])
+            .filter(NarfBatches.batch == batch)
+            )
+    if cells is not None:
+        query = query.filter(NarfBatches.cellid.in_(cells))
+    quality = psql.read_sql_query(query.statement, session.bind)
+    for col in QUALITY_COLUMNS[1:]:
+        quality[col] = pd.to_numeric(quality[col], errors='coerce')
+
+    return quality
+
+
+def get_cell_quality(session, batch):
+    """Returns the quality DataFrame for every cell in batch, loading it with
+    load_cell_quality only if it isn't already cached.
+    """
+
+    batch = str(batch)
+    return _quality_cache.get_or_load(
+            batch, lambda: load_cell_quality(session, batch)
+            )
+
+
+def invalidate_cell_quality(batch=None):
+    """Removes the cached quality metrics for batch, or for every batch if
+    batch is None.
+    """
+
+    if batch is not None:
+        batch = str(batch)
+    _quality_cache.invalidate(batch)
+
+
+def filter_cell_quality(quality, cells, min_snr=0, min_iso=0, min_snri=0):
+    """Given a DataFrame from load_cell_quality and a list of cellids,
+    returns a 2-tuple containing:
+        index 0, the cellids (in their original order) that have an entry in
+            quality and meet all of the minimum criteria.
+        index 1, a dict with the number of cells that were removed for each
+            criterion (snr, iso, snri), the number that had no entry in
+            quality (missing), and the total number removed.
+    A cell that fails more than one criterion is counted once for each.
+    """
+
+    if quality['cellid'].duplicated().any():
+        log.info("Multiple quality entries found for some cellids, "
+                 "using the first entry for each.")
+    q = (
+            quality.drop_duplicates(subset=['cellid'])
+            .set_index('cellid')
+            .reindex(cells)
+            )
+    missing = ~np.isin(cells, quality['cellid'].values)
+
+    db_snr = np.minimum(q['est_snr'].values, q['val_snr'].values)
+    bad_snr = min_snr > db_snr
+    bad_iso = min_iso > q['min_isolation'].values
+    bad_snri = min_snri > q['min_snr_index'].values
+
+    good = ~(missing | bad_snr | bad_iso | bad_snri)
+    kept = [c for c, g in zip(cells, good) if g]
+    removed = {
+            'snr': int(bad_snr.sum()),
+            'iso': int(bad_iso.sum()),
+            'snri': int(bad_snri.sum()),
+            'missing': int(missing.sum()),
+            'total': len(cells) - len(kept),
+            }
+
+    return (kept, removed)
@@ -0,0 +1,127 @@
+""" Background jobs for work that is too slow to finish inside a request.
+
+A JobRunner runs functions in a bounded pool of worker threads and keeps
+their status and result in memory so that the page can poll for them by
+job id. Finished jobs are forgotten after JobRunner.keep seconds.
+"""
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+ERROR = 'error'
+
+
+class Job():
+    """Status and result of one function submitted to a JobRunner."""
+
+    def __init__(self, key=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = QUEUED
+        self.stage = ''
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+
+    def set_stage(self, stage):
+        """Records a short description of what the job is doing now."""
+        self.stage = stage
+
+    def info(self):
+        """Returns a dict describing the job's progress."""
+        if self.finished is not None:
+            elapsed = self.finished - self.submitted
+        else:
+            elapsed = time.time() - self.submitted
+        return {
+                'job': self.id, 'status': self.status, 'stage': self.stage,
+                'elapsed': round(elapsed, 2), 'error': self.error,
+                }
+
+
+class JobRunner():
+    """Runs submitted functions in up to max_workers threads.
+
+    At most max_pending jobs can be queued or running at once; submit
+    raises RuntimeError beyond that so that the caller can ask the user to
+    try again later. Jobs submitted with the same key while an earlier one
+    is still queued or running share that job instead of starting another.
+    """
+
+    def __init__(self, max_workers=2, max_pending=20, keep=600):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.keep = keep
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._jobs = {}
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, key=None, **kwargs):
+        """Queues fn(*args, progress=job.set_stage, **kwargs) and returns
+        its Job.
+        """
+
+        with self._lock:
+            self._purge()
+            if (key is not None) and (key in self._active):
+                return self._jobs[self._active[key]]
+            pending = sum(
+                    1 for j in self._jobs.values()
+                    if j.status in (QUEUED, RUNNING)
+                    )
+            if pending >= self.max_pending:
+                raise RuntimeError(
+                        "Too many jobs are already running, "
+                        "please try again in a moment."
+                        )
+            job = Job(key)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._active[key] = job.id
+
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        """Returns the Job for job_id, or None if it doesn't exist or has
+        been forgotten.
+        """
+
+        with self._lock:
+            return self._jobs.get(job_id, None)
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = RUNNING
+        job.started = time.time()
+        try:
+            job.result = fn(*args, progress=job.set_stage, **kwargs)
+            job.status = DONE
+        except Exception as e:
+            log.exception("Job {0} failed".format(job.id))
+            job.error = str(e)
+            job.status = ERROR
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                if self._active.get(job.key, None) == job.id:
+                    del self._active[job.key]
+
+    def _purge(self):
+        # Must be called with self._lock held.
+        cutoff = time.time() - self.keep
+        expired = [
+                i for i, j in self._jobs.items()
+                if (j.finished is not None) and (j.finished < cutoff)
+                ]
+        for i in expired:
+            del self._jobs[i]
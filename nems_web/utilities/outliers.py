@@ -0,0 +1,97 @@
+""" Outlier checks for NarfResults performance measures, shared by the plot
+generators and the custom script utilities.
+
+Each entry in OUTLIER_RULES maps a measure to a vectorized check that takes
+a DataFrame of results (one row per cell + model, one column per NarfResults
+column) and returns a boolean Series that is True for every row whose value
+for that measure should be dropped. Measures without an entry are never
+dropped.
+
+Comments for each check are copied from Narf_Analysis : compute_data_matrix
+"""
+import numpy as np
+import pandas as pd
+
+
+def _column(data, name):
+    """Returns column name from data as floats, or all NaN if it's missing."""
+    if name in data.columns:
+        return pd.to_numeric(data[name], errors='coerce')
+    return pd.Series(np.nan, index=data.index)
+
+
+def _below_r_floor(data, meas):
+    return _column(data, 'r_test') < _column(data, 'r_floor')
+
+
+def _above(limit):
+    def check(data, meas):
+        return _column(data, meas) > limit
+    return check
+
+
+def _below(limit):
+    def check(data, meas):
+        return _column(data, meas) < limit
+    return check
+
+
+def _inside(low, high):
+    def check(data, meas):
+        value = _column(data, meas)
+        return (value >= low) & (value <= high)
+    return check
+
+
+def _outside(low, high):
+    def check(data, meas):
+        value = _column(data, meas)
+        return ~((value >= low) & (value <= high))
+    return check
+
+
+OUTLIER_RULES = {
+        # "Drop r_test values below threshold"
+        'r_test': _below_r_floor,
+        'r_ceiling': _below_r_floor,
+        # "Drop MI values greater than 1"
+        'mi_test': _above(1),
+        'mi_fit': _outside(0, 1),
+        # "Drop MSE values greater than 1.1"
+        'mse_test': _above(1.1),
+        'mse_fit': _above(1.1),
+        # "Drop NLOGL outside normalized region"
+        'nlogl_test': _inside(-1, 0),
+        'nlogl_fit': _inside(-1, 0),
+        # TODO: is this still used? not listed in NarfResults
+        # "Drop gamma values that are too low"
+        'gamma_test': _below(0.15),
+        'gamma_fit': _below(0.15),
+        # TODO: is an outlier check needed for cohere_test
+        #       and/or cohere_fit?
+        }
+
+
+def outlier_mask(data, measures):
+    """Given a DataFrame of results and a list of measures, returns a 2-tuple
+    containing:
+        index 0, a boolean DataFrame with the same index as data and a column
+            for each measure, which is False wherever a value fails the
+            outlier check for its measure.
+        index 1, a dict of measure : number of recorded values that were
+            dropped by that measure's check.
+    """
+
+    keep = pd.DataFrame(True, index=data.index, columns=measures)
+    dropped = {}
+    for meas in measures:
+        rule = OUTLIER_RULES.get(meas, None)
+        if rule is None:
+            continue
+        # Only count values that were actually recorded, missing values
+        # are NaN either way.
+        drop = rule(data, meas) & _column(data, meas).notnull()
+        keep[meas] = ~drop.values
+        dropped[meas] = int(drop.sum())
+
+    return (keep, dropped)
@@ -0,0 +1,198 @@
+""" Paired comparisons between every pair of models, computed from a single
+cell x model matrix of performance values.
+
+Each pair of columns is compared on the cells that have a value for both
+models. All pairs are ranked and tested at once with numpy rather than
+looping over pairs, so comparing 50 models (1225 pairs) on a few hundred
+cells takes about a tenth of a second.
+
+Supported tests:
+    'wilcoxon': Wilcoxon signed-rank test using the normal approximation,
+                with zero differences dropped and the variance corrected
+                for ties (the same as scipy.stats.wilcoxon with
+                zero_method='wilcox', correction=False, method='approx').
+    'sign': two-sided sign test on the number of positive and negative
+            differences.
+    'permutation': paired permutation test on the mean difference (see
+                   utilities.resampling).
+
+Supported corrections for multiple comparisons:
+    'holm': Holm-Bonferroni step-down correction.
+    'fdr': Benjamini-Hochberg false discovery rate.
+"""
+import numpy as np
+import scipy.stats as st
+
+from nems_web.utilities.resampling import permutation_pvalues
+
+TESTS = ['wilcoxon', 'sign', 'permutation']
+CORRECTIONS = ['holm', 'fdr']
+
+
+def pair_indices(nmodels):
+    """Returns the row and column indices (i, j) with i < j of every pair of
+    models, in the same order as itertools.combinations.
+    """
+
+    return np.triu_indices(nmodels, k=1)
+
+
+def mean_differences(matrix):
+    """Returns an nmodels x nmodels array with the absolute difference
+    between the mean of each pair of columns in matrix, ignoring NaN.
+    """
+
+    means = np.nanmean(matrix, axis=0)
+    return np.abs(means[:, np.newaxis] - means[np.newaxis, :])
+
+
+def paired_differences(matrix):
+    """Returns a pairs x cells array of the differences between each pair of
+    columns in matrix (see pair_indices), with NaN wherever either model is
+    missing a value for the cell.
+    """
+
+    # One row per pair, so that the tests below sort and sum over
+    # contiguous memory.
+    i, j = pair_indices(matrix.shape[1])
+    columns = np.ascontiguousarray(matrix.T)
+    return columns[i] - columns[j]
+
+
+def _sorted_ranks(values):
+    """Sorts each row of values and ranks the entries from 1 to the number
+    of non-NaN entries, giving tied values their average rank.
+
+    Returns the sort order of each row, and the ranks (NaN for NaN entries)
+    and the size of the group of ties for each entry in sorted order.
+    """
+
+    ncols = values.shape[1]
+    order = np.argsort(values, axis=1)
+    ordered = np.take_along_axis(values, order, axis=1)
+    valid = ~np.isnan(ordered)
+
+    # Positions where a new run of equal values starts or an old one
+    # ends, within each sorted row.
+    idx = np.arange(ncols)
+    starts = np.ones(ordered.shape, dtype=bool)
+    starts[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    ends = np.ones(ordered.shape, dtype=bool)
+    ends[:, :-1] = starts[:, 1:]
+    first = np.maximum.accumulate(np.where(starts, idx, 0), axis=1)
+    last = np.minimum.accumulate(
+            np.where(ends, idx, ncols)[:, ::-1], axis=1,
+            )[:, ::-1]
+
+    ranks = np.where(valid, (first + last)/2 + 1, np.nan)
+    ties = np.where(valid, last - first + 1, 0)
+    return order, ranks, ties
+
+
+def wilcoxon_pvalues(diffs):
+    """Returns the two-sided Wilcoxon signed-rank p-value for each row of
+    a pairs x cells array of differences. Zero and NaN differences are
+    dropped. Pairs with no differences left get a p-value of NaN.
+    """
+
+    # The ranks are summed in sorted order rather than being put back in
+    # cell order, since only their signs are needed.
+    diffs = np.where(diffs == 0, np.nan, diffs)
+    order, ranks, ties = _sorted_ranks(np.abs(diffs))
+    signs = np.sign(np.take_along_axis(diffs, order, axis=1))
+    n = (~np.isnan(ranks)).sum(axis=1)
+    r_plus = np.where(signs > 0, ranks, 0).sum(axis=1)
+    r_minus = np.where(signs < 0, ranks, 0).sum(axis=1)
+    t = np.minimum(r_plus, r_minus)
+
+    mean = n*(n + 1)/4
+    # Each entry in a group of t ties adds t**2 - 1, so the sum over the
+    # group is t**3 - t.
+    tie_term = (ties**2 - 1).clip(min=0).sum(axis=1)
+    var = (n*(n + 1)*(2*n + 1) - 0.5*tie_term)/24
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = (t - mean)/np.sqrt(var)
+    p = 2*st.norm.sf(np.abs(z))
+    return np.where(n > 0, p, np.nan)
+
+
+def sign_pvalues(diffs):
+    """Returns the two-sided sign test p-value for each row of a
+    pairs x cells array of differences. Zero and NaN differences are
+    dropped. Pairs with no differences left get a p-value of NaN.
+    """
+
+    positive = (diffs > 0).sum(axis=1)
+    negative = (diffs < 0).sum(axis=1)
+    n = positive + negative
+    p = 2*st.binom.cdf(np.minimum(positive, negative), n, 0.5)
+    return np.where(n > 0, np.minimum(p, 1.0), np.nan)
+
+
+def adjust_pvalues(pvalues, correction=None):
+    """Corrects a 1D array of p-values for multiple comparisons with the
+    given correction ('holm', 'fdr', or None for no correction). NaN
+    p-values are left as NaN and not counted as comparisons.
+    """
+
+    pvalues = np.asarray(pvalues, dtype=float)
+    if correction is None:
+        return pvalues
+    if correction not in CORRECTIONS:
+        raise ValueError("Unknown correction: {0}".format(correction))
+
+    adjusted = np.full(pvalues.shape, np.nan)
+    tested = np.flatnonzero(~np.isnan(pvalues))
+    m = len(tested)
+    if m == 0:
+        return adjusted
+    order = tested[np.argsort(pvalues[tested], kind='mergesort')]
+    ordered = pvalues[order]
+
+    if correction == 'holm':
+        # multiply the k'th smallest p-value by (m - k), then make sure
+        # the results never decrease
+        scaled = ordered*(m - np.arange(m))
+        ordered = np.maximum.accumulate(scaled)
+    else:
+        # multiply the k'th smallest p-value by m / (k + 1), then make sure
+        # the results never increase when read from the largest down
+        scaled = ordered*m/np.arange(1, m + 1)
+        ordered = np.minimum.accumulate(scaled[::-1])[::-1]
+
+    adjusted[order] = np.minimum(ordered, 1.0)
+    return adjusted
+
+
+def compare_pairs(
+        matrix, test='wilcoxon', correction=None, npermutations=10000,
+        seed=None,
+        ):
+    """Compares every pair of columns in a cells x models matrix.
+    npermutations and seed are only used by the permutation test.
+
+    Returns a 2-tuple of nmodels x nmodels arrays:
+        index 0, the absolute difference between the mean of each model.
+        index 1, the (corrected) p-value for test on each pair of models,
+            filled in on both sides of the diagonal, with NaN on it.
+    """
+
+    if test not in TESTS:
+        raise ValueError("Unknown paired test: {0}".format(test))
+    matrix = np.asarray(matrix, dtype=float)
+    nmodels = matrix.shape[1]
+
+    diffs = paired_differences(matrix)
+    if test == 'wilcoxon':
+        p = wilcoxon_pvalues(diffs)
+    elif test == 'sign':
+        p = sign_pvalues(diffs)
+    else:
+        p = permutation_pvalues(diffs, npermutations, seed)
+    p = adjust_pvalues(p, correction)
+
+    pvalues = np.full((nmodels, nmodels), np.nan)
+    i, j = pair_indices(nmodels)
+    pvalues[i, j] = p
+    pvalues[j, i] = p
+    return mean_differences(matrix), pvalues
@@ -1,75 +1,54 @@
 """ Utility functions for parsing a list of modelnames into a list of
 abbreviated strings with a common prefix and/or suffix.
+
+Modelnames are compared as lists of underscore-separated keywords, so a
+prefix or suffix always ends (or starts) on an underscore and never
+includes the whole of any name.
 @author jacob
 """
 import logging
+
 log = logging.getLogger(__name__)
 
 
+def _common_tokens(token_lists):
+    # Number of leading tokens shared by every list. The lexicographically
+    # smallest and largest lists share the fewest tokens, so only those two
+    # need to be compared.
+    lo = min(token_lists)
+    hi = max(token_lists)
+    n = 0
+    for a, b in zip(lo, hi):
+        if a != b:
+            break
+        n += 1
+    # Always leave at least one token in each name.
+    return min(n, min(len(t) for t in token_lists) - 1)
+
+
 def find_prefix(s_list):
     """Given a list of strings, returns the common prefix to nearest _."""
-    prefix = ''
     if (not s_list) or (len(s_list) == 1):
-        return prefix
-    i = 0
-    test = True
-    while test:
-        # log.debug('while loop, i=%s'%i)
-        # log.debug('before for loop, prefix = %s'%prefix)
-        for j in range(len(s_list) - 1):
-            # look at ith item of each string in list, in order
-            if i < len(s_list[j]):
-                a = s_list[j][i]
-            else:
-                a = ''
-            if i<len(s_list[j+1]):
-                b = s_list[j + 1][i]
-            else:
-                b = ''
-            # log.debug('for loop, a = %s and b = %s'%(a, b))
-            if a != b:
-                test = False
-                break
-            if j == len(s_list) - 2:
-                prefix += b
-        i += 1
-
-    while prefix and (prefix[-1] != '_'):
-        prefix = prefix[:-1]
-
-    return prefix
+        return ''
+    tokens = [s.split('_') for s in s_list]
+    n = _common_tokens(tokens)
+    if n <= 0:
+        return ''
+    return '_'.join(tokens[0][:n]) + '_'
 
 
 def find_suffix(s_list):
     """Given a list of strings, returns the common suffix to nearest _."""
-    suffix = ''
     if (not s_list) or (len(s_list) == 1):
-        return suffix
-    i = 1
-    test = True
-    while test:
-        # log.debug('while loop, i=%s'%i)
-        # log.debug('before for loop, suffix = %s'%suffix)
-        for j in range(len(s_list) - 1):
-            # look at ith item of each string in reverse order
-            a = s_list[j][-1 * i]
-            b = s_list[j + 1][-1 * i]
-            # print('for loop, a = %s and b = %s'%(a, b))
-            if a != b:
-                test = False
-                break
-            if j == len(s_list) - 2:
-                suffix += b
-        i += 1
-    # reverse the order so that it comes out as read left to right
-    suffix = suffix[::-1]
-    while suffix and (suffix[0] != '_'):
-        suffix = suffix[1:]
-
-    return suffix
-
-
-def find_common(s_list, pre=True, suf=True):
+        return ''
+    tokens = [s.split('_')[::-1] for s in s_list]
+    n = _common_tokens(tokens)
+    if n <= 0:
+        return ''
+    return '_' + '_'.join(tokens[0][:n][::-1])
+
+
+def find_common(s_list, pre=True, suf=True, compress=False):
     """Given a list of strings, finds the common suffix and prefix, then
     returns a 3-tuple containing:
         index 0, a new list with prefixes and suffixes removed
@@ -78,6 +57,8 @@ def find_common(s_list, pre=True, suf=True):
     Takes s_list as list of strings (required), and pre and suf as Booleans
     (optional) to indicate whether prefix and suffix should be found. Both are
     set to True by default.
+    If compress is True, the shortened strings are further reduced to the
+    keywords needed to tell them apart with compress_tokens.
     """
 
     prefix = ''
@@ -88,17 +69,56 @@ def find_common(s_list, pre=True, suf=True):
     if suf:
         log.debug("Finding suffixes...")
         suffix = find_suffix(s_list)
-    # shortened = [s[len(prefix):-1*(len(suffix))] for s in s_list]
+
     shortened = []
     for s in s_list:
-        # log.debug("s=%s"%s)
         if prefix:
             s = s[len(prefix):]
-            # log.debug("s changed to: %s"%s)
         if suffix:
             s = s[:-1 * len(suffix)]
-            # log.debug("s changed to: %s"%s)
         shortened.append(s)
-        log.debug("final s: %s" % s)
+
+    if compress:
+        shortened = compress_tokens(shortened)
 
     return (shortened, prefix, suffix)
+
+
+def compress_tokens(s_list):
+    """Given a list of strings, returns a new list with as few keywords as
+    possible left in each string while keeping them all different.
+
+    Keywords are tried one at a time starting with the most common, and
+    each is removed from every string if that doesn't make two different
+    strings the same or leave a string empty. Keywords shared by every
+    string are always removed first, so this is a greedy reduction rather
+    than the smallest possible one.
+    """
+
+    if len(s_list) < 2:
+        return list(s_list)
+    tokens = [s.split('_') for s in s_list]
+    ndistinct = len(set(s_list))
+    counts = {}
+    for token_list in tokens:
+        for t in set(token_list):
+            counts[t] = counts.get(t, 0) + 1
+    # Most common (least informative) keywords first, then alphabetical
+    # so the result doesn't depend on dict order.
+    order = sorted(counts, key=lambda t: (-counts[t], t))
+
+    removed = set()
+    for t in order:
+        test = removed | {t}
+        compressed = [
+                tuple(k for k in token_list if k not in test)
+                for token_list in tokens
+                ]
+        if all(compressed) and (len(set(compressed)) == ndistinct):
+            removed = test
+
+    return [
+            '_'.join(k for k in token_list if k not in removed)
+            for token_list in tokens
+            ]
+
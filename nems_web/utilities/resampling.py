@@ -0,0 +1,136 @@
+""" Bootstrap and permutation tests on a cell x model matrix of performance
+values, used to add confidence intervals and significance information to
+the model comparison plots.
+
+Resamples are drawn as one matrix per chunk (a row of cell indices or sign
+flips for each resample) and applied to every model or pair of models at
+once with a matrix product. Counts above RESAMPLE_CHUNK are split into
+chunks that run in the shared pool of worker processes (see
+utilities.workers), or in the calling thread if the pool isn't available.
+Each chunk gets its own child of a numpy SeedSequence, so the results for
+a given seed are the same no matter how many processes are used.
+
+NaN values (cells that a model has no value for) are left out of each
+mean rather than counted as zero.
+"""
+import logging
+
+import numpy as np
+
+from nems_web.utilities.workers import worker_pool
+
+log = logging.getLogger(__name__)
+
+# Largest number of resamples drawn as one matrix. Bigger counts are split
+# into chunks of this size.
+RESAMPLE_CHUNK = 2000
+
+
+def _chunks(nresamples, seed):
+    """Returns a list of (SeedSequence, size) pairs that add up to
+    nresamples.
+    """
+
+    sizes = [RESAMPLE_CHUNK]*(nresamples//RESAMPLE_CHUNK)
+    if nresamples % RESAMPLE_CHUNK:
+        sizes.append(nresamples % RESAMPLE_CHUNK)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    return list(zip(seeds, sizes))
+
+
+def _run_chunks(fn, args, nresamples, seed):
+    """Calls fn(*args, seed, size) for each chunk of nresamples and returns
+    the list of results, in chunk order.
+    """
+
+    chunks = _chunks(nresamples, seed)
+    if len(chunks) > 1:
+        return worker_pool.map(fn, [args + (s, n) for s, n in chunks])
+    return [fn(*args, s, n) for s, n in chunks]
+
+
+def _resample_counts(rng, ncells, size):
+    # Draw an index matrix with one row of cell indices per resample, then
+    # turn it into the number of times each cell was drawn for each row.
+    indices = rng.integers(0, ncells, size=(size, ncells))
+    offsets = np.arange(size)[:, np.newaxis]*ncells
+    counts = np.bincount(
+            (indices + offsets).ravel(), minlength=size*ncells,
+            )
+    return counts.reshape(size, ncells).astype(float)
+
+
+def _bootstrap_chunk(matrix, seed, size):
+    """Returns a size x models array with the mean of each model for size
+    bootstrap resamples of the rows (cells) of matrix.
+    """
+
+    rng = np.random.default_rng(seed)
+    valid = ~np.isnan(matrix)
+    values = np.where(valid, matrix, 0)
+    counts = _resample_counts(rng, matrix.shape[0], size)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (counts @ values)/(counts @ valid)
+
+
+def bootstrap_means(matrix, nresamples=1000, seed=None):
+    """Resamples the rows (cells) of a cells x models matrix with
+    replacement, nresamples times. The same cells are drawn for every
+    model in a resample.
+
+    Returns an nresamples x models array of the mean of each model in
+    each resample.
+    """
+
+    matrix = np.asarray(matrix, dtype=float)
+    means = _run_chunks(_bootstrap_chunk, (matrix,), nresamples, seed)
+    return np.concatenate(means, axis=0)
+
+
+def bootstrap_ci(matrix, nresamples=1000, level=0.95, seed=None):
+    """Returns a 2-tuple of arrays with the lower and upper bounds of the
+    percentile bootstrap confidence interval for the mean of each model
+    (column) in a cells x models matrix.
+    """
+
+    means = bootstrap_means(matrix, nresamples, seed)
+    tail = (1 - level)/2*100
+    low, high = np.nanpercentile(means, [tail, 100 - tail], axis=0)
+    return low, high
+
+
+def _permutation_chunk(diffs, seed, size):
+    """Returns the number of sign-flip permutations, out of size, whose
+    mean difference is at least as large in magnitude as the observed mean
+    difference, for each row of diffs.
+    """
+
+    rng = np.random.default_rng(seed)
+    valid = ~np.isnan(diffs)
+    n = valid.sum(axis=1)
+    values = np.where(valid, diffs, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        observed = np.abs(values.sum(axis=1)/n)
+        signs = rng.choice([-1.0, 1.0], size=(size, diffs.shape[1]))
+        permuted = np.abs((signs @ values.T)/n)
+    # Allow for rounding error so that permutations equal to the observed
+    # value aren't missed.
+    return (permuted >= observed*(1 - 1e-12)).sum(axis=0)
+
+
+def permutation_pvalues(diffs, npermutations=10000, seed=None):
+    """Paired permutation (randomization) test on the mean of each row of a
+    pairs x cells array of differences, as in NARF's randttest. Under the
+    null hypothesis each difference is equally likely to have either sign,
+    so the sign of every cell is flipped at random in each permutation.
+
+    Returns the two-sided p-value for each row, or NaN for rows with no
+    differences.
+    """
+
+    diffs = np.asarray(diffs, dtype=float)
+    counts = _run_chunks(_permutation_chunk, (diffs,), npermutations, seed)
+    exceed = np.sum(counts, axis=0)
+    p = (exceed + 1)/(npermutations + 1)
+    n = (~np.isnan(diffs)).sum(axis=1)
+    return np.where(n > 0, p, np.nan)
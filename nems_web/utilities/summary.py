@@ -0,0 +1,54 @@
+""" Per-model summary statistics for the plot generators.
+
+summarize takes the multi-indexed DataFrame built by
+PlotGenerator.form_data_array (modelname level 0, cellid level 1, one column
+per measure) and computes every statistic in SUMMARY_STATS, plus the
+quantiles in SUMMARY_QUANTILES, for every (model, measure) combination with
+one groupby over the models. NaN values are skipped.
+
+The result has one row per model and a two-level column index of
+(measure, statistic), so a plot can take summary[measure]['mean'] or
+summary.xs('mean', axis=1, level='stat') as needed.
+"""
+import pandas as pd
+
+# Statistics computed for every model and measure. 'first' is the first
+# non-NaN value, for columns like n_parms that are the same for every cell.
+SUMMARY_STATS = ['count', 'mean', 'median', 'std', 'sem', 'first']
+SUMMARY_QUANTILES = [0.25, 0.75]
+
+
+def quantile_name(q):
+    """Returns the summary column name for quantile q, ex: 0.25 -> 'q25'."""
+    return 'q{0:g}'.format(q*100)
+
+
+def summarize(data, measures=None, quantiles=SUMMARY_QUANTILES):
+    """Returns a DataFrame with one row per modelname in data and a
+    (measure, stat) column for each measure and each statistic in
+    SUMMARY_STATS and quantiles. If measures is None, every column of data
+    is summarized.
+
+    Models are listed in the same order as the modelname level of data's
+    index, including models with no rows left (whose statistics are NaN).
+    """
+
+    if measures is None:
+        measures = data.columns.tolist()
+    models = data.index.levels[0].tolist()
+    grouped = data[measures].groupby(level='modelname', sort=False)
+
+    stats = grouped.agg(SUMMARY_STATS)
+    if quantiles:
+        # One row per (model, quantile), moved into the columns.
+        q = grouped.quantile(quantiles).unstack(level=-1)
+        q.columns = q.columns.set_levels(
+                [quantile_name(x) for x in q.columns.levels[1]], level=1,
+                )
+        stats = pd.concat([stats, q], axis=1)
+
+    stats = stats.reindex(index=models)
+    stats = stats.reindex(columns=measures, level=0)
+    stats.columns.names = ['measure', 'stat']
+    stats.index.name = 'modelname'
+    return stats
@@ -0,0 +1,366 @@
+""" In-memory store of the NarfResults performance measures for each batch,
+along with per-model summary statistics (see utilities.summary) for every
+measure.
+
+The first request for a batch loads its results with a single query. After
+that, refresh only reads the rows whose id is newer than the largest id
+seen so far, or whose lastmod is at least as new as the latest lastmod seen,
+and recomputes the summaries for just the models those rows belong to. If
+the number of rows in the database no longer matches the store (ex: results
+were deleted), the batch is reloaded in full.
+
+Plots and reports can then take their per-cell values from results() and
+whole-batch aggregates from summary() instead of querying every row of the
+batch on each request. Approximate percentiles at any quantile come from
+quantiles(), which reads them from a QuantileSketch (see utilities.sketch)
+per model and measure. New results are added to the existing sketches;
+only the sketches of models whose results were changed are rebuilt.
+"""
+import itertools
+import logging
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pandas.io.sql as psql
+from sqlalchemy import func, or_
+
+from nems_db.db import NarfResults
+from nems_web.utilities.cache import LRUCache
+from nems_web.utilities.categories import categorize
+from nems_web.utilities.outliers import outlier_mask
+from nems_web.utilities.summary import summarize
+from nems_web.utilities.sketch import sketch_values
+
+log = logging.getLogger(__name__)
+
+# Performance measures kept for every result, along with the columns that
+# the outlier checks depend on.
+STORE_MEASURES = [
+        'r_test', 'r_ceiling', 'r_fit', 'r_active', 'mse_test', 'mse_fit',
+        'mi_test', 'mi_fit', 'nlogl_test', 'nlogl_fit', 'cohere_test',
+        'cohere_fit', 'n_parms',
+        ]
+STORE_EXTRA = ['r_floor']
+# Number of seconds after a sweep during which reads don't check the
+# database for new results.
+REFRESH_INTERVAL = 10
+# Number of batches kept in memory at once.
+STORE_MAX_BATCHES = 8
+
+
+class _BatchResults():
+    """The stored rows and summaries for one batch."""
+
+    def __init__(self):
+        self.rows = None
+        # summaries with and without outliers dropped, one row per model
+        self.summary = None
+        self.masked_summary = None
+        # (model, measure, outliers) : QuantileSketch, built on first use
+        self.sketches = {}
+        # changes whenever the stored rows do (see SummaryStore.version)
+        self.version = None
+        self.last_id = None
+        self.lastmod = None
+        self.swept = 0
+        self.lock = threading.Lock()
+
+
+class SummaryStore():
+    """Keeps the results for recently used batches in memory and refreshes
+    them incrementally. See the module docstring for details.
+
+    """
+
+    def __init__(
+            self, refresh_interval=REFRESH_INTERVAL,
+            max_batches=STORE_MAX_BATCHES,
+            ):
+        self.refresh_interval = refresh_interval
+        self._batches = LRUCache(maxsize=max_batches)
+        self._lock = threading.Lock()
+        # Shared by every batch, so that a batch that's dropped and loaded
+        # again never reuses an old version number.
+        self._versions = itertools.count()
+
+    def results(self, session, batch, cells=None, models=None,
+                max_age=None):
+        """Returns a DataFrame with one row per stored result for batch,
+        optionally limited to the given cells and models, with columns for
+        id, cellid, modelname, lastmod and each stored measure.
+
+        max_age is the number of seconds since the last sweep after which
+        the batch is checked for new results (default refresh_interval).
+
+        """
+
+        state = self.refresh(session, batch, max_age)
+        rows = state.rows
+        keep = np.ones(len(rows), dtype=bool)
+        if cells is not None:
+            keep &= rows['cellid'].isin(cells).values
+        if models is not None:
+            keep &= rows['modelname'].isin(models).values
+        data = rows[keep].reset_index()
+        for c in ['cellid', 'modelname']:
+            data[c] = data[c].cat.remove_unused_categories()
+        return data
+
+    def summary(self, session, batch, models=None, outliers=True,
+                max_age=None):
+        """Returns the summary statistics for every model in batch (or just
+        models, in the order given), over every cell in the batch, with one
+        row per model and a (measure, stat) column for each measure and
+        statistic (see utilities.summary.summarize). If outliers is False,
+        values that fail the outlier checks are left out.
+
+        """
+
+        state = self.refresh(session, batch, max_age)
+        summary = state.summary if outliers else state.masked_summary
+        if models is not None:
+            summary = summary.reindex(models)
+        return summary
+
+    def version(self, session, batch, max_age=None):
+        """Returns a number that changes whenever the stored results for
+        batch change, for use in cache keys. The batch is refreshed first,
+        as for results().
+        """
+
+        return self.refresh(session, batch, max_age).version
+
+    def refresh(self, session, batch, max_age=None):
+        """Loads or updates the stored results for batch if they haven't
+        been checked in the last max_age seconds. Returns the batch state.
+        """
+
+        if max_age is None:
+            max_age = self.refresh_interval
+        batch = int(batch)
+        with self._lock:
+            state = self._batches.get(batch)
+            if state is None:
+                state = _BatchResults()
+                self._batches.set(batch, state)
+
+        with state.lock:
+            if state.rows is None:
+                self._load(session, batch, state)
+            elif time.time() - state.swept > max_age:
+                self._sweep(session, batch, state)
+        return state
+
+    def invalidate(self, batch=None):
+        """Drops the stored results for batch, or for every batch if batch
+        is None, so that they're reloaded in full on the next request.
+        """
+
+        if batch is not None:
+            batch = int(batch)
+        self._batches.invalidate(batch)
+
+    def _query(self, session, batch):
+        columns = [
+                getattr(NarfResults, c)
+                for c in ['id', 'cellid', 'modelname', 'lastmod']
+                + STORE_MEASURES + STORE_EXTRA
+                if hasattr(NarfResults, c)
+                ]
+        return (
+                session.query(*columns)
+                .filter(NarfResults.batch == batch)
+                )
+
+    def _read(self, session, query):
+        rows = psql.read_sql_query(query.statement, session.bind)
+        for c in STORE_MEASURES + STORE_EXTRA:
+            if c in rows.columns:
+                rows[c] = pd.to_numeric(rows[c], errors='coerce')
+        return rows.set_index('id')
+
+    def _load(self, session, batch, state):
+        rows = self._read(session, self._query(session, batch))
+        state.rows = categorize(rows.sort_index())
+        state.summary, state.masked_summary = self._summarize(state.rows)
+        state.sketches = {}
+        state.version = next(self._versions)
+        self._mark(state)
+        log.debug("Loaded {0} results for batch {1} into summary store"
+                  .format(len(rows), batch))
+
+    def _sweep(self, session, batch, state):
+        query = self._query(session, batch)
+        if state.lastmod is not None:
+            query = query.filter(or_(
+                    NarfResults.id > state.last_id,
+                    NarfResults.lastmod >= state.lastmod,
+                    ))
+        else:
+            query = query.filter(NarfResults.id > state.last_id)
+        new = self._read(session, query)
+
+        if len(new):
+            old = state.rows.index.intersection(new.index)
+            # Rows read again only because they share the latest lastmod
+            # are usually unchanged, so only the ones that differ count.
+            before = state.rows.loc[old, new.columns].astype(object)
+            after = new.loc[old].astype(object)
+            differs = ~(
+                    (before == after) | (before.isnull() & after.isnull())
+                    ).all(axis=1)
+            changed = old[differs.values]
+            appended = new.drop(old).sort_index()
+            # Models with changed rows, before and after the change.
+            replaced = set(new.loc[changed, 'modelname']).union(
+                    state.rows.loc[changed, 'modelname'].astype(str)
+                    )
+            # Models whose summaries need to be recomputed: the changed
+            # ones and the ones with appended rows.
+            models = replaced.union(appended['modelname'])
+            # Changed models, and models with a second result for a cell,
+            # need their sketches rebuilt. Sketches for the others only
+            # need the values from the appended rows.
+            pairs = pd.MultiIndex.from_arrays([
+                    state.rows['cellid'].astype(str),
+                    state.rows['modelname'].astype(str),
+                    ])
+            repeat = (
+                    pd.MultiIndex.from_arrays(
+                            [appended['cellid'], appended['modelname']]
+                            ).isin(pairs)
+                    | appended.duplicated(subset=['cellid', 'modelname'])
+                    )
+            replaced.update(appended.loc[repeat, 'modelname'])
+            appended = appended[~repeat]
+            rows = state.rows.drop(old)
+            for c in ['cellid', 'modelname']:
+                # Add any new names to the categories so that the
+                # columns stay categorical when the rows are combined.
+                dtype = pd.CategoricalDtype(
+                        rows[c].cat.categories.union(new[c].unique())
+                        )
+                rows[c] = rows[c].astype(dtype)
+                new[c] = new[c].astype(dtype)
+            state.rows = pd.concat([rows, new]).sort_index()
+        else:
+            models = set()
+            replaced = set()
+            appended = new
+
+        count = (
+                session.query(func.count(NarfResults.id))
+                .filter(NarfResults.batch == batch)
+                .scalar()
+                )
+        if count != len(state.rows):
+            # Some results were deleted, which can't be seen from the
+            # new rows alone.
+            log.debug("Result count changed for batch {0}, reloading"
+                      .format(batch))
+            self._load(session, batch, state)
+            return
+
+        if models:
+            rows = state.rows[state.rows['modelname'].isin(models)]
+            summary, masked = self._summarize(rows)
+            state.summary = self._replace(state.summary, summary, models)
+            state.masked_summary = self._replace(
+                    state.masked_summary, masked, models,
+                    )
+            log.debug("Updated {0} results and {1} model summaries for "
+                      "batch {2}".format(len(new), len(models), batch))
+            self._update_sketches(state, appended, replaced)
+            state.version = next(self._versions)
+        self._mark(state)
+
+    def quantiles(self, session, batch, measure, qs, models=None,
+                  outliers=True, max_age=None):
+        """Returns a DataFrame with one row per model in batch (or just
+        models, in the order given) and a column with the approximate value
+        of measure at each quantile in qs, over every cell in the batch.
+        If outliers is False, values that fail the outlier checks are
+        left out.
+
+        Quantiles are read from a QuantileSketch kept for each model and
+        measure, so they take the same time to look up however many
+        results the batch has. Sketches are built on first use and then
+        updated with just the new values as results are added.
+
+        """
+
+        state = self.refresh(session, batch, max_age)
+        with state.lock:
+            if models is None:
+                models = state.summary.index.tolist()
+            table = {
+                    m: self._sketch(state, m, measure, outliers).quantiles(qs)
+                    for m in models
+                    }
+        return pd.DataFrame.from_dict(table, orient='index', columns=qs)
+
+    def _sketch(self, state, model, measure, outliers):
+        # Must be called with state.lock held.
+        key = (model, measure, outliers)
+        sketch = state.sketches.get(key, None)
+        if sketch is None:
+            rows = state.rows[state.rows['modelname'] == model]
+            data, masked = self._values(rows)
+            values = data if outliers else masked
+            sketch = sketch_values(
+                    values[measure].values if measure in values else [],
+                    )
+            state.sketches[key] = sketch
+        return sketch
+
+    def _update_sketches(self, state, appended, replaced):
+        # Must be called with state.lock held.
+        for key in list(state.sketches):
+            if key[0] in replaced:
+                del state.sketches[key]
+        if not len(appended):
+            return
+        data, masked = self._values(appended)
+        models = set(data.index.get_level_values('modelname'))
+        for (model, measure, outliers), sketch in state.sketches.items():
+            if (model in models) and (measure in data):
+                values = data if outliers else masked
+                sketch.update(
+                        values.xs(model, level='modelname')[measure].values
+                        )
+
+    def _values(self, rows):
+        """Returns the measures for rows with and without outliers, indexed
+        by modelname and cellid.
+        """
+
+        measures = [c for c in STORE_MEASURES if c in rows.columns]
+        # Keep the first result for each cell + model, as the plots do.
+        data = (
+                rows.drop_duplicates(subset=['cellid', 'modelname'])
+                .astype({'cellid': str, 'modelname': str})
+                .set_index(['modelname', 'cellid'])
+                )
+        keep = outlier_mask(data, measures)[0]
+        return data[measures], data[measures].where(keep)
+
+    def _summarize(self, rows):
+        """Returns the summaries for rows with and without outliers."""
+        data, masked = self._values(rows)
+        return summarize(data), summarize(masked)
+
+    def _replace(self, summary, part, models):
+        summary = summary.drop(models, errors='ignore')
+        return pd.concat([summary, part]).sort_index()
+
+    def _mark(self, state):
+        rows = state.rows
+        state.last_id = int(rows.index.max()) if len(rows) else 0
+        lastmod = rows['lastmod'].max() if len(rows) else None
+        state.lastmod = None if pd.isnull(lastmod) else lastmod
+        state.swept = time.time()
+
+
+summary_store = SummaryStore()
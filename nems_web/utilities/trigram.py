@@ -0,0 +1,147 @@
+""" Trigram index for ranked, case-insensitive substring search over a list
+of strings, used to autocomplete cellids and modelnames.
+"""
+import logging
+import bisect
+import collections
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Minimum trigram similarity for a fuzzy match when a query isn't a
+# substring of any item.
+FUZZY_THRESHOLD = 0.3
+
+# Rank of each kind of match, lower is better.
+EXACT = 0
+PREFIX = 1
+WORD_PREFIX = 2
+SUBSTRING = 3
+FUZZY = 4
+
+_WORD_BREAKS = '_-.'
+
+
+def trigrams(s):
+    """Returns the set of three character substrings of s."""
+    return set(s[i:i+3] for i in range(len(s) - 2))
+
+
+class TrigramIndex():
+    """Maps each trigram in a list of strings to the ids of the strings
+    that contain it, plus a sorted copy of the strings for prefix lookups.
+
+    Matches are ranked exact, then prefix, then prefix of a word (after
+    '_', '-' or '.'), then any other substring, with shorter items first
+    within each rank. If nothing contains the query, items sharing at least
+    FUZZY_THRESHOLD of their trigrams with it are returned instead,
+    most similar first.
+
+    Arguments:
+    ----------
+    items : iterable of strings
+        The strings to index, ex: the cellids in a batch.
+
+    """
+
+    def __init__(self, items=()):
+        self.items = np.array(list(items), dtype=object)
+        self.lowered = [str(i).lower() for i in self.items]
+        postings = collections.defaultdict(list)
+        self.ntrigrams = np.zeros(len(self.items), dtype=np.int32)
+        for i, s in enumerate(self.lowered):
+            grams = trigrams(s)
+            self.ntrigrams[i] = len(grams)
+            for g in grams:
+                postings[g].append(i)
+        self.postings = {
+                k: np.array(v, dtype=np.int32) for k, v in postings.items()
+                }
+        order = sorted(range(len(self.lowered)), key=self.lowered.__getitem__)
+        self.sorted_ids = np.array(order, dtype=np.int32)
+        self.sorted_lowered = [self.lowered[i] for i in order]
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def nbytes(self):
+        """Rough estimate of the memory used by the index."""
+        postings = sum(v.nbytes for v in self.postings.values())
+        strings = sum(2*len(s) + 98 for s in self.lowered)
+        return postings + strings + 16*len(self.items)
+
+    def search(self, query, offset=0, limit=None):
+        """Returns a 2-tuple containing:
+            index 0, the list of matching items in rank order starting at
+                offset, with at most limit items (or all of them if limit
+                is None).
+            index 1, the total number of matching items.
+
+        """
+
+        ids = self.rank(query)
+        offset = max(0, offset)
+        if limit is None:
+            page = ids[offset:]
+        else:
+            page = ids[offset:offset+max(0, limit)]
+        return (self.items[page].tolist(), len(ids))
+
+    def rank(self, query):
+        """Returns the ids of the items matching query, best match first."""
+        q = query.strip().lower()
+        if not q:
+            return self.sorted_ids
+        if len(q) < 3:
+            # Too short for trigrams, so only look for prefixes.
+            return self._prefix_ids(q)
+
+        grams = trigrams(q)
+        counts = self._trigram_counts(grams)
+        # Every substring match contains all of the query's trigrams, so
+        # only those candidates need to be checked.
+        candidates = np.flatnonzero(counts == len(grams))
+        matches = [
+                (self._match_rank(self.lowered[i], q), len(self.lowered[i]),
+                 self.lowered[i], i)
+                for i in candidates
+                if q in self.lowered[i]
+                ]
+        if matches:
+            matches.sort()
+            return np.array([m[-1] for m in matches], dtype=np.int32)
+
+        similarity = counts/(len(grams) + self.ntrigrams - counts).clip(1)
+        fuzzy = np.flatnonzero(similarity >= FUZZY_THRESHOLD)
+        # Most similar first, then by id for a stable order.
+        order = np.lexsort((fuzzy, -similarity[fuzzy]))
+        return fuzzy[order].astype(np.int32)
+
+    def _trigram_counts(self, grams):
+        # Number of the query's trigrams found in each item.
+        found = [self.postings[g] for g in grams if g in self.postings]
+        if not found:
+            return np.zeros(len(self.items), dtype=np.int64)
+        return np.bincount(np.concatenate(found), minlength=len(self.items))
+
+    def _prefix_ids(self, q):
+        start = bisect.bisect_left(self.sorted_lowered, q)
+        end = bisect.bisect_left(self.sorted_lowered, q + '\uffff')
+        ids = self.sorted_ids[start:end]
+        # Shorter (closer) matches first, alphabetical within each length.
+        lengths = np.array([len(self.lowered[i]) for i in ids], dtype=np.int32)
+        return ids[np.argsort(lengths, kind='mergesort')]
+
+    def _match_rank(self, item, q):
+        if item == q:
+            return EXACT
+        if item.startswith(q):
+            return PREFIX
+        start = item.find(q)
+        while start != -1:
+            if (start > 0) and (item[start-1] in _WORD_BREAKS):
+                return WORD_PREFIX
+            start = item.find(q, start + 1)
+        return SUBSTRING
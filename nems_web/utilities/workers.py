@@ -0,0 +1,147 @@
+""" A shared pool of worker processes for CPU-bound work that would otherwise
+hold up the web server's threads (drawing figures, resampling).
+
+Workers are started with 'spawn' rather than forked from the threaded web
+server. A spawned worker imports the parent's main module again (as
+__mp_main__), so any script that starts the app, like nems_web/run.py,
+must only call app.run() under an `if __name__ == '__main__':` guard.
+
+If the pool is disabled (processes=0) or stops working, for example because
+a worker couldn't start, the work is done in the calling thread instead and
+a new pool is started on the next call.
+
+A call that times out keeps running in its worker until it finishes, so
+callers that give up on slow work should recycle() the pool to get the
+worker back.
+"""
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import (
+        ProcessPoolExecutor, CancelledError, TimeoutError,
+        )
+from concurrent.futures.process import BrokenProcessPool
+
+log = logging.getLogger(__name__)
+
+# Number of worker processes. If 0, all work runs in the calling thread.
+WORKER_PROCESSES = 2
+
+
+class WorkerPool():
+    """Runs functions in a lazily started pool of spawned processes, falling
+    back to the calling thread. See the module docstring for details.
+
+    Functions and arguments must be picklable, so functions have to be
+    defined at the top level of a module.
+
+    """
+
+    def __init__(self, processes=WORKER_PROCESSES):
+        self.processes = processes
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def call(self, fn, *args, timeout=None):
+        """Returns fn(*args), run in a worker process if possible.
+
+        Raises concurrent.futures.TimeoutError if the worker doesn't finish
+        within timeout seconds (None to wait as long as it takes).
+        """
+
+        return self.map(fn, [args], timeout=timeout)[0]
+
+    def map(self, fn, arglist, timeout=None):
+        """Returns [fn(*args) for args in arglist], with the calls spread
+        over the worker processes if possible.
+
+        timeout is the number of seconds to wait for all of the calls
+        together. If it runs out, the calls that haven't started are
+        cancelled and concurrent.futures.TimeoutError is raised. Calls that
+        have started keep their workers busy until they finish (see
+        recycle).
+
+        """
+
+        pool = self._get_pool()
+        if pool is None:
+            return [fn(*args) for args in arglist]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            pending = [pool.submit(fn, *args) for args in arglist]
+        except RuntimeError:
+            # The pool is broken (BrokenProcessPool is a RuntimeError) or
+            # was shut down by recycle in another thread.
+            return self._run_here(pool, fn, arglist)
+        try:
+            results = []
+            for f in pending:
+                if deadline is None:
+                    results.append(f.result())
+                else:
+                    results.append(f.result(
+                            timeout=max(0, deadline - time.monotonic())
+                            ))
+            return results
+        except TimeoutError:
+            for f in pending:
+                f.cancel()
+            raise
+        except (BrokenProcessPool, CancelledError):
+            # The pool broke, or another thread recycled it.
+            for f in pending:
+                f.cancel()
+            return self._run_here(pool, fn, arglist)
+
+    def recycle(self):
+        """Stops every worker, including any still busy with calls that
+        timed out, and starts a new pool on the next call. Calls that other
+        threads are waiting on are rerun in those threads.
+        """
+
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+        if pool is None:
+            return
+        log.warning("Recycling worker pool")
+        # ProcessPoolExecutor has no public way to stop a call that's
+        # already running, so its worker processes are stopped directly.
+        workers = list((getattr(pool, '_processes', None) or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for p in workers:
+            p.terminate()
+
+    def shutdown(self):
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def _get_pool(self):
+        if not self.processes:
+            return None
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                        max_workers=self.processes,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        )
+            return self._pool
+
+    def _run_here(self, pool, fn, arglist):
+        log.warning("Worker pool stopped working, running {0} in-process"
+                    .format(getattr(fn, '__name__', fn)))
+        self._reset_pool(pool)
+        return [fn(*args) for args in arglist]
+
+    def _reset_pool(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+
+worker_pool = WorkerPool()